@@ -0,0 +1,4 @@
+"""Benchmarks for the hohgwuhn pipeline, run against local stand-ins for external services.
+
+Run each benchmark from the repository root, e.g. `python -m benchmarks.bench_geocode`.
+"""
@@ -0,0 +1,93 @@
+"""Times diffing snapshots with hohgwuhn/changes.py, and checks the changes it finds.
+
+Each synthetic snapshot is the one before it with a few percent of the schools closed, opened,
+given an address typo, moved to another city (keeping their phone number) or handed to a new
+instructor.  Pass --data-dir ../data to also time the real history.
+
+    python -m benchmarks.bench_changes --schools 1000 100000 --snapshots 4
+"""
+import argparse
+import random
+import time
+
+import pandas as pd
+
+from hohgwuhn import changes, snapshots
+
+from .standins import syntheticSchools
+
+
+def nextSnapshot(school_df, rng, rate, next_id):
+    """Perturb a snapshot, returning it with the number of each change made."""
+    school_df = school_df.copy()
+    count = len(school_df)
+    change_count = max(1, int(count * rate))
+    rows = rng.sample(range(count), 4 * change_count)
+    typo_rows, moved_rows, instructor_rows, closed_rows = (
+        rows[i * change_count:(i + 1) * change_count] for i in range(4))
+
+    def typo(address):
+        i = rng.randrange(len(address) - 1)
+        return address[:i] + address[i + 1] + address[i] + address[i + 2:]
+
+    addresses = school_df['Address'].to_numpy(dtype=object)
+    addresses[typo_rows] = [typo(address) for address in addresses[typo_rows]]
+    school_df['Address'] = addresses
+    school_df.loc[school_df.index[moved_rows], 'City'] = 'Elsewhere %s' % next_id
+    school_df.loc[school_df.index[moved_rows], 'Address'] = [
+        '%s Relocated Ave' % (next_id + i) for i in range(change_count)]
+    school_df.loc[school_df.index[instructor_rows], 'Instructor'] = 'Inst. New'
+    school_df = school_df.drop(index=school_df.index[closed_rows])
+
+    opened = syntheticSchools(change_count, seed=next_id)
+    opened['Address'] = ['%s Opened Rd' % (next_id + i) for i in range(change_count)]
+    opened['Phone #s'] = ['777-%07d' % (next_id + i) for i in range(change_count)]
+    return pd.concat([school_df, opened], ignore_index=True), change_count
+
+
+def timeDiff(old_df, new_df):
+    start = time.perf_counter()
+    diff = changes.diffSnapshots(old_df, new_df)
+    return time.perf_counter() - start, diff
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--schools', type=int, nargs='+', default=[1000, 100000])
+    parser.add_argument('--snapshots', type=int, default=4)
+    parser.add_argument('--rate', type=float, default=0.02,
+                        help='Share of the schools given each kind of change per snapshot')
+    parser.add_argument('--data-dir', help='Also diff the real history in this data/ folder')
+    args = parser.parse_args()
+
+    print('%8s %9s %7s %7s %9s %7s %11s' % (
+        'schools', 'seconds', 'added', 'removed', 'modified', 'moved', 'expected'))
+    for school_count in args.schools:
+        rng = random.Random(school_count)
+        history = [syntheticSchools(school_count, seed=school_count)]
+        expected = []
+        for i in range(args.snapshots - 1):
+            next_df, change_count = nextSnapshot(history[-1], rng, args.rate, (i + 1) * 10 ** 7)
+            history.append(next_df)
+            expected.append(change_count)
+
+        for old_df, new_df, change_count in zip(history, history[1:], expected):
+            seconds, diff = timeDiff(old_df, new_df)
+            summary = diff.summary()
+            print('%8d %9.3f %7d %7d %9d %7d %11s' % (
+                school_count, seconds, summary['added'], summary['removed'],
+                summary['modified'], summary['moved'],
+                '%s/%s/%s/%s' % (change_count, change_count, 3 * change_count, change_count)))
+
+    if args.data_dir:
+        dates = snapshots.listSnapshots(data_dir=args.data_dir)
+        loaded = [changes.loadSnapshot(date, data_dir=args.data_dir) for date in dates]
+        start = time.perf_counter()
+        for old_df, new_df in zip(loaded, loaded[1:]):
+            changes.diffSnapshots(old_df, new_df)
+        print('Real history, %s snapshots: %.3f seconds' % (
+            len(dates), time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""Times building the zoom-level cluster pyramid in hohgwuhn/geovis.py.
+
+Points are scattered around a few hundred random city centres, as schools are.  Reports the
+time to build the pyramid and to write each level as GeoJSON, and how many clusters a front end
+would draw at each zoom compared to the markers it draws today.
+
+    python -m benchmarks.bench_clusters --points 100000 --max-zoom 16
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from hohgwuhn import geovis
+
+
+def syntheticPoints(count, seed=0, city_count=500):
+    """Latitudes and longitudes clustered around random city centres."""
+    rng = np.random.default_rng(seed)
+    city_lat = rng.uniform(-50, 65, city_count)
+    city_lon = rng.uniform(-170, 170, city_count)
+    city = rng.integers(0, city_count, count)
+    return (
+        np.clip(city_lat[city] + rng.normal(0, 0.2, count), -85, 85),
+        np.clip(city_lon[city] + rng.normal(0, 0.2, count), -180, 179.999),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--points', type=int, nargs='+', default=[100000])
+    parser.add_argument('--max-zoom', type=int, default=geovis.CLUSTER_MAX_ZOOM)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    for point_count in args.points:
+        lat, lon = syntheticPoints(point_count)
+        build_seconds = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            levels = geovis.buildClusterPyramid(lat, lon, args.max_zoom)
+            build_seconds.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        level_json = [json.dumps(geovis.clusterFeatures(level)) for level in levels]
+        export_seconds = time.perf_counter() - start
+
+        print('%s points: pyramid of %s levels in %.3f s (best of %s), GeoJSON in %.3f s' % (
+            point_count, len(levels), min(build_seconds), args.repeat, export_seconds))
+        print('%6s %10s %12s' % ('zoom', 'clusters', 'GeoJSON KB'))
+        for zoom, (level, level_text) in enumerate(zip(levels, level_json)):
+            print('%6d %10d %12.1f' % (zoom, len(level['count']), len(level_text) / 1024))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Compares resolving the WKSA country names one by one with country_converter, as
+pullWksaCountryPages used to, against the frozen mapping in hohgwuhn/countries.py.
+
+Each run is a fresh interpreter, so the times and peak memory include importing whatever the
+resolution needs, as on a cold start.
+
+    python -m benchmarks.bench_countries --repeat 3
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+from hohgwuhn import countries
+
+
+MEASURE_SCRIPT = '''
+import json, resource, sys, time
+names = %(names)r
+start = time.perf_counter()
+%(resolve)s
+elapsed = time.perf_counter() - start
+assert codes == %(expected)r, codes
+json.dump({
+    'seconds': elapsed,
+    'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+}, sys.stdout)
+'''
+
+RESOLVERS = {
+    'per name, country_converter': (
+        'import country_converter as coco\n'
+        "codes = [coco.convert(names=[name], to='ISO2') for name in names]"
+    ),
+    'frozen mapping': (
+        'from hohgwuhn.countries import resolveCountryCodes\n'
+        'codes = resolveCountryCodes(names)'
+    ),
+}
+
+
+def measure(resolve, names, expected):
+    """Resolve the names in a fresh interpreter, returning its measurements."""
+    script = MEASURE_SCRIPT % {'names': names, 'resolve': resolve, 'expected': expected}
+    output = subprocess.run(
+        [sys.executable, '-c', script], capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with open(countries.COUNTRY_CODES_FILE, 'r') as codes_file:
+        frozen = json.load(codes_file)
+    # The site lists countries in title case, and a new country shows up now and then
+    known_names = [name.title() for name in frozen]
+    cases = [
+        ('all known', known_names, list(frozen.values())),
+        ('2 unknown', known_names + ['Mexico', 'Portugal'], list(frozen.values()) + ['MX', 'PT']),
+    ]
+
+    print('%-14s %-30s %9s %9s' % ('names', 'resolver', 'seconds', 'peak MB'))
+    for case_name, names, expected in cases:
+        for resolver_name, resolve in RESOLVERS.items():
+            runs = [measure(resolve, names, expected) for _ in range(args.repeat)]
+            print('%-14s %-30s %9.3f %9.1f' % (
+                case_name, resolver_name,
+                statistics.median(run['seconds'] for run in runs),
+                statistics.median(run['max_rss_mb'] for run in runs)))
+
+
+if __name__ == '__main__':
+    main()
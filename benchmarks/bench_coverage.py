@@ -0,0 +1,82 @@
+"""Measures building the nearest-school coverage grid, and looking schools up in it.
+
+For each school count: the time to build the grid, its size on disk and the time to map it back,
+then the latency of single point lookups and the throughput of batched ones, next to the
+SchoolIndex queries they replace.  Cell centers are checked against a brute force scan.
+
+    python -m benchmarks.bench_coverage --schools 330 10000 100000 --resolution 0.25
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from hohgwuhn import coverage, nearest
+
+
+def randomPoints(count, seed):
+    """Uniformly random points on the sphere."""
+    rng = np.random.default_rng(seed)
+    return np.degrees(np.arcsin(rng.uniform(-1, 1, count))), rng.uniform(-180, 180, count)
+
+
+def timeIt(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--schools', type=int, nargs='+', default=[330, 10000, 100000])
+    parser.add_argument('--resolution', type=float, default=0.25)
+    parser.add_argument('--queries', type=int, default=100000)
+    parser.add_argument('--single-queries', type=int, default=2000)
+    parser.add_argument('--check-cells', type=int, default=2000)
+    args = parser.parse_args()
+
+    query_lat, query_lon = randomPoints(args.queries, seed=1)
+    rows, columns = coverage.gridShape(args.resolution)
+    print('%sx%s cells of %.3g degrees' % (rows, columns, 180 / rows))
+    print('%8s %9s %10s %8s %9s %11s %11s %11s' % (
+        'schools', 'build s', 'cells/s', 'MB', 'load ms', 'single us', 'batch us/q',
+        'index us/q'))
+    for school_count in args.schools:
+        school_lat, school_lon = randomPoints(school_count, seed=2)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            grid_file = os.path.join(temp_dir, 'coverage.npy')
+            build_seconds, grid = timeIt(
+                coverage.CoverageGrid.build, school_lat, school_lon, grid_file, args.resolution)
+            size_mb = os.path.getsize(grid_file) / 1e6
+            load_seconds, grid = timeIt(coverage.CoverageGrid.load, grid_file)
+
+            # Cell centers must hold exactly the brute force nearest school
+            rng = np.random.default_rng(3)
+            cells = rng.integers(0, rows * columns, args.check_cells)
+            center_lat = -90 + (cells // columns + 0.5) * 180 / rows
+            center_lon = -180 + (cells % columns + 0.5) * 180 / rows
+            brute_distances, _ = nearest.bruteForceNearest(
+                center_lat, center_lon, school_lat, school_lon)
+            assert np.allclose(
+                grid.cells['km'].ravel()[cells], brute_distances[:, 0], rtol=1e-5)
+
+            start = time.perf_counter()
+            for lat, lon in zip(query_lat[:args.single_queries].tolist(),
+                                query_lon[:args.single_queries].tolist()):
+                grid.lookup(lat, lon)
+            single_seconds = (time.perf_counter() - start) / args.single_queries
+            batch_seconds, _ = timeIt(grid.lookup, query_lat, query_lon)
+            del grid
+
+        index = nearest.SchoolIndex.build(school_lat, school_lon)
+        index_seconds, _ = timeIt(index.nearest, query_lat, query_lon)
+        print('%8d %9.2f %10.0f %8.1f %9.2f %11.1f %11.3f %11.2f' % (
+            school_count, build_seconds, rows * columns / build_seconds, size_mb,
+            load_seconds * 1000, single_seconds * 1e6, batch_seconds / args.queries * 1e6,
+            index_seconds / args.queries * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""Times the offline gazetteer in hohgwuhn/gazetteer.py, and counts the API calls it saves.
+
+A synthetic GeoNames dump holds the cities of the synthetic scrape (all but --missing-rate of
+them) among --cities made up ones.  Reports per-lookup latency percentiles for exact names,
+case / punctuation variants and misspellings (fuzzy matches, cold and then memoized), then
+geocodes the scrape against the fake geocoder with and without the gazetteer.
+
+    python -m benchmarks.bench_gazetteer --cities 200000 --schools 2000 --unknown-rate 0.3
+"""
+import argparse
+import contextlib
+import io
+import random
+import time
+
+import numpy as np
+
+from hohgwuhn import gazetteer as gz
+from hohgwuhn import geocoder_googs as geocoder
+
+from .standins import fakeApiManager, syntheticSchools
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ran', 'sel', 'to', 'vik', 'bur', 'gen', 'dal', 'wa', 'nor']
+
+
+def _geonamesLine(name, country, region, rng):
+    row = [''] * 19
+    row[gz.GEONAMES_NAME] = row[gz.GEONAMES_ASCII_NAME] = name
+    row[gz.GEONAMES_LATITUDE] = '%.5f' % rng.uniform(-60, 70)
+    row[gz.GEONAMES_LONGITUDE] = '%.5f' % rng.uniform(-180, 180)
+    row[gz.GEONAMES_COUNTRY], row[gz.GEONAMES_ADMIN1] = country, region
+    row[gz.GEONAMES_POPULATION] = str(rng.randrange(500, 1000000))
+    return '\t'.join(row)
+
+
+def syntheticGeoNames(school_df, city_count, missing_rate, seed=0):
+    """A GeoNames dump of the scrape's cities, bar missing_rate of them, among made up ones."""
+    rng = random.Random(seed)
+    places = school_df[['Country Code', 'Region', 'City']].drop_duplicates()
+    lines = [
+        _geonamesLine(city, country, region, rng)
+        for country, region, city in places.itertuples(index=False)
+        if rng.random() >= missing_rate
+    ]
+    countries = sorted(places['Country Code'].unique())
+    for _ in range(city_count):
+        name = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randrange(2, 5))).title()
+        lines.append(_geonamesLine(
+            name, rng.choice(countries), 'Region %s' % rng.randrange(50), rng))
+    return '\n'.join(lines)
+
+
+def _misspell(name, rng):
+    position = rng.randrange(1, len(name))
+    return name[:position] + name[position + 1:]
+
+
+def timeLookups(gazetteer, queries):
+    """Microseconds taken by each lookup."""
+    micros = []
+    for query in queries:
+        start = time.perf_counter_ns()
+        gazetteer.lookup(*query)
+        micros.append((time.perf_counter_ns() - start) / 1000)
+    return np.array(micros)
+
+
+def timeGeocode(school_df, gazetteer, latency, qps):
+    """Geocode a fresh copy of the scrape, returning (seconds, API calls, schools found)."""
+    geocode_api = fakeApiManager(latency, qps)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        found = geocoder.geocodeSchools(school_df.copy(), geocode_api, gazetteer=gazetteer)
+    return time.perf_counter() - start, geocode_api.client.calls, found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--cities', type=int, default=200000)
+    parser.add_argument('--schools', type=int, default=2000)
+    parser.add_argument('--unknown-rate', type=float, default=0.3,
+                        help='Share of addresses the geocoder does not find')
+    parser.add_argument('--missing-rate', type=float, default=0.1,
+                        help='Share of the scrape\'s cities left out of the gazetteer')
+    parser.add_argument('--queries', type=int, default=20000)
+    parser.add_argument('--latency', type=float, default=0.01, help='Seconds per API call')
+    parser.add_argument('--qps', type=int, default=200, help='API queries per second limit')
+    args = parser.parse_args()
+
+    school_df = syntheticSchools(args.schools, unknown_rate=args.unknown_rate)
+    cities_txt = syntheticGeoNames(school_df, args.cities, args.missing_rate)
+    start = time.perf_counter()
+    gazetteer = gz.Gazetteer.fromGeoNames(io.StringIO(cities_txt))
+    compile_seconds = time.perf_counter() - start
+
+    npz = io.BytesIO()
+    gazetteer.save(npz)
+    npz.seek(0)
+    start = time.perf_counter()
+    gazetteer = gz.Gazetteer.load(npz)
+    load_seconds = time.perf_counter() - start
+    print('%s cities: compiled in %.2f s, %.1f MB saved, loaded and indexed in %.2f s' % (
+        len(gazetteer), compile_seconds, len(npz.getvalue()) / 1e6, load_seconds))
+
+    rng = random.Random(1)
+    known = [
+        (country, region, city) for country, region, city in zip(
+            gazetteer.country.tolist(), gazetteer.region_keys.tolist(), gazetteer.names.tolist())
+    ]
+    sample = [rng.choice(known) for _ in range(args.queries)]
+    typos = [(country, region, _misspell(city, rng)) for country, region, city in sample[:2000]]
+    cases = {
+        'exact': sample,
+        'case / punctuation': [
+            (country.lower(), region.upper(), ' %s. ' % city.swapcase())
+            for country, region, city in sample
+        ],
+        'misspelt (cold)': typos,
+        'misspelt (memoized)': typos,
+    }
+    print('%-22s %8s %10s %10s %10s' % ('lookup', 'queries', 'p50 us', 'p99 us', 'max us'))
+    for name, queries in cases.items():
+        micros = timeLookups(gazetteer, queries)
+        print('%-22s %8d %10.1f %10.1f %10.1f' % (
+            name, len(queries), np.percentile(micros, 50), np.percentile(micros, 99),
+            micros.max()))
+
+    without_seconds, without_calls, without_found = timeGeocode(
+        school_df, None, args.latency, args.qps)
+    with_seconds, with_calls, with_found = timeGeocode(
+        school_df, gazetteer, args.latency, args.qps)
+    print('%s schools, %.0f%% of addresses unknown to the geocoder:' % (
+        len(school_df), 100 * args.unknown_rate))
+    print('  without gazetteer: %6d API calls, %6d found, %.2f s' % (
+        without_calls, without_found, without_seconds))
+    print('  with gazetteer:    %6d API calls, %6d found, %.2f s' % (
+        with_calls, with_found, with_seconds))
+    print('  API calls saved:   %6d (%.1f%%)' % (
+        without_calls - with_calls, 100 * (without_calls - with_calls) / without_calls))
+
+
+if __name__ == '__main__':
+    main()
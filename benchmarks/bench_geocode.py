@@ -0,0 +1,73 @@
+"""Compares the batched geocoding engine against the original row by row loop.
+
+    python -m benchmarks.bench_geocode --rows 300 --latency 0.05 --qps 50
+"""
+import argparse
+import contextlib
+import io
+import time
+
+from hohgwuhn import geocoder_googs as geocoder
+
+from .standins import fakeApiManager, syntheticSchools
+
+
+def legacyGeocode(school_df, geocode_api):
+    """The original loadSchoolData loop: one blocking lookup (plus fallback) per row."""
+    school_list = []
+    for _, item in school_df.iterrows():
+        geodata = (
+            item['Address'] and geocoder._handleResponse(  # pylint: disable=protected-access
+                geocode_api.get(address=item['Address'], country_code=item['Country Code'])
+            ) or
+            geocoder._handleResponse(  # pylint: disable=protected-access
+                geocode_api.get(
+                    address=('%s, %s' % (item['City'], item['Region'])),
+                    country_code=item['Country Code']
+                ),
+                assure_address=False
+            ))
+        if geodata:
+            school_list.append(geodata)
+    return len(school_list)
+
+
+def timeRun(name, geocode, school_df, latency, qps, **kwargs):
+    """Run one geocoding strategy over a fresh copy of the schools, returning its stats."""
+    geocode_api = fakeApiManager(latency, qps)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        found = geocode(school_df.copy(), geocode_api, **kwargs)
+    elapsed = time.perf_counter() - start
+    return {
+        'name': name,
+        'seconds': elapsed,
+        'rows_per_sec': len(school_df) / elapsed,
+        'api_calls': geocode_api.client.calls,
+        'found': found,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=300)
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds per API call')
+    parser.add_argument('--qps', type=int, default=50, help='API queries per second limit')
+    parser.add_argument('--workers', type=int, default=geocoder.GEOCODE_WORKERS)
+    args = parser.parse_args()
+
+    school_df = syntheticSchools(args.rows)
+    runs = [
+        timeRun('iterrows loop', legacyGeocode, school_df, args.latency, args.qps),
+        timeRun(
+            'batched engine', geocoder.geocodeSchools, school_df, args.latency, args.qps,
+            workers=args.workers),
+    ]
+    for run in runs:
+        print('%-15s %7.2fs %8.1f rows/sec %6d API calls %6d found' % (
+            run['name'], run['seconds'], run['rows_per_sec'], run['api_calls'], run['found']))
+    print('Speedup: %.1fx' % (runs[0]['seconds'] / runs[1]['seconds']))
+
+
+if __name__ == '__main__':
+    main()
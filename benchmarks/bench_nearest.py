@@ -0,0 +1,60 @@
+"""Compares the nearest-school index against a brute force scan of every school.
+
+    python -m benchmarks.bench_nearest --schools 330 10000 100000 --queries 5000 --k 3
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from hohgwuhn import nearest
+
+
+def randomPoints(count, seed):
+    """Uniformly random points on the sphere."""
+    rng = np.random.default_rng(seed)
+    return np.degrees(np.arcsin(rng.uniform(-1, 1, count))), rng.uniform(-180, 180, count)
+
+
+def timeIt(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--schools', type=int, nargs='+', default=[330, 10000, 100000])
+    parser.add_argument('--queries', type=int, default=5000)
+    parser.add_argument('--k', type=int, default=3)
+    parser.add_argument('--radius-km', type=float, default=100)
+    args = parser.parse_args()
+
+    query_lat, query_lon = randomPoints(args.queries, seed=1)
+    print('%8s %9s %9s %11s %11s %11s %8s' % (
+        'schools', 'build s', 'load s', 'knn us/q', 'brute us/q', 'radius us/q', 'speedup'))
+    for school_count in args.schools:
+        school_lat, school_lon = randomPoints(school_count, seed=2)
+        build_seconds, index = timeIt(nearest.SchoolIndex.build, school_lat, school_lon)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            index_path = os.path.join(temp_dir, 'index.npz')
+            index.save(index_path)
+            load_seconds, index = timeIt(nearest.SchoolIndex.load, index_path)
+
+        knn_seconds, (distances, _) = timeIt(index.nearest, query_lat, query_lon, k=args.k)
+        brute_seconds, (brute_distances, _) = timeIt(
+            nearest.bruteForceNearest, query_lat, query_lon, school_lat, school_lon, k=args.k)
+        radius_seconds, _ = timeIt(index.withinRadius, query_lat, query_lon, args.radius_km)
+        assert np.allclose(distances, brute_distances)
+
+        per_query = 1e6 / args.queries
+        print('%8d %9.3f %9.4f %11.1f %11.1f %11.1f %7.1fx' % (
+            school_count, build_seconds, load_seconds, knn_seconds * per_query,
+            brute_seconds * per_query, radius_seconds * per_query, brute_seconds / knn_seconds))
+
+
+if __name__ == '__main__':
+    main()
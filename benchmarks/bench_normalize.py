@@ -0,0 +1,102 @@
+"""Compares the per-country normalization rules against the Korean-only loop they replaced.
+
+Runs both over the same synthetic scrape, where three schools in eight are Korean, checks they
+leave identical schools, and reports schools normalized per second.
+
+    python -m benchmarks.bench_normalize --schools 1000000 --repeat 3
+"""
+import argparse
+import copy
+import re
+import time
+
+from hohgwuhn import normalize
+from hohgwuhn.school import School
+
+
+# (country, code, region, city, address) after phone extraction, like fetchData normalizes them
+TEMPLATES = [
+    ('U.S.A', 'US', 'Arizona', 'Phoenix', '%s W. Desert Hills Phoenix, AZ 85086'),
+    ('KOREA', 'KR', 'Busan', 'Phil',
+     'No.%s Youngdong-Plaza JwaDong Haewoondae-Gu Busan Younggeun Gye'),
+    ('DENMARK', 'DK', 'Jylland', 'Ikast', 'Bogildvej %s 7430 Ikast'),
+    ('KOREA', 'KR', 'Seoul | Gyeonggi | Gangwon', 'Boknam Myuong',
+     '%s 3Ban Youngheung8Ri Youngwol-Eup Youngwol-Gun Gangwon'),
+    ('JAPAN', 'JP', 'Okinawa', 'Kadena', 'Bldg. %s Kadena Air Base'),
+    ('KOREA', 'KR', 'Seoul | Gyeonggi | Gangwon', 'Dong-Gu Daegu', '136-%s Sinam4-Dong'),
+    ('U.S.A', 'US', 'Texas', 'Austin', '%s Congress Ave Austin, TX 78701'),
+    ('GERMANY', 'DE', 'Bayern', 'Munich', 'Leopoldstr. %s 80802 Munich'),
+]
+
+
+def syntheticSchools(count):
+    schools = []
+    for i in range(count):
+        country_name, country_code, region, city, address = TEMPLATES[i % len(TEMPLATES)]
+        schools.append(School(
+            country_name=country_name, country_code=country_code, region=region, city=city,
+            address=address % i))
+    return schools
+
+
+# handleHankuk as it was before the rule engine
+def handleHankukLoop(wksa_schools):
+    for school in wksa_schools:
+        if school.country_code != 'KR':
+            continue
+        city_set = re.sub(r'\s[/|]\s', ' ', school.region).split()
+        if len(city_set) > 1:
+            for region in city_set:
+                if region in school.address:
+                    school.region = region
+        tokenized_address = school.address.split()
+        if school.region == school.address.split()[-1]:
+            new_boundary = school.address.split()[-2]
+            school.address += ' %s' % school.city
+            school.instructor = school.city
+            school.city = new_boundary
+            tokenized_address = school.address.split()
+        elif school.region not in school.address:
+            school.address += ' %s' % school.city
+            school.region = school.city.split()[-1]
+            tokenized_address = school.address.split()
+            school.city = school.address.split()[-2]
+        if school.region == tokenized_address[-3]:
+            school.instructor = ' '.join(tokenized_address[-2:])
+            school.address = ' '.join(tokenized_address[:-2])
+
+
+def bestOf(repeat, function, schools):
+    """Fastest of repeat runs, each on a fresh copy of schools, and the last run's schools."""
+    best = None
+    for _ in range(repeat):
+        run_schools = copy.deepcopy(schools)
+        start = time.perf_counter()
+        function(run_schools)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best, run_schools
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--schools', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    schools = syntheticSchools(args.schools)
+    loop_seconds, loop_schools = bestOf(args.repeat, handleHankukLoop, schools)
+    rule_seconds, rule_schools = bestOf(args.repeat, normalize.normalizeSchools, schools)
+    assert [school.toDict() for school in loop_schools] == [
+        school.toDict() for school in rule_schools]
+
+    korean = sum(1 for school in schools if school.country_code == 'KR')
+    print('%s schools, %s Korean; identical output' % (args.schools, korean))
+    print('%-14s %10s %12s' % ('', 'seconds', 'schools/s'))
+    for name, seconds in [('KR loop', loop_seconds), ('rules', rule_seconds)]:
+        print('%-14s %10.3f %12.0f' % (name, seconds, args.schools / seconds))
+    print('speedup %.2fx' % (loop_seconds / rule_seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""Compares the country page parsers of fetch_wksa (PAGE_PARSERS), BeautifulSoup against lxml
+XPath, on the saved WKSA pages the tests parse.
+
+For each page it reports the parse time, averaged over --repeat parses, and the peak traced
+(Python heap) memory of a single parse.  libxml2 keeps the lxml tree outside the Python heap,
+so the lxml peak leaves it out.
+
+    python -m benchmarks.bench_parsers --repeat 20
+"""
+import argparse
+import glob
+import os
+import time
+import tracemalloc
+
+from hohgwuhn import fetch_wksa
+
+
+PAGE_CORPUS = sorted(glob.glob(os.path.join(
+    os.path.dirname(__file__), '..', 'test', 'test_hohgwuhn', 'pages', '*.html')))
+
+
+def measure(parseSchools, page_body, repeat):
+    """(milliseconds per parse, peak traced KB) of parsing the page."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        parseSchools(page_body, 'COUNTRY', 'US')
+    seconds = (time.perf_counter() - start) / repeat
+
+    tracemalloc.start()
+    parseSchools(page_body, 'COUNTRY', 'US')
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds * 1000, peak_bytes / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    backends = list(fetch_wksa.PAGE_PARSERS)
+    totals = dict.fromkeys(backends, 0.0)
+    print('%-20s %s' % ('page', ' '.join(
+        '%10s %12s' % ('%s ms' % backend, '%s peak KB' % backend) for backend in backends)))
+    for page_path in PAGE_CORPUS:
+        with open(page_path, 'r') as page_file:
+            page_body = page_file.read()
+        results = {
+            backend: measure(fetch_wksa.PAGE_PARSERS[backend], page_body, args.repeat)
+            for backend in backends
+        }
+        for backend in backends:
+            totals[backend] += results[backend][0]
+        print('%-20s %s' % (os.path.basename(page_path), ' '.join(
+            '%10.2f %12.0f' % results[backend] for backend in backends)))
+    print('%-20s %s' % ('total', ' '.join(
+        '%10.2f %12s' % (totals[backend], '') for backend in backends)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Compares memoized, parallel phone number extraction against the original one-by-one loop.
+
+Cold runs start from an empty SQLite store; the warm run reopens the store the cold run saved,
+as the next scrape would.
+
+    python -m benchmarks.bench_phones --schools 20000 --workers 4
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import phonenumbers as libphone
+
+from hohgwuhn import phone_cache
+
+
+TEMPLATES = [
+    ('NEW!!! %s W. Desert Hills Phoenix, AZ 85086  623-337-%04d', 'US'),
+    ('No.%s Youngdong-Plaza JwaDong Haewoondae-Gu Busan 051-701-%04d 018-563-7503', 'KR'),
+    ('Bogildvej %s 7430 Ikast +45 21 45 %04d', 'DK'),
+    ('%s Congress Ave Austin, TX 78701 (512) 555-%04d', 'US'),
+    ('Unit %s, Oak Lane Ipswich IP1 %04d', 'GB'),
+]
+
+
+def syntheticLookups(count, seed=0):
+    """(address, country code) lookups for count schools, each with their own numbers."""
+    rng = random.Random(seed)
+    lookups = []
+    for i in range(count):
+        address, country_code = TEMPLATES[i % len(TEMPLATES)]
+        lookups.append((address % (i, rng.randrange(10000)), country_code))
+    return lookups
+
+
+def originalSplit(lookups):
+    """The loop separatePhoneNumbers ran before memoization."""
+    results = []
+    for address, country_code in lookups:
+        phone_numbers = []
+        phone_index_min = len(address)
+        for match in libphone.PhoneNumberMatcher(address, country_code):
+            phone_numbers.append(
+                str(libphone.format_number(match.number, libphone.PhoneNumberFormat.NATIONAL)))
+            phone_index_min = min(phone_index_min, match.start)
+        results.append((';'.join(phone_numbers), address[:phone_index_min].strip()))
+    return results
+
+
+def memoizedSplit(lookups, cache, workers):
+    results = phone_cache.extractAll(lookups, cache, workers)
+    return [
+        (';'.join(phone_numbers), address[:phone_start].strip())
+        for (address, _), (phone_numbers, phone_start) in zip(lookups, results)
+    ]
+
+
+def timeIt(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--schools', type=int, default=20000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    lookups = syntheticLookups(args.schools)
+    baseline_seconds, expected = timeIt(originalSplit, lookups)
+    print('%-28s %9s %9s' % ('run', 'seconds', 'speedup'))
+    print('%-28s %9.2f %9s' % ('original loop', baseline_seconds, '1.00x'))
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        runs = [
+            ('cold, 1 worker', os.path.join(temp_dir, 'serial.sqlite'), 1),
+            ('cold, %s workers' % args.workers, os.path.join(temp_dir, 'pool.sqlite'),
+             args.workers),
+            ('warm', os.path.join(temp_dir, 'pool.sqlite'), args.workers),
+        ]
+        for name, location, workers in runs:
+            cache = phone_cache.openPhoneCache(location)
+            seconds, result = timeIt(memoizedSplit, lookups, cache, workers)
+            cache.close()
+            assert result == expected
+            print('%-28s %9.2f %8.1fx' % (name, seconds, baseline_seconds / seconds))
+
+
+if __name__ == '__main__':
+    main()
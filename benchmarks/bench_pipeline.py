@@ -0,0 +1,237 @@
+"""Runs the whole fetch -> geocode -> ETL chain offline, against local stand-ins.
+
+    - the WKSA site is a local HTTP server serving the recorded schools in data/school_data.csv,
+      repeated under new addresses beyond the ~330 real ones
+    - the Geocoding API is a FakeGeocodeClient with a fixed latency and QPS limit
+    - GCS buckets are in memory, and Firestore is in memory with a fixed latency per commit
+
+Each scale runs in a fresh interpreter.  For each stage (fetchData, loadSchoolData,
+loadCountryFile) it reports the throughput, latency percentiles of the stage's calls to its
+stand-in service, and the peak RSS while the stage ran.  Results are written as JSON, and can
+be compared against an earlier run to catch regressions:
+
+    python -m benchmarks.bench_pipeline --schools 330 10000 100000 --output pipeline.json
+    python -m benchmarks.bench_pipeline --schools 330 10000 --baseline pipeline.json
+"""
+import argparse
+import contextlib
+from datetime import datetime
+import json
+import os
+import platform
+import re
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from .standins import (
+    FakeGeocodeClient, MemoryFirestore, MemoryStorageClient, SiteServer
+)
+
+
+STAGES = ['fetch', 'geocode', 'etl']
+
+
+def _resetPeakRSS():
+    """Reset the peak RSS of this process (Linux), returning False where that is unsupported."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _memoryMB(field):
+    """Read VmRSS / VmHWM in MB, or fall back to the lifetime peak from getrusage."""
+    try:
+        with open('/proc/self/status', 'r') as status:
+            return int(re.search(r'%s:\s+(\d+)' % field, status.read()).group(1)) / 1024
+    except (OSError, AttributeError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentiles(latencies):
+    """Latency percentiles in milliseconds."""
+    if not latencies:
+        return {}
+    latencies_ms = np.asarray(latencies) * 1000
+    return {
+        'p50': float(np.percentile(latencies_ms, 50)),
+        'p90': float(np.percentile(latencies_ms, 90)),
+        'p99': float(np.percentile(latencies_ms, 99)),
+        'max': float(latencies_ms.max()),
+    }
+
+
+def _timedRequests(session):
+    """Record the latency of every request made through the session."""
+    latencies = []
+    send = session.request
+
+    def timedRequest(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return send(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+    session.request = timedRequest
+    return latencies
+
+
+def _runStage(function, count_schools, latencies):
+    """Run one stage, returning its measurements."""
+    rss_before = _memoryMB('VmRSS')
+    peak_resets = _resetPeakRSS()
+    start = time.perf_counter()
+    result = function()
+    seconds = time.perf_counter() - start
+    school_count = count_schools(result)
+    return {
+        'seconds': seconds,
+        'schools': school_count,
+        'schools_per_sec': school_count / seconds if seconds else 0.0,
+        'calls': len(latencies),
+        'latency_ms': percentiles(latencies),
+        'rss_before_mb': rss_before,
+        # Without a peak reset, this is the peak of the process so far
+        'peak_rss_mb': _memoryMB('VmHWM' if peak_resets else 'ru_maxrss'),
+    }
+
+
+def runScale(school_count, geocode_latency, geocode_qps, commit_latency):
+    """Run the pipeline once over school_count schools, returning the stage measurements."""
+    # Imported here so each stage's modules are loaded in the measured process only
+    # pylint: disable=import-outside-toplevel
+    import googlemaps
+    from hohgwuhn import fetch_wksa, gcs, geocoder_googs, geoetl
+
+    storage_client = MemoryStorageClient()
+    gcs.getClient = lambda: storage_client
+    firestore = MemoryFirestore(commit_latency)
+    geoetl.getFirestore = lambda: firestore
+    geocode_client = FakeGeocodeClient(geocode_latency, geocode_qps)
+    googlemaps.Client = lambda **_: geocode_client
+    os.environ.setdefault('GOOGLE_GEOCODE_API_KEY', 'AIzaBenchmarkOnlyKey')
+    geocoder_googs.GEOCODE_QPS = geocode_qps
+
+    def blobRows(bucket_name):
+        bucket = storage_client.get_bucket(bucket_name)
+        return sum(blob.download_as_string().count(b'\n') - 1 for blob in bucket.list_blobs())
+
+    results = {}
+    with SiteServer(school_count) as site_url, open(os.devnull, 'w') as devnull:
+        fetch_wksa.KSW_SCHOOLS_PAGE = '%s/school-directory/' % site_url
+        page_latencies = _timedRequests(fetch_wksa.getSession())
+
+        with contextlib.redirect_stdout(devnull):
+            results['fetch'] = _runStage(
+                fetch_wksa.fetchData, lambda _: blobRows(gcs.GCLOUD_FETCH_BUCKET),
+                page_latencies)
+            blob_name = storage_client.get_bucket(gcs.GCLOUD_FETCH_BUCKET).list_blobs()[0].name
+
+            results['geocode'] = _runStage(
+                lambda: geocoder_googs.loadSchoolData(blob_name, deadline_seconds=0),
+                lambda _: blobRows(gcs.GCLOUD_GEOCODE_BUCKET), geocode_client.latencies)
+
+            # Count the schools loaded, written or skipped as unchanged
+            results['etl'] = _runStage(
+                lambda: geoetl.loadCountryFile(blob_name), sum, firestore.latencies)
+    return results
+
+
+def _gitCommit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+            check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def compareToBaseline(results, baseline):
+    """Print each stage's time and peak memory relative to a baseline run of the same scale."""
+    baseline_scales = {scale['schools']: scale['stages'] for scale in baseline['scales']}
+    print('\nAgainst %s (%s):' % (
+        baseline.get('git_commit') or 'baseline', baseline['timestamp']))
+    for scale in results['scales']:
+        if scale['schools'] not in baseline_scales:
+            continue
+        for stage in STAGES:
+            now, before = scale['stages'][stage], baseline_scales[scale['schools']][stage]
+            print('%8d %-8s time %+6.1f%%  peak RSS %+6.1f%%' % (
+                scale['schools'], stage,
+                100 * (now['seconds'] / before['seconds'] - 1),
+                100 * (now['peak_rss_mb'] / before['peak_rss_mb'] - 1)))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--schools', type=int, nargs='+', default=[330, 10000])
+    parser.add_argument('--geocode-latency', type=float, default=0.005,
+                        help='Seconds per geocoding call')
+    parser.add_argument('--geocode-qps', type=int, default=2000)
+    parser.add_argument('--commit-latency', type=float, default=0.02,
+                        help='Seconds per Firestore batch commit')
+    parser.add_argument('--output', default='bench_pipeline.json')
+    parser.add_argument('--baseline', help='Earlier --output to compare against')
+    parser.add_argument('--run-scale', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    settings = {
+        'geocode_latency': args.geocode_latency,
+        'geocode_qps': args.geocode_qps,
+        'commit_latency': args.commit_latency,
+    }
+    if args.run_scale:
+        json.dump(runScale(args.run_scale, **settings), sys.stdout)
+        return
+
+    results = {
+        'benchmark': 'pipeline',
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'git_commit': _gitCommit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'settings': settings,
+        'scales': [],
+    }
+    print('%8s %-8s %9s %11s %7s %9s %9s %9s %9s %9s' % (
+        'schools', 'stage', 'seconds', 'schools/s', 'calls', 'p50 ms', 'p90 ms', 'p99 ms',
+        'peak MB', 'growth MB'))
+    for school_count in args.schools:
+        command = [
+            sys.executable, '-m', 'benchmarks.bench_pipeline', '--run-scale', str(school_count),
+            '--geocode-latency', str(args.geocode_latency),
+            '--geocode-qps', str(args.geocode_qps),
+            '--commit-latency', str(args.commit_latency),
+        ]
+        output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+        stages = json.loads(output)
+        results['scales'].append({'schools': school_count, 'stages': stages})
+
+        for stage in STAGES:
+            measured = stages[stage]
+            latency = measured['latency_ms']
+            print('%8d %-8s %9.2f %11.1f %7d %9.2f %9.2f %9.2f %9.1f %9.1f' % (
+                school_count, stage, measured['seconds'], measured['schools_per_sec'],
+                measured['calls'], latency.get('p50', 0), latency.get('p90', 0),
+                latency.get('p99', 0), measured['peak_rss_mb'],
+                measured['peak_rss_mb'] - measured['rss_before_mb']))
+
+    with open(args.output, 'w') as output_file:
+        json.dump(results, output_file, indent=2)
+    print('Wrote %s' % args.output)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as baseline_file:
+            compareToBaseline(results, json.load(baseline_file))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+"""Compares the slotted School record against the plain dicts fetch_wksa used to pass around.
+
+Measures the memory held per record and the throughput of each pipeline stage, on a synthetic
+scrape where every fourth school is Korean.
+
+    python -m benchmarks.bench_records --schools 100000 --phone-schools 10000
+"""
+import argparse
+import copy
+import csv
+import io
+import re
+import time
+import tracemalloc
+
+import phonenumbers as libphone
+
+from hohgwuhn import fetch_wksa as fetch
+from hohgwuhn.school import School
+
+
+TEMPLATES = [
+    ('U.S.A', 'US', 'Arizona', 'Phoenix',
+     'NEW!!! %s W. Desert Hills Phoenix, AZ 85086  623-337-0258', 'Inst. Angela Hoikka'),
+    ('KOREA', 'KR', 'Busan', 'Phil',
+     'No.%s Youngdong-Plaza JwaDong Haewoondae-Gu Busan Younggeun Gye 051-701-5588', ''),
+    ('DENMARK', 'DK', 'Jylland', 'Ikast',
+     'Bogildvej %s 7430 Ikast +45 21 45 67 89', 'Inst. Hansen'),
+    ('U.S.A', 'US', 'Texas', 'Austin', '%s Congress Ave Austin, TX 78701 (512) 555-0199',
+     'Inst. Lee'),
+]
+
+DICT_FIELDS = [
+    'country_name', 'country_code', 'city', 'region',
+    'address', 'website', 'phone_numbers', 'instructor'
+]
+DICT_HEADER = {
+    'country_name': 'Country', 'country_code': 'Country Code', 'region': 'Region',
+    'city': 'City', 'address': 'Address', 'website': 'Website',
+    'phone_numbers': 'Phone #s', 'instructor': 'Instructor'
+}
+
+
+def schoolDicts(count):
+    """Schools as _getSchoolsContent used to return them."""
+    schools = []
+    for i in range(count):
+        country_name, country_code, region, city, address, instructor = TEMPLATES[i % 4]
+        schools.append({
+            'country_name': country_name, 'country_code': country_code, 'region': region,
+            'city': '%s %s' % (city, i), 'website': '', 'address': address % i,
+            'phone_numbers': [], 'instructor': instructor
+        })
+    return schools
+
+
+def schoolRecords(count):
+    """The same schools as School records."""
+    schools = []
+    for i in range(count):
+        country_name, country_code, region, city, address, instructor = TEMPLATES[i % 4]
+        schools.append(School(
+            country_name=country_name, country_code=country_code, region=region,
+            city='%s %s' % (city, i), website='', address=address % i,
+            instructor=instructor
+        ))
+    return schools
+
+
+# The dict versions of the stages, as they were before School
+def separatePhoneNumbersDicts(school_list):
+    for school in school_list:
+        phone_index_min = len(school['address'])
+        for match in libphone.PhoneNumberMatcher(school['address'], school['country_code']):
+            school['phone_numbers'].append(
+                str(libphone.format_number(match.number, libphone.PhoneNumberFormat.NATIONAL)))
+            phone_index_min = min(phone_index_min, match.start)
+        school['phone_numbers'] = ';'.join(school['phone_numbers'])
+        school['address'] = school['address'][:phone_index_min].strip()
+
+
+def handleHankukDicts(wksa_schools):
+    for school in wksa_schools:
+        if school['country_code'] != 'KR':
+            continue
+        city_set = re.sub(r'\s[/|]\s', ' ', school['region']).split()
+        if len(city_set) > 1:
+            for region in city_set:
+                if region in school['address']:
+                    school['region'] = region
+        tokenized_address = school['address'].split()
+        if school['region'] == school['address'].split()[-1]:
+            new_boundary = school['address'].split()[-2]
+            school['address'] += ' %s' % school['city']
+            school['instructor'] = school['city']
+            school['city'] = new_boundary
+            tokenized_address = school['address'].split()
+        elif school['region'] not in school['address']:
+            school['address'] += ' %s' % school['city']
+            school['region'] = school['city'].split()[-1]
+            tokenized_address = school['address'].split()
+            school['city'] = school['address'].split()[-2]
+        if school['region'] == tokenized_address[-3]:
+            school['instructor'] = ' '.join(tokenized_address[-2:])
+            school['address'] = ' '.join(tokenized_address[:-2])
+
+
+def exportDicts(school_list):
+    csvout = io.StringIO()
+    writer = csv.DictWriter(csvout, DICT_FIELDS, lineterminator='\n')
+    writer.writerow(DICT_HEADER)
+    for school in school_list:
+        writer.writerow(school)
+    return csvout.getvalue()
+
+
+def exportRecords(school_list):
+    """Run the real exportCSV, capturing the file instead of uploading it."""
+    captured = {}
+
+    class CapturingBlob:
+        def upload_from_string(self, data, **_):
+            captured['csv'] = data.decode()
+
+    class CapturingBucket:
+        def blob(self, _name):
+            return CapturingBlob()
+
+    original = fetch.gcs.getFetchBucket
+    fetch.gcs.getFetchBucket = CapturingBucket
+    try:
+        fetch.exportCSV(school_list, streaming=False)
+    finally:
+        fetch.gcs.getFetchBucket = original
+    return captured['csv']
+
+
+def heldBytes(build, count):
+    """Bytes held per record by the list build() returns."""
+    tracemalloc.start()
+    schools = build(count)
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del schools
+    return held / count
+
+
+def timeIt(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--schools', type=int, default=100000)
+    parser.add_argument(
+        '--phone-schools', type=int, default=10000,
+        help='schools run through phone extraction, which is dominated by phonenumbers')
+    args = parser.parse_args()
+
+    print('Bytes per record: dict %.0f, School %.0f' % (
+        heldBytes(schoolDicts, args.schools), heldBytes(schoolRecords, args.schools)))
+
+    stages = [
+        ('build', schoolDicts, schoolRecords, args.schools),
+        ('separatePhoneNumbers', separatePhoneNumbersDicts,
+         lambda schools: fetch.separatePhoneNumbers(schools, workers=1),
+         args.phone_schools),
+        ('handleHankuk', handleHankukDicts, fetch.handleHankuk, args.schools),
+        ('exportCSV', exportDicts, exportRecords, args.schools),
+    ]
+    # Every stage after build starts from phone-extracted schools, like the real pipeline
+    dict_schools = schoolDicts(args.schools)
+    record_schools = schoolRecords(args.schools)
+    separatePhoneNumbersDicts(dict_schools)
+    fetch.separatePhoneNumbers(record_schools)
+
+    print('%-22s %12s %12s %9s' % ('stage', 'dict k/s', 'School k/s', 'speedup'))
+    for name, dict_stage, record_stage, count in stages:
+        if name == 'build':
+            dict_args, record_args = (count,), (count,)
+        elif name == 'separatePhoneNumbers':
+            dict_args = (schoolDicts(count),)
+            record_args = (schoolRecords(count),)
+        else:
+            dict_args = (copy.deepcopy(dict_schools),)
+            record_args = (copy.deepcopy(record_schools),)
+
+        dict_seconds, dict_result = timeIt(dict_stage, *dict_args)
+        record_seconds, record_result = timeIt(record_stage, *record_args)
+        if name == 'exportCSV':
+            assert dict_result == record_result
+        print('%-22s %12.1f %12.1f %8.2fx' % (
+            name, count / dict_seconds / 1000, count / record_seconds / 1000,
+            dict_seconds / record_seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Compares the adaptive request scheduler against a fixed pool of plain requests.
+
+Both fetch the same pages from a local stand-in for a struggling WKSA site, which slows down
+past its capacity, sheds load with 503 + Retry-After, throws random 5xx errors and stalls on a
+few requests.  The fixed pool sends `--workers` requests at once with a timeout and no retries,
+as the scraper used to; the scheduler adapts how many it sends, within the same pool.
+
+    python -m benchmarks.bench_scheduler --pages 400 --workers 16 --capacity 4
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import os
+import time
+
+import requests
+
+from hohgwuhn import scheduler
+from .standins import FlakySiteServer
+
+
+def fetchFixed(urls, workers, timeout):
+    """Fetch with a fixed number of requests in flight, counting the pages that failed."""
+    session = requests.Session()
+
+    def fetchOne(url):
+        try:
+            return session.get(url, timeout=timeout).status_code == 200
+        except requests.RequestException:
+            return False
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        fetched = list(executor.map(fetchOne, urls))
+    return {'fetched': sum(fetched), 'attempts': len(urls), 'retries': 0}
+
+
+def fetchScheduled(urls, workers, timeout):
+    """Fetch through a RequestScheduler, over the same pool."""
+    run_scheduler = scheduler.RequestScheduler(
+        workers, timeout=timeout, backoff_seconds=0.1, slow_seconds=timeout / 2)
+    session = run_scheduler.wrap(requests.Session())
+
+    def fetchOne(url):
+        try:
+            return session.get(url).status_code == 200
+        except scheduler.FetchFailed:
+            return False
+
+    # Quiet the retry messages
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            fetched = list(executor.map(fetchOne, urls))
+        stats = run_scheduler.report()
+    return {
+        'fetched': sum(fetched), 'attempts': stats['attempts'], 'retries': stats['retries'],
+        'limit': stats['limit'], 'decreases': stats['decreases'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pages', type=int, default=400)
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--capacity', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--error-rate', type=float, default=0.05)
+    parser.add_argument('--spike-rate', type=float, default=0.02)
+    parser.add_argument('--spike-seconds', type=float, default=2.0)
+    parser.add_argument('--timeout', type=float, default=1.0)
+    args = parser.parse_args()
+
+    print('%-10s %8s %8s %9s %8s %10s %7s' % (
+        'fetcher', 'fetched', 'failed', 'attempts', 'seconds', 'pages/s', 'limit'))
+    for name, fetch in [('fixed', fetchFixed), ('scheduler', fetchScheduled)]:
+        with FlakySiteServer(args.latency, args.capacity, args.error_rate, args.spike_rate,
+                             args.spike_seconds) as site_url:
+            urls = ['%s/page/%s' % (site_url, page) for page in range(args.pages)]
+            start = time.perf_counter()
+            result = fetch(urls, args.workers, args.timeout)
+            seconds = time.perf_counter() - start
+        print('%-10s %8d %8d %9d %8.2f %10.1f %7s' % (
+            name, result['fetched'], args.pages - result['fetched'], result['attempts'],
+            seconds, result['fetched'] / seconds,
+            '%.1f' % result['limit'] if 'limit' in result else '-'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""Compares loading the scrape history from the CSVs against the memory-mapped Arrow snapshots.
+
+By default a synthetic history is generated; pass --data-dir ../data to use the real one.
+
+    python -m benchmarks.bench_snapshots --snapshots 24 --schools 20000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import pandas as pd
+
+from hohgwuhn import snapshots
+
+from .standins import syntheticSchools
+
+
+def writeSyntheticHistory(data_dir, snapshot_count, school_count):
+    """Write snapshot_count dated geodata CSVs of school_count schools each."""
+    for i in range(snapshot_count):
+        school_df = syntheticSchools(school_count, seed=i)
+        school_df['Latitude'] = [round(40 + (j % 1000) / 100, 7) for j in range(school_count)]
+        school_df['Longitude'] = [round(-100 + (j % 777) / 100, 7) for j in range(school_count)]
+        school_df['Geocode Type'] = 'ROOFTOP'
+        school_df['Google Address'] = school_df['Address'] + ', USA'
+
+        snapshot_dir = os.path.join(data_dir, '2020-%02d-01' % (i + 1))
+        os.makedirs(snapshot_dir)
+        school_df.to_csv(os.path.join(snapshot_dir, 'school_geodata.csv'), index=False)
+
+
+def measure(function):
+    """Run function, returning (seconds, result)."""
+    start = time.perf_counter()
+    result = function()
+    return time.perf_counter() - start, result
+
+
+def loadCSVHistory(data_dir, columns=None):
+    """What the notebook does today: parse every CSV with default dtypes."""
+    return pd.concat([
+        pd.read_csv(
+            os.path.join(data_dir, date, 'school_geodata.csv'),
+            usecols=lambda column: columns is None or column in columns)
+        for date in snapshots.listSnapshots(data_dir=data_dir)
+    ], ignore_index=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--data-dir', help='Use an existing data/ folder')
+    parser.add_argument('--snapshots', type=int, default=24)
+    parser.add_argument('--schools', type=int, default=20000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        data_dir = args.data_dir
+        if not data_dir:
+            data_dir = temp_dir
+            writeSyntheticHistory(data_dir, args.snapshots, args.schools)
+
+        dates = snapshots.listSnapshots(data_dir=data_dir)
+        convert_seconds, _ = measure(
+            lambda: [snapshots.convertSnapshot(date, data_dir=data_dir) for date in dates])
+        print('Converted %s snapshots in %.2fs (one time cost)' % (len(dates), convert_seconds))
+
+        projection = ['City', 'Region', 'Latitude', 'Longitude']
+        runs = [
+            ('CSV, all columns', lambda: loadCSVHistory(data_dir)),
+            ('Arrow, all columns', lambda: snapshots.loadHistory(data_dir=data_dir)),
+            ('CSV, 4 columns', lambda: loadCSVHistory(data_dir, projection)),
+            ('Arrow, 4 columns', lambda: snapshots.loadHistory(
+                columns=projection, data_dir=data_dir)),
+            ('Arrow tables, mmap', lambda: [
+                table for _, table in snapshots.iterSnapshots(data_dir=data_dir)]),
+        ]
+        print('%-20s %9s %12s %9s' % ('load', 'seconds', 'result MB', 'rows'))
+        for name, load in runs:
+            seconds, result = measure(load)
+            if isinstance(result, pd.DataFrame):
+                rows = len(result)
+                result_mb = result.memory_usage(deep=True).sum() / 1024 / 1024
+            else:
+                rows = sum(table.num_rows for table in result)
+                result_mb = 0.0  # Mapped from the page cache, not allocated
+            print('%-20s %9.3f %12.1f %9d' % (name, seconds, result_mb, rows))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Measures the cold start cost of each Cloud Function entry point in main.py.
+
+Each entry point is measured in a fresh interpreter: the time to import main.py plus the modules
+the function imports when called, and the peak resident memory afterwards.  The `eager` row
+imports everything up front, as main.py used to.
+
+    python -m benchmarks.bench_startup --repeat 5
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+
+# The modules each function in main.py imports when it is called
+ENTRY_POINT_IMPORTS = {
+    'fetchData': ['sendgrid', 'sendgrid.helpers.mail', 'hohgwuhn.fetch_wksa'],
+    'geocodeFile': ['hohgwuhn.geocoder_googs'],
+    'geoETL': ['hohgwuhn.geoetl'],
+}
+ENTRY_POINT_IMPORTS['eager'] = [
+    module for modules in ENTRY_POINT_IMPORTS.values() for module in modules
+]
+
+# Creating the clients needs credentials, so their cost is only measured when asked for
+ENTRY_POINT_CLIENTS = {
+    'fetchData': ['hohgwuhn.gcs:getClient'],
+    'geocodeFile': ['hohgwuhn.gcs:getClient'],
+    'geoETL': ['hohgwuhn.gcs:getClient', 'hohgwuhn.geoetl:getFirestore'],
+}
+ENTRY_POINT_CLIENTS['eager'] = ENTRY_POINT_CLIENTS['geoETL']
+
+MEASURE_SCRIPT = '''
+import importlib, json, resource, sys, time
+start = time.perf_counter()
+import main
+for module in %(modules)r:
+    importlib.import_module(module)
+for client in %(clients)r:
+    module, function = client.split(':')
+    getattr(importlib.import_module(module), function)()
+elapsed = time.perf_counter() - start
+json.dump({
+    'seconds': elapsed,
+    'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'modules_loaded': len(sys.modules),
+}, sys.stdout)
+'''
+
+
+def measureEntryPoint(entry_point, with_clients=False):
+    """Measure one cold start of the entry point in a fresh interpreter."""
+    script = MEASURE_SCRIPT % {
+        'modules': ENTRY_POINT_IMPORTS[entry_point],
+        'clients': ENTRY_POINT_CLIENTS[entry_point] if with_clients else [],
+    }
+    output = subprocess.run(
+        [sys.executable, '-c', script], check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument(
+        '--with-clients', action='store_true', help='Also create the GCS/Firestore clients')
+    args = parser.parse_args()
+
+    print('%-12s %10s %12s %8s' % ('entry point', 'import s', 'max RSS MB', 'modules'))
+    for entry_point in ENTRY_POINT_IMPORTS:
+        runs = [measureEntryPoint(entry_point, args.with_clients) for _ in range(args.repeat)]
+        print('%-12s %10.3f %12.1f %8d' % (
+            entry_point,
+            statistics.median(run['seconds'] for run in runs),
+            statistics.median(run['max_rss_mb'] for run in runs),
+            runs[0]['modules_loaded'],
+        ))
+
+
+if __name__ == '__main__':
+    main()
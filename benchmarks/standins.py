@@ -0,0 +1,487 @@
+"""Local stand-ins for the external services the pipeline talks to."""
+from collections import deque
+import csv
+from datetime import datetime, timezone
+import html
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import multiprocessing
+import os
+import random
+import threading
+import time
+from urllib.parse import parse_qs
+
+import pandas as pd
+
+from hohgwuhn import geocoder_googs as geocoder
+
+
+class FakeGeocodeClient:
+    """Stands in for googlemaps.Client, with a fixed latency per call and a QPS limit.
+
+    Addresses containing 'unknown' are not found, so the City/Region fallback gets exercised.
+    """
+    def __init__(self, latency=0.05, queries_per_second=30):
+        self.latency = latency
+        self.queries_per_second = queries_per_second
+        self.calls = 0
+        # Seconds each call took, as seen by the caller, including any throttling
+        self.latencies = []
+        self._sent_times = deque(maxlen=queries_per_second)
+        self._lock = threading.Lock()
+
+    def _throttle(self):
+        with self._lock:
+            if len(self._sent_times) == self.queries_per_second:
+                elapsed = time.time() - self._sent_times[0]
+                if elapsed < 1:
+                    time.sleep(1 - elapsed)
+            self._sent_times.append(time.time())
+            self.calls += 1
+
+    def geocode(self, address, components, **_):
+        """Answer a geocoding query after the configured latency."""
+        start = time.perf_counter()
+        self._throttle()
+        time.sleep(self.latency)
+        self.latencies.append(time.perf_counter() - start)
+        if 'unknown' in address:
+            return []
+        seed = random.Random('%s|%s' % (address, components['country']))
+        return [{
+            'formatted_address': 'Geocoded %s' % address,
+            'geometry': {
+                'location': {'lat': seed.uniform(-60, 70), 'lng': seed.uniform(-180, 180)},
+                'location_type': 'ROOFTOP' if ',' not in address else 'APPROXIMATE',
+            },
+        }]
+
+
+def fakeApiManager(latency=0.05, queries_per_second=30, cache=None):
+    """Build a LimitedApiManager that talks to a FakeGeocodeClient."""
+    os.environ.setdefault('GOOGLE_GEOCODE_API_KEY', 'AIzaBenchmarkOnlyKey')
+    api_manager = geocoder.LimitedApiManager(queries_per_second, cache=cache)
+    api_manager.client = FakeGeocodeClient(latency, queries_per_second)
+    return api_manager
+
+
+def syntheticSchools(count, seed=0, unknown_rate=0.1, city_count=None):
+    """Build a scraped school DataFrame with the exportCSV columns.
+
+    Some addresses are unknown to the fake geocoder, and cities repeat, so runs include both
+    City/Region fallbacks and duplicate queries.
+    """
+    rng = random.Random(seed)
+    city_count = city_count or max(1, count // 5)
+    countries = [('U.S.A.', 'US'), ('DENMARK', 'DK'), ('KOREA', 'KR'), ('JAPAN', 'JP')]
+    rows = []
+    for i in range(count):
+        country_name, country_code = countries[i % len(countries)]
+        city_id = rng.randrange(city_count)
+        rows.append({
+            'Country': country_name,
+            'Country Code': country_code,
+            'City': 'City %s' % city_id,
+            'Region': 'Region %s' % (city_id % 50),
+            'Address': '%s %s St%s' % (
+                i, rng.choice(['Main', 'Oak', 'Elm']),
+                ' unknown' if rng.random() < unknown_rate else ''),
+            'Website': '',
+            'Phone #s': '555-%04d' % i,
+            'Instructor': 'Inst. %s' % i,
+        })
+    return pd.DataFrame(rows)
+
+
+class MemoryBlob:
+    """In-memory stand-in for a GCS blob, supporting whole and streamed reads and writes."""
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+
+    @property
+    def size(self):
+        return len(self.bucket.objects[self.name])
+
+    @property
+    def updated(self):
+        return self.bucket.updated[self.name]
+
+    def exists(self):
+        return self.name in self.bucket.objects
+
+    def upload_from_string(self, data, content_type=None):
+        # pylint: disable=unused-argument
+        self.bucket.store(self.name, data.encode() if isinstance(data, str) else data)
+
+    def download_as_string(self):
+        return self.bucket.objects[self.name]
+
+    def open(self, mode, chunk_size=None, newline=None, content_type=None):
+        # pylint: disable=unused-argument
+        if mode == 'r':
+            return io.StringIO(self.download_as_string().decode(), newline=newline)
+        blob = self
+
+        class BlobWriter(io.StringIO):
+            def close(self):
+                if not self.closed:
+                    blob.upload_from_string(self.getvalue())
+                super().close()
+        return BlobWriter()
+
+    def delete(self):
+        self.bucket.objects.pop(self.name, None)
+
+
+class MemoryBucket:
+    """In-memory stand-in for a GCS bucket."""
+    def __init__(self, name):
+        self.name = name
+        self.objects = {}
+        self.updated = {}
+        self._lock = threading.Lock()
+
+    def store(self, blob_name, data):
+        with self._lock:
+            self.objects[blob_name] = data
+            self.updated[blob_name] = datetime.now(timezone.utc)
+
+    def blob(self, blob_name):
+        return MemoryBlob(self, blob_name)
+
+    def get_blob(self, blob_name):
+        return MemoryBlob(self, blob_name) if blob_name in self.objects else None
+
+    def list_blobs(self, prefix=''):
+        return [
+            MemoryBlob(self, blob_name) for blob_name in sorted(self.objects)
+            if blob_name.startswith(prefix)
+        ]
+
+
+class MemoryStorageClient:
+    """In-memory stand-in for storage.Client, creating buckets on first use."""
+    def __init__(self):
+        self.buckets = {}
+
+    def get_bucket(self, bucket_name):
+        return self.buckets.setdefault(bucket_name, MemoryBucket(bucket_name))
+
+
+class MemoryFirestore:
+    """In-memory stand-in for firestore.Client, with a fixed latency per batch commit."""
+    def __init__(self, commit_latency=0.0):
+        self.commit_latency = commit_latency
+        self.documents = {}
+        # Seconds each batch commit took
+        self.latencies = []
+        self.lock = threading.Lock()
+
+    def collection(self, name):
+        return _MemoryCollection(self, name)
+
+    def batch(self):
+        return _MemoryBatch(self)
+
+
+class _MemorySnapshot:
+    def __init__(self, data, document_id=None):
+        self.id = document_id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data) if self.exists else None
+
+
+class _MemoryDocument:
+    def __init__(self, client, path):
+        self.client = client
+        self.path = path
+
+    def collection(self, name):
+        return _MemoryCollection(self.client, '%s/%s' % (self.path, name))
+
+    def get(self):
+        return _MemorySnapshot(self.client.documents.get(self.path))
+
+    def set(self, data):
+        with self.client.lock:
+            self.client.documents[self.path] = dict(data)
+
+    def delete(self):
+        with self.client.lock:
+            self.client.documents.pop(self.path, None)
+
+
+class _MemoryCollection:
+    def __init__(self, client, path):
+        self.client = client
+        self.path = path
+
+    def document(self, document_id):
+        return _MemoryDocument(self.client, '%s/%s' % (self.path, document_id))
+
+    def select(self, field_paths):
+        return _MemoryQuery(self, field_paths)
+
+
+class _MemoryQuery:
+    """A projection of every document of a collection."""
+    def __init__(self, collection, field_paths):
+        self.collection = collection
+        self.field_paths = field_paths
+
+    def stream(self):
+        prefix = self.collection.path + '/'
+        with self.collection.client.lock:
+            documents = list(self.collection.client.documents.items())
+        for path, data in documents:
+            if path.startswith(prefix) and '/' not in path[len(prefix):]:
+                yield _MemorySnapshot(
+                    {field: data[field] for field in self.field_paths if field in data},
+                    path[len(prefix):])
+
+
+class _MemoryBatch:
+    def __init__(self, client):
+        self.client = client
+        self.writes = []
+
+    def set(self, document_ref, data):
+        self.writes.append((document_ref, data))
+
+    def delete(self, document_ref):
+        self.writes.append((document_ref, None))
+
+    def commit(self):
+        start = time.perf_counter()
+        if len(self.writes) > 500:
+            raise ValueError('maximum 500 writes allowed per request')
+        time.sleep(self.client.commit_latency)
+        for document_ref, data in self.writes:
+            if data is None:
+                document_ref.delete()
+            else:
+                document_ref.set(data)
+        with self.client.lock:
+            self.client.latencies.append(time.perf_counter() - start)
+
+
+# Scraped schools the synthetic WKSA site is built from, as exported by fetch_wksa
+RECORDED_SCHOOLS_FILE = os.path.join(
+    os.path.dirname(__file__), '..', 'data', 'school_data.csv')
+
+# fetch_wksa navigates US regions by POSTing these
+US_GEO_IDS = range(1, 4 + 1)
+
+
+def _slug(country_name):
+    return ''.join(c for c in country_name.lower().replace(' ', '-') if c.isalnum() or c == '-')
+
+
+def _schoolHtml(school):
+    city = html.escape(school['City'])
+    if school['Website'].strip():
+        city = '<a href="%s">%s</a>' % (html.escape(school['Website'].strip()), city)
+    phone_numbers = ''.join(
+        '<br />%s' % html.escape(phone) for phone in school['Phone #s'].split(';') if phone)
+    return (
+        '<div class="school"><div class="city">%s</div>'
+        '<div class="contact">%s%s</div>'
+        '<div class="instructor">%s</div></div>\n' % (
+            city, html.escape(school['Address']), phone_numbers,
+            html.escape(school['Instructor']))
+    )
+
+
+def _countryPageHtml(schools):
+    sections = []
+    region = None
+    for school in sorted(schools, key=lambda school: school['Region']):
+        if school['Region'] != region:
+            region = school['Region']
+            sections.append('<div class="region_name">%s</div>\n' % html.escape(region.upper()))
+        sections.append(_schoolHtml(school))
+    return (
+        '<html><body><div class="schools_content">\n%s</div></body></html>' % ''.join(sections))
+
+
+def sitePages(school_count, site_url):
+    """Build the WKSA school directory for school_count schools, as {(method, path): html}.
+
+    The first schools are the recorded ones, exactly as scraped.  Beyond that, recorded schools
+    are repeated under new unit numbers, so every school has its own address.
+    """
+    with open(RECORDED_SCHOOLS_FILE, 'r') as schools_file:
+        recorded = list(csv.DictReader(schools_file))
+
+    countries = {}
+    for i in range(school_count):
+        school = dict(recorded[i % len(recorded)])
+        if i >= len(recorded):
+            school['Address'] = 'Unit %s, %s' % (i // len(recorded), school['Address'])
+        countries.setdefault(school['Country'], []).append(school)
+
+    pages = {}
+    navigation = []
+    for country_name, schools in countries.items():
+        path = '/school-directory/%s/' % _slug(country_name)
+        navigation.append('<li><a href="%s%s">%s</a></li>' % (
+            site_url, path, html.escape(country_name)))
+        if schools[0]['Country Code'] == 'US':
+            # Regions are split across the POSTed pages in order
+            schools.sort(key=lambda school: school['Region'])
+            per_page = -(-len(schools) // len(US_GEO_IDS))
+            for page, geo_id in enumerate(US_GEO_IDS):
+                pages[('POST', '%s?geo_id=%s' % (path, geo_id))] = _countryPageHtml(
+                    schools[page * per_page:(page + 1) * per_page])
+        else:
+            pages[('GET', path)] = _countryPageHtml(schools)
+
+    pages[('GET', '/school-directory/')] = (
+        '<html><body><ul id="menu-schools-submenu">%s</ul></body></html>' % ''.join(navigation))
+    return pages
+
+
+class _SiteHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    pages = {}
+
+    def _respond(self, page_key):
+        body = self.pages.get(page_key)
+        if body is None:
+            self.send_error(404)
+            return
+        body = body.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        self._respond(('GET', self.path))
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        form = parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode())
+        self._respond(('POST', '%s?geo_id=%s' % (self.path, form['geo_id'][0])))
+
+    def log_message(self, *_):
+        pass
+
+
+def _serveSite(school_count, ready):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _SiteHandler)
+    site_url = 'http://127.0.0.1:%s' % server.server_address[1]
+    _SiteHandler.pages = sitePages(school_count, site_url)
+    ready.put(site_url)
+    server.serve_forever()
+
+
+class SiteServer:
+    """Serves a synthetic WKSA site over local HTTP, from its own process.
+
+    The pages live in the server process, so they do not count against the memory of the
+    process being measured.
+
+        with SiteServer(330) as site_url:
+            fetch_wksa.KSW_SCHOOLS_PAGE = site_url + '/school-directory/'
+    """
+    def __init__(self, school_count):
+        self.school_count = school_count
+        self.process = None
+
+    def __enter__(self):
+        ready = multiprocessing.Queue()
+        self.process = multiprocessing.Process(
+            target=_serveSite, args=(self.school_count, ready), daemon=True)
+        self.process.start()
+        return ready.get(timeout=120)
+
+    def __exit__(self, *_):
+        self.process.terminate()
+        self.process.join()
+
+
+class _FlakyHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    settings = {}
+    lock = threading.Lock()
+    in_flight = 0
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        settings = self.settings
+        with self.lock:
+            _FlakyHandler.in_flight += 1
+            overload = max(0, _FlakyHandler.in_flight - settings['capacity'])
+        try:
+            # Past its capacity the site slows down with every extra request, then sheds load
+            if overload > settings['capacity']:
+                status, headers, delay = 503, {'Retry-After': '1'}, settings['latency']
+            elif random.random() < settings['error_rate']:
+                status, headers, delay = random.choice([500, 502, 503]), {}, settings['latency']
+            else:
+                status, headers = 200, {}
+                delay = settings['latency'] * (1 + overload)
+                if random.random() < settings['spike_rate']:
+                    delay += settings['spike_seconds']
+            time.sleep(delay)
+        finally:
+            with self.lock:
+                _FlakyHandler.in_flight -= 1
+
+        body = ('<html><body>page %s</body></html>' % self.path).encode()
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, *_):
+        pass
+
+
+def _serveFlakySite(settings, ready):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _FlakyHandler)
+    server.daemon_threads = True
+    _FlakyHandler.settings = settings
+    ready.put('http://127.0.0.1:%s' % server.server_address[1])
+    server.serve_forever()
+
+
+class FlakySiteServer:
+    """Serves pages over local HTTP like a struggling WKSA site, from its own process.
+
+    Each page takes `latency` seconds, plus `spike_seconds` for a `spike_rate` share of them,
+    and fails with a 5xx for an `error_rate` share.  Beyond `capacity` requests at once, every
+    extra request slows all of them down, and beyond twice that the site answers 503 with a
+    Retry-After.
+
+        with FlakySiteServer(capacity=4, error_rate=0.05) as site_url:
+            requests.get(site_url + '/page/1')
+    """
+    def __init__(self, latency=0.02, capacity=4, error_rate=0.05, spike_rate=0.02,
+                 spike_seconds=2.0):
+        self.settings = {
+            'latency': latency, 'capacity': capacity, 'error_rate': error_rate,
+            'spike_rate': spike_rate, 'spike_seconds': spike_seconds,
+        }
+        self.process = None
+
+    def __enter__(self):
+        ready = multiprocessing.Queue()
+        self.process = multiprocessing.Process(
+            target=_serveFlakySite, args=(self.settings, ready), daemon=True)
+        self.process.start()
+        return ready.get(timeout=120)
+
+    def __exit__(self, *_):
+        self.process.terminate()
+        self.process.join()
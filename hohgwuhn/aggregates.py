@@ -0,0 +1,194 @@
+"""Precomputed read-model documents for a scrape_record, so a page load reads a handful of
+documents rather than every school_location.
+
+loadCountryFile collects a few columns of each school as it streams the geodata file, and
+computes these documents from them with NumPy once the file is read.  They are written to the
+record's `aggregate` subcollection, and listed in the record's `aggregates` field:
+
+================
+aggregate
+----------------
+- countries: schools and located (with coordinates) counts, centroid and bounding box of every
+  country, plus the totals for the record
+- regions-<ISO-2>: the same per region of a country ('XX' for schools without a country code)
+- points-<nnnn>: the ids (school_location document ids) and coordinates of up to
+  POINTS_PER_DOCUMENT located schools, packed: 'ids' joins the ids with newlines, and 'lat_lon'
+  holds (lat, lon) pairs as little-endian int32 of degrees * POINT_SCALE
+================
+
+Centroids are the normalized mean of the schools' unit vectors, so they are right across the
+antimeridian; bounding boxes ([south, west, north, east]) are plain min / max.
+"""
+import os
+
+import numpy as np
+
+from .nearest import toUnitVectors
+
+
+# Firestore documents hold at most 1 MiB; each point takes 8 bytes plus its id
+POINTS_PER_DOCUMENT = int(os.environ.get('FIRESTORE_POINTS_PER_DOCUMENT', 10000))
+POINT_SCALE = 100000
+
+
+class GeoColumns:
+    """The columns of a scrape's schools the read models are computed from, appended per
+    school."""
+    def __init__(self):
+        self.school_ids = []
+        self.country_codes = []
+        self.regions = []
+        self.lats = []
+        self.lons = []
+
+    def add(self, school_id, country_code, region, lat, lon):
+        self.school_ids.append(school_id)
+        self.country_codes.append(country_code)
+        self.regions.append(region)
+        self.lats.append(lat)
+        self.lons.append(lon)
+
+    def __len__(self):
+        return len(self.school_ids)
+
+    def documents(self):
+        """Compute the read-model documents, as a dict of document id -> document."""
+        return readModels(
+            self.school_ids, self.country_codes, self.regions, self.lats, self.lons)
+
+
+def parseCoordinates(values):
+    """Convert coordinate strings to floats, NaN where blank or not a number."""
+    values = np.char.strip(np.asarray(values, dtype=str))
+    try:
+        # The common case: every value is a number or blank
+        return np.where(values == '', 'nan', values).astype(np.float64)
+    except ValueError:
+        pass
+    parsed = np.full(len(values), np.nan)
+    for position, value in enumerate(values.tolist()):
+        try:
+            parsed[position] = float(value)
+        except ValueError:
+            pass
+    return parsed
+
+
+def groupStats(groups, group_count, lat, lon):
+    """Per group of 0..group_count-1: schools, located, centroid and bounding box.
+
+    lat / lon are NaN for schools without coordinates.  Returns a dict of NumPy arrays with one
+    entry per group; the centroid and bounding box of groups without located schools are NaN.
+    """
+    located = np.isfinite(lat) & np.isfinite(lon)
+    stats = {
+        'schools': np.bincount(groups, minlength=group_count),
+        'located': np.bincount(groups[located], minlength=group_count),
+    }
+    for column in ['lat', 'lon', 'south', 'west', 'north', 'east']:
+        stats[column] = np.full(group_count, np.nan)
+    if not located.any():
+        return stats
+
+    located_groups, lat, lon = groups[located], lat[located], lon[located]
+    vectors = toUnitVectors(lat, lon)
+    sums = np.stack([
+        np.bincount(located_groups, weights=vectors[:, axis], minlength=group_count)
+        for axis in range(3)
+    ], axis=-1)
+    stats['lat'] = np.degrees(np.arctan2(sums[:, 2], np.hypot(sums[:, 0], sums[:, 1])))
+    stats['lon'] = np.degrees(np.arctan2(sums[:, 1], sums[:, 0]))
+    stats['lat'][stats['located'] == 0] = np.nan
+    stats['lon'][stats['located'] == 0] = np.nan
+
+    order = np.argsort(located_groups, kind='stable')
+    sorted_groups = located_groups[order]
+    starts = np.flatnonzero(np.r_[True, sorted_groups[1:] != sorted_groups[:-1]])
+    present = sorted_groups[starts]
+    stats['south'][present] = np.minimum.reduceat(lat[order], starts)
+    stats['west'][present] = np.minimum.reduceat(lon[order], starts)
+    stats['north'][present] = np.maximum.reduceat(lat[order], starts)
+    stats['east'][present] = np.maximum.reduceat(lon[order], starts)
+    return stats
+
+
+def _round(value, digits=6):
+    return None if value != value else round(value, digits)
+
+
+def _statEntries(stats, names, name_field):
+    """One dict per group, as stored in Firestore."""
+    columns = {column: values.tolist() for column, values in stats.items()}
+    return [
+        {
+            name_field: name,
+            'schools': columns['schools'][index],
+            'located': columns['located'][index],
+            'centroid': None if not columns['located'][index] else {
+                'lat': _round(columns['lat'][index]), 'lon': _round(columns['lon'][index])},
+            'bbox': None if not columns['located'][index] else [
+                _round(columns[column][index]) for column in ['south', 'west', 'north', 'east']],
+        }
+        for index, name in enumerate(names)
+    ]
+
+
+def packPoints(school_ids, lat, lon, per_document=POINTS_PER_DOCUMENT):
+    """Pack located schools into points-<nnnn> documents."""
+    located = np.flatnonzero(np.isfinite(lat) & np.isfinite(lon))
+    lat_lon = np.empty((len(located), 2), dtype='<i4')
+    lat_lon[:, 0] = np.round(lat[located] * POINT_SCALE)
+    lat_lon[:, 1] = np.round(lon[located] * POINT_SCALE)
+    documents = {}
+    for start in range(0, len(located), per_document):
+        end = start + per_document
+        documents['points-%04d' % (start // per_document)] = {
+            'count': len(located[start:end]),
+            'ids': '\n'.join(school_ids[position] for position in located[start:end].tolist()),
+            'lat_lon': lat_lon[start:end].tobytes(),
+            'scale': POINT_SCALE,
+        }
+    return documents
+
+
+def unpackPoints(document):
+    """Get (ids, lat, lon) back from a points document."""
+    lat_lon = np.frombuffer(document['lat_lon'], dtype='<i4').reshape(-1, 2)
+    ids = document['ids'].split('\n') if document['count'] else []
+    return ids, lat_lon[:, 0] / document['scale'], lat_lon[:, 1] / document['scale']
+
+
+def readModels(school_ids, country_codes, regions, lats, lons,
+               points_per_document=POINTS_PER_DOCUMENT):
+    """Compute the aggregate documents of a scrape's schools, as a dict of id -> document."""
+    lat, lon = parseCoordinates(lats), parseCoordinates(lons)
+    country_codes = np.asarray(country_codes, dtype=str)
+    countries, country_groups = np.unique(country_codes, return_inverse=True)
+    country_stats = groupStats(country_groups, len(countries), lat, lon)
+
+    # Regions are grouped within their country, by (country, region) pairs, sorted by country
+    region_names, region_groups = np.unique(np.asarray(regions, dtype=str), return_inverse=True)
+    region_count = max(1, len(region_names))
+    pairs, pair_groups = np.unique(
+        country_groups.astype(np.int64) * region_count + region_groups, return_inverse=True)
+    region_stats = groupStats(pair_groups, len(pairs), lat, lon)
+    region_entries = _statEntries(
+        region_stats, region_names[pairs % region_count].tolist(), 'region')
+    country_starts = np.searchsorted(
+        pairs // region_count, np.arange(len(countries) + 1)).tolist()
+
+    documents = {
+        'countries': {
+            'schools': len(country_codes),
+            'located': int(country_stats['located'].sum()),
+            'countries': _statEntries(country_stats, countries.tolist(), 'country_code'),
+        },
+    }
+    for country_index, country_code in enumerate(countries.tolist()):
+        documents['regions-%s' % (country_code or 'XX')] = {
+            'country_code': country_code,
+            'regions': region_entries[
+                country_starts[country_index]:country_starts[country_index + 1]],
+        }
+    documents.update(packPoints(school_ids, lat, lon, points_per_document))
+    return documents
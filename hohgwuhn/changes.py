@@ -0,0 +1,410 @@
+"""Reports what changed between dated snapshots of the school listings.
+
+Schools carry no id of their own, so the schools of two snapshots are aligned in three passes,
+each only over the schools left unmatched by the ones before:
+    1. exact: same place (country code, region, city) and address, after normalizing case,
+       accents, punctuation and whitespace
+    2. fuzzy: same place, with addresses whose character trigrams overlap by at least
+       FUZZY_THRESHOLD (Jaccard), e.g. a typo fixed or a suite number added
+    3. phone: same country and the same phone number, for schools that moved to another city
+
+Every pass works on whole columns at once, so even the full history diffs in a fraction of a
+second.  Matched schools whose fields differ are reported as modified, with the per-field
+changes; the rest are added or removed.  Snapshots can be any CSV written by exportCSV or
+exportGeoData, whatever their vintage, given as a date in data/, a local path or a GCS object:
+
+    diff = diffSnapshots(loadSnapshot('2018-03-17'), loadSnapshot('2019-01-01'))
+    diff.summary()  ->  {'added': 7, 'removed': 11, 'modified': 45, 'moved': 17, ...}
+
+    python -m hohgwuhn.changes 2018-03-17 2019-01-01 ../data/school_geodata.csv --details
+"""
+import argparse
+from dataclasses import dataclass
+import json
+import os
+import sys
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from . import gcs
+from . import snapshots
+from .nearest import haversine
+
+
+# Minimum trigram Jaccard similarity for a fuzzy address match within the same place
+FUZZY_THRESHOLD = 0.5
+# Matched schools whose coordinates are further apart than this have moved
+MOVED_KM = 0.5
+# Phone numbers with fewer digits are too ambiguous to match schools on
+MIN_PHONE_DIGITS = 6
+
+# Trigrams are hashed into a fixed-width bit signature per address
+SIGNATURE_BITS = 512
+
+COORDINATE_COLUMNS = ['Latitude', 'Longitude']
+
+
+def _standardize(school_df):
+    """Strings for every column except coordinates, which become floats (NaN if missing)."""
+    school_df = school_df.drop(columns=[
+        column for column in school_df.columns if str(column).startswith('Unnamed:')])
+    school_df = school_df.reset_index(drop=True)
+    for column in school_df.columns:
+        if column in COORDINATE_COLUMNS:
+            school_df[column] = pd.to_numeric(school_df[column], errors='coerce')
+        else:
+            school_df[column] = school_df[column].astype(object).fillna('').astype(str)
+    return school_df
+
+
+def loadSnapshot(source, kind='geodata', data_dir=snapshots.SNAPSHOT_DIR):
+    """Load a snapshot from a date in data_dir, a CSV path, or a 'gs://<bucket>/<blob>' URL."""
+    if source.startswith('gs://'):
+        bucket_name, _, blob_name = source[len('gs://'):].partition('/')
+        with gcs.openBlobReader(gcs.getBucket(bucket_name), blob_name) as data_file:
+            school_df = pd.read_csv(data_file, dtype=str, keep_default_na=False)
+    elif os.path.isfile(source):
+        school_df = pd.read_csv(source, dtype=str, keep_default_na=False)
+    else:
+        school_df = snapshots.openSnapshot(source, kind, data_dir=data_dir).to_pandas()
+    return _standardize(school_df)
+
+
+def normalizeText(values):
+    """Fold case, accents, punctuation and runs of whitespace out of a column of strings."""
+    values = pd.Series(values).fillna('').astype(str)
+    # Each distinct value is only normalized once; cities, regions and most addresses repeat
+    codes, uniques = pd.factorize(values)
+    # Kept as Python objects, as the Arrow string regexes only know ASCII word characters
+    normalized = (
+        pd.Series(uniques, dtype=object)
+        .str.normalize('NFKD')
+        .str.replace('[\u0300-\u036f]', '', regex=True)
+        .str.normalize('NFC')
+        .str.casefold()
+        .str.replace(r'[\W_]+', ' ', regex=True)
+        .str.strip()
+    )
+    return pd.Series(normalized.to_numpy()[codes], index=values.index, dtype=object)
+
+
+def _column(school_df, column):
+    return school_df[column] if column in school_df else pd.Series('', index=school_df.index)
+
+
+def _matchKeys(school_df, use_country):
+    """The normalized keys each pass matches on, one row per school."""
+    country = _column(school_df, 'Country Code').str.strip().str.upper() if use_country else (
+        pd.Series('', index=school_df.index))
+    keys = pd.DataFrame({
+        'row': np.arange(len(school_df)),
+        'country': country,
+        'address': normalizeText(_column(school_df, 'Address')),
+        'phone': _column(school_df, 'Phone #s').str.replace(r'\D', '', regex=True),
+    })
+    keys['place'] = (
+        country + '|' + normalizeText(_column(school_df, 'Region')) + '|' +
+        normalizeText(_column(school_df, 'City')))
+    return keys
+
+
+def _withOccurrence(keys, columns):
+    """Number repeated keys, so duplicate schools pair up one to one."""
+    keys = keys.copy()
+    keys['occurrence'] = keys.groupby(columns, sort=False).cumcount()
+    return keys
+
+
+def _exactPairs(old_keys, new_keys):
+    columns = ['place', 'address']
+    pairs = _withOccurrence(old_keys, columns).merge(
+        _withOccurrence(new_keys, columns), on=columns + ['occurrence'],
+        suffixes=('_old', '_new'))
+    return pairs[['row_old', 'row_new']]
+
+
+def trigramSignatures(addresses):
+    """Bit signatures of the character trigrams of each address, one row per address."""
+    rows, bits = [], []
+    for row, address in enumerate(addresses):
+        padded = ' %s ' % address
+        # crc32 rather than hash(), which is salted per process, so signatures are reproducible
+        trigram_bits = {
+            zlib.crc32(padded[i:i + 3].encode()) % SIGNATURE_BITS for i in range(len(padded) - 2)}
+        rows.extend([row] * len(trigram_bits))
+        bits.extend(trigram_bits)
+    signatures = np.zeros((len(addresses), SIGNATURE_BITS), dtype=bool)
+    signatures[rows, bits] = True
+    return signatures
+
+
+def _pickBest(candidates):
+    """Greedily pair off the highest scoring candidates, each school at most once."""
+    candidates = candidates.sort_values(
+        ['score', 'row_old', 'row_new'], ascending=[False, True, True], kind='stable')
+    picked = []
+    while len(candidates):
+        best = candidates.drop_duplicates('row_old').drop_duplicates('row_new')
+        picked.append(best)
+        candidates = candidates[
+            ~candidates['row_old'].isin(best['row_old']) &
+            ~candidates['row_new'].isin(best['row_new'])]
+    return pd.concat(picked) if picked else candidates
+
+
+def _fuzzyPairs(old_keys, new_keys, threshold):
+    candidates = old_keys[['row', 'place']].merge(
+        new_keys[['row', 'place']], on='place', suffixes=('_old', '_new'))
+    if candidates.empty:
+        return candidates[['row_old', 'row_new']]
+
+    old_signatures = trigramSignatures(old_keys['address'].tolist())
+    new_signatures = trigramSignatures(new_keys['address'].tolist())
+    # Rows of the signature matrices, by school row
+    old_index = pd.Series(np.arange(len(old_keys)), index=old_keys['row'])
+    new_index = pd.Series(np.arange(len(new_keys)), index=new_keys['row'])
+    old_bits = old_signatures[old_index[candidates['row_old']].to_numpy()]
+    new_bits = new_signatures[new_index[candidates['row_new']].to_numpy()]
+    union = (old_bits | new_bits).sum(axis=1)
+    candidates['score'] = (old_bits & new_bits).sum(axis=1) / np.maximum(union, 1)
+
+    candidates = candidates[candidates['score'] >= threshold]
+    return _pickBest(candidates)[['row_old', 'row_new']]
+
+
+def _phonePairs(old_keys, new_keys):
+    def uniquePhones(keys):
+        keys = keys[keys['phone'].str.len() >= MIN_PHONE_DIGITS]
+        return keys.drop_duplicates(['country', 'phone'], keep=False)
+
+    pairs = uniquePhones(old_keys).merge(
+        uniquePhones(new_keys), on=['country', 'phone'], suffixes=('_old', '_new'))
+    return pairs[['row_old', 'row_new']]
+
+
+def _bothMatchKeys(old_df, new_df):
+    # Snapshots from before the worldwide scrape have no country code to match on
+    use_country = 'Country Code' in old_df and 'Country Code' in new_df
+    # Keyed together, so the values the snapshots share are normalized once
+    columns = ['Country Code', 'Region', 'City', 'Address', 'Phone #s']
+    both_df = pd.concat([
+        school_df[[column for column in columns if column in school_df]]
+        for school_df in (old_df, new_df)
+    ], ignore_index=True)
+    keys = _matchKeys(both_df, use_country)
+    old_keys, new_keys = keys.iloc[:len(old_df)], keys.iloc[len(old_df):].copy()
+    new_keys['row'] -= len(old_df)
+    return old_keys, new_keys.reset_index(drop=True)
+
+
+def _alignKeys(old_left, new_left, threshold):
+    passes = []
+    for match, findPairs in [
+            ('exact', _exactPairs),
+            ('fuzzy', lambda old, new: _fuzzyPairs(old, new, threshold)),
+            ('phone', _phonePairs)]:
+        pairs = findPairs(old_left, new_left).assign(match=match)
+        passes.append(pairs)
+        old_left = old_left[~old_left['row'].isin(pairs['row_old'])]
+        new_left = new_left[~new_left['row'].isin(pairs['row_new'])]
+
+    pairs = pd.concat(passes, ignore_index=True)
+    return pairs.sort_values('row_new', kind='stable').reset_index(drop=True)
+
+
+def alignSchools(old_df, new_df, threshold=FUZZY_THRESHOLD):
+    """Pair up the rows of two snapshots holding the same school.
+
+    Returns a DataFrame of (row_old, row_new, match), match being the pass that paired them.
+    """
+    return _alignKeys(*_bothMatchKeys(old_df, new_df), threshold)
+
+
+def _changedMask(old_values, new_values, column):
+    if column in COORDINATE_COLUMNS:
+        both_missing = old_values.isna() & new_values.isna()
+        same = np.isclose(old_values, new_values, rtol=0, atol=1e-7)
+        return ~(both_missing | same)
+    return old_values.str.strip() != new_values.str.strip()
+
+
+@dataclass
+class SnapshotDiff:
+    """The changes from one snapshot to the next.
+
+    added / removed hold the schools of the new / old snapshot with no match in the other,
+    modified holds one row per matched school with at least one changed field, and changes
+    holds one row per changed field (Old Row, New Row, Field, Old, New).  Rows are positions in
+    each snapshot.
+    """
+    old_name: str
+    new_name: str
+    added: pd.DataFrame
+    removed: pd.DataFrame
+    modified: pd.DataFrame
+    changes: pd.DataFrame
+    unchanged: int
+
+    def summary(self):
+        """Count the schools added, removed, modified, moved and unchanged, and each change."""
+        field_counts = self.changes['Field'].value_counts()
+        return {
+            'old': self.old_name,
+            'new': self.new_name,
+            'added': len(self.added),
+            'removed': len(self.removed),
+            'modified': len(self.modified),
+            'moved': int(self.modified['Moved'].sum()),
+            'unchanged': self.unchanged,
+            'fields': {field: int(count) for field, count in field_counts.items()},
+        }
+
+    def toDict(self):
+        """Get the full report, JSON serializable."""
+        def records(school_df):
+            return json.loads(school_df.to_json(orient='records'))
+
+        changes_by_pair = {
+            (old_row, new_row): {
+                field: [old, new] for field, old, new in zip(
+                    pair_changes['Field'], pair_changes['Old'], pair_changes['New'])
+            }
+            for (old_row, new_row), pair_changes in self.changes.groupby(
+                ['Old Row', 'New Row'], sort=False)
+        }
+        return {
+            'summary': self.summary(),
+            'added': records(self.added),
+            'removed': records(self.removed),
+            'modified': [
+                {
+                    'old_row': int(old_row),
+                    'new_row': int(new_row),
+                    'match': match,
+                    'moved': bool(moved),
+                    'changes': changes_by_pair[(old_row, new_row)],
+                }
+                for old_row, new_row, match, moved in zip(
+                    self.modified['Old Row'], self.modified['New Row'], self.modified['Match'],
+                    self.modified['Moved'])
+            ],
+        }
+
+
+def diffSnapshots(old_df, new_df, old_name='old', new_name='new', threshold=FUZZY_THRESHOLD,
+                  moved_km=MOVED_KM):
+    """Diff two snapshots, as loaded by loadSnapshot (or read with dtype=str)."""
+    old_df, new_df = _standardize(old_df), _standardize(new_df)
+    old_keys, new_keys = _bothMatchKeys(old_df, new_df)
+    pairs = _alignKeys(old_keys, new_keys, threshold)
+    old_rows, new_rows = pairs['row_old'].to_numpy(), pairs['row_new'].to_numpy()
+
+    fields = [column for column in new_df.columns if column in old_df.columns]
+    changed = pd.DataFrame({
+        column: _changedMask(
+            old_df[column].iloc[old_rows].reset_index(drop=True),
+            new_df[column].iloc[new_rows].reset_index(drop=True), column).to_numpy()
+        for column in fields
+    }, columns=fields, dtype=bool)
+
+    change_frames = []
+    for column in fields:
+        mask = changed[column].to_numpy()
+        change_frames.append(pd.DataFrame({
+            'Old Row': old_rows[mask],
+            'New Row': new_rows[mask],
+            'Field': column,
+            'Old': old_df[column].iloc[old_rows[mask]].to_numpy(dtype=object),
+            'New': new_df[column].iloc[new_rows[mask]].to_numpy(dtype=object),
+        }))
+    changes = pd.concat(change_frames, ignore_index=True) if change_frames else pd.DataFrame(
+        columns=['Old Row', 'New Row', 'Field', 'Old', 'New'])
+    changes = changes.sort_values(['New Row', 'Old Row'], kind='stable').reset_index(drop=True)
+
+    # Moved: matched into a different place, or geocoded further than moved_km away
+    moved = old_keys['place'].to_numpy()[old_rows] != new_keys['place'].to_numpy()[new_rows]
+    if all(column in fields for column in COORDINATE_COLUMNS):
+        distances = haversine(
+            old_df['Latitude'].to_numpy()[old_rows], old_df['Longitude'].to_numpy()[old_rows],
+            new_df['Latitude'].to_numpy()[new_rows], new_df['Longitude'].to_numpy()[new_rows])
+        moved |= np.nan_to_num(distances, nan=0.0) > moved_km
+
+    is_modified = changed.any(axis=1).to_numpy() if fields else np.zeros(len(pairs), dtype=bool)
+    modified = pd.DataFrame({
+        'Old Row': old_rows[is_modified],
+        'New Row': new_rows[is_modified],
+        'Match': pairs['match'].to_numpy()[is_modified],
+        'Moved': moved[is_modified],
+        'Changed': [
+            ', '.join(np.asarray(fields)[row_changed])
+            for row_changed in changed.to_numpy()[is_modified]
+        ],
+    })
+
+    return SnapshotDiff(
+        old_name=old_name,
+        new_name=new_name,
+        added=new_df.drop(index=new_rows),
+        removed=old_df.drop(index=old_rows),
+        modified=modified,
+        changes=changes,
+        unchanged=int((~is_modified).sum()),
+    )
+
+
+def diffHistory(sources, kind='geodata', data_dir=snapshots.SNAPSHOT_DIR, **diff_args):
+    """Diff each snapshot against the one before it, for two or more loadSnapshot sources."""
+    diffs = []
+    old_source, old_df = sources[0], loadSnapshot(sources[0], kind, data_dir)
+    for new_source in sources[1:]:
+        new_df = loadSnapshot(new_source, kind, data_dir)
+        diffs.append(diffSnapshots(old_df, new_df, old_source, new_source, **diff_args))
+        old_source, old_df = new_source, new_df
+    return diffs
+
+
+def _printDiff(diff, details):
+    summary = diff.summary()
+    print('%s -> %s: %s added, %s removed, %s modified (%s moved), %s unchanged' % (
+        summary['old'], summary['new'], summary['added'], summary['removed'],
+        summary['modified'], summary['moved'], summary['unchanged']))
+    if summary['fields']:
+        print('  changed: %s' % ', '.join(
+            '%s %s' % (field, count) for field, count in summary['fields'].items()))
+    if not details:
+        return
+    for _, school in diff.added.iterrows():
+        print('  + %s, %s: %s' % (school.get('City', ''), school.get('Region', ''),
+                                   school.get('Address', '')))
+    for _, school in diff.removed.iterrows():
+        print('  - %s, %s: %s' % (school.get('City', ''), school.get('Region', ''),
+                                   school.get('Address', '')))
+    for change in diff.changes.itertuples(index=False):
+        print('  ~ row %s -> %s %s: %r -> %r' % tuple(change))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('sources', nargs='*',
+                        help='Snapshot dates, CSV paths or gs:// URLs (default: every date)')
+    parser.add_argument('--kind', choices=sorted(snapshots.SNAPSHOT_KINDS), default='geodata')
+    parser.add_argument('--data-dir', default=snapshots.SNAPSHOT_DIR)
+    parser.add_argument('--threshold', type=float, default=FUZZY_THRESHOLD)
+    parser.add_argument('--details', action='store_true', help='List every changed school')
+    parser.add_argument('--output', help='Write the full report as JSON')
+    args = parser.parse_args()
+
+    snapshot_sources = args.sources or snapshots.listSnapshots(args.kind, args.data_dir)
+    if len(snapshot_sources) < 2:
+        sys.exit('At least two snapshots are needed')
+    snapshot_diffs = diffHistory(
+        snapshot_sources, args.kind, args.data_dir, threshold=args.threshold)
+    for snapshot_diff in snapshot_diffs:
+        _printDiff(snapshot_diff, args.details)
+    if args.output:
+        with open(args.output, 'w') as report_file:
+            json.dump([snapshot_diff.toDict() for snapshot_diff in snapshot_diffs], report_file,
+                      indent=2, ensure_ascii=False)
@@ -0,0 +1,210 @@
+"""Checkpoints of geocoded schools, so a run cut short resumes where it stopped.
+
+geocodeFile is deployed with a 540s timeout, so loadSchoolData geocodes the scrape
+GEOCODE_CHUNK_ROWS schools at a time and saves each finished chunk as a CSV part: under
+'_checkpoints/<file name>/' in the geocode bucket, or in LOCAL_CHECKPOINT_DIR for local runs.
+A later run of the same file reuses every part whose schools still match the scrape, and only
+geocodes the rest (set GEOCODE_RESUME=0 to start over).  The parts are deleted once the geodata
+file is written.  Near the deadline, a chunk may be saved as several smaller parts, each named by
+its own first row.
+
+Each run has a deadline, GEOCODE_DEADLINE_SECONDS after it starts (0 for none), checked before
+every part, API call and retry backoff.  A GCS run that reaches it uploads '_continue/<file name>'
+to the fetch bucket, whose finalize event triggers geocodeFile again to pick up the remainder.
+Runs that made no progress, or that follow GEOCODE_MAX_CONTINUATIONS others, do not continue.
+
+geoETL ignores objects under both prefixes.
+"""
+import io
+import json
+import os
+import shutil
+import time
+
+from . import gcs
+
+
+CHECKPOINT_PREFIX = '_checkpoints/'
+CONTINUATION_PREFIX = '_continue/'
+LOCAL_CHECKPOINT_DIR = '../data/geocode_checkpoint'
+
+GEOCODE_RESUME = os.environ.get('GEOCODE_RESUME', '1') != '0'
+GEOCODE_DEADLINE_SECONDS = float(os.environ.get('GEOCODE_DEADLINE_SECONDS', 420))
+GEOCODE_MAX_CONTINUATIONS = int(os.environ.get('GEOCODE_MAX_CONTINUATIONS', 10))
+
+
+class DeadlineExceeded(Exception):
+    """The run's deadline passed before its work was done."""
+
+
+class Deadline:
+    """A point in time a run should stop by, or never with no seconds."""
+    def __init__(self, seconds=GEOCODE_DEADLINE_SECONDS):
+        self.end = time.monotonic() + seconds if seconds else None
+
+    def remaining(self):
+        """Seconds left, or None without a deadline."""
+        return None if self.end is None else self.end - time.monotonic()
+
+    def expired(self):
+        return self.end is not None and time.monotonic() >= self.end
+
+    def allows(self, seconds):
+        """Whether waiting `seconds` still ends before the deadline."""
+        return self.end is None or time.monotonic() + seconds < self.end
+
+
+def isInternalName(blob_name):
+    """Whether a blob is a checkpoint part or continuation, rather than a data file."""
+    return blob_name.startswith((CHECKPOINT_PREFIX, CONTINUATION_PREFIX))
+
+
+class LocalCheckpointStore:
+    """Keeps checkpoint parts as files in a local directory."""
+    def __init__(self, directory):
+        self.directory = directory
+
+    def names(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return os.listdir(self.directory)
+
+    def read(self, name):
+        with open(os.path.join(self.directory, name), 'r', newline='') as part_in:
+            return part_in.read()
+
+    def write(self, name, text):
+        os.makedirs(self.directory, exist_ok=True)
+        # Write then rename, so a run killed mid-write never leaves half a part
+        path = os.path.join(self.directory, name)
+        with open(path + '.tmp', 'w', newline='') as part_out:
+            part_out.write(text)
+        os.replace(path + '.tmp', path)
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class GCSCheckpointStore:
+    """Keeps checkpoint parts as objects under a prefix of a GCS bucket."""
+    def __init__(self, bucket, prefix):
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def names(self):
+        return [
+            blob.name[len(self.prefix):] for blob in self.bucket.list_blobs(prefix=self.prefix)]
+
+    def read(self, name):
+        return gcs.openBlobReader(self.bucket, self.prefix + name, streaming=False).read()
+
+    def write(self, name, text):
+        gcs.uploadText(self.bucket, self.prefix + name, text)
+
+    def clear(self):
+        for blob in self.bucket.list_blobs(prefix=self.prefix):
+            blob.delete()
+
+
+class Checkpoint:
+    """The geocoded parts of one scrape, each saved as a CSV named by its first row."""
+    def __init__(self, store, resume=GEOCODE_RESUME):
+        self.store = store
+        if not resume:
+            store.clear()
+        self.parts = set(store.names())
+        # Parts saved by this run, as opposed to reused from an earlier one
+        self.saved = 0
+
+    @staticmethod
+    def partName(start):
+        return 'rows-%09d.csv' % start
+
+    def load(self, start, chunk_df, key_columns):
+        """Get the saved part starting at row `start` as strings, if it matches chunk_df.
+
+        chunk_df holds the scrape's rows from `start` on, of which the part may cover only the
+        first ones.  The scrape may have been replaced since, so the part is only used when it
+        has no more rows than chunk_df, and the same key_columns as its first rows.
+        """
+        import pandas as pd  # pylint: disable=import-outside-toplevel
+        name = self.partName(start)
+        if name not in self.parts:
+            return None
+        part_df = pd.read_csv(
+            io.StringIO(self.store.read(name)), dtype=str, keep_default_na=False)
+        key_columns = [
+            column for column in key_columns
+            if column in chunk_df.columns and column in part_df.columns
+        ]
+        chunk_df = chunk_df.iloc[:len(part_df)]
+        if len(part_df) != len(chunk_df) or not (
+                part_df[key_columns].to_numpy() ==
+                chunk_df[key_columns].astype(str).to_numpy()).all():
+            print('Ignoring checkpoint %s, which no longer matches the scrape' % name)
+            return None
+        part_df.index = chunk_df.index
+        return part_df
+
+    def save(self, start, chunk_df):
+        """Save a geocoded part, starting at row `start` of the scrape."""
+        name = self.partName(start)
+        self.store.write(name, chunk_df.to_csv(index=False))
+        self.parts.add(name)
+        self.saved += 1
+
+    def read(self, start):
+        """Get the text of the saved part starting at row `start`."""
+        return self.store.read(self.partName(start))
+
+    def clear(self):
+        """Delete every part, once the geodata file is written."""
+        self.store.clear()
+        self.parts = set()
+
+
+def openCheckpoint(file_name=None, resume=GEOCODE_RESUME):
+    """Open the checkpoint of a scrape in GCS, or of the local scrape."""
+    if file_name:
+        store = GCSCheckpointStore(gcs.getGeocodeBucket(), CHECKPOINT_PREFIX + file_name + '/')
+    else:
+        store = LocalCheckpointStore(LOCAL_CHECKPOINT_DIR)
+    return Checkpoint(store, resume)
+
+
+def resolveTrigger(blob_name):
+    """Get (file name, continuation count) for the object that triggered geocodeFile."""
+    if not blob_name.startswith(CONTINUATION_PREFIX):
+        return blob_name, 0
+    blob = gcs.getFetchBucket().blob(blob_name)
+    continuation = json.loads(blob.download_as_string().decode())
+    print('Continuing %s (continuation %s)' % (
+        continuation['file_name'], continuation['continuation']))
+    return continuation['file_name'], continuation['continuation']
+
+
+def requestContinuation(file_name, continuation, progress):
+    """Trigger another geocodeFile run for the rest of the file, unless it would not help.
+
+    Returns whether one was triggered.
+    """
+    if not progress.saved:
+        print('No part of %s finished before the deadline, not continuing' % file_name)
+        return False
+    if continuation > GEOCODE_MAX_CONTINUATIONS:
+        print('%s still unfinished after %s continuations, giving up' % (
+            file_name, GEOCODE_MAX_CONTINUATIONS))
+        return False
+    print('Deadline reached, continuing %s in a new run' % file_name)
+    gcs.uploadText(
+        gcs.getFetchBucket(), CONTINUATION_PREFIX + file_name,
+        json.dumps({'file_name': file_name, 'continuation': continuation}),
+        content_type='application/json')
+    return True
+
+
+def clearContinuation(file_name):
+    """Delete the continuation object of a file once it is finished."""
+    blob = gcs.getFetchBucket().get_blob(CONTINUATION_PREFIX + file_name)
+    if blob is not None:
+        blob.delete()
@@ -0,0 +1,94 @@
+"""Resolves the country names on the WKSA site to ISO-2 codes.
+
+Names already seen are looked up in the frozen mapping in country_codes.json.  Only unknown
+names go to country_converter, all in a single batched call, and it is only imported then, as
+importing it loads a large pandas table.
+
+Refresh the frozen mapping from the scraped CSVs (e.g. after the site adds a country) with:
+
+    python -m hohgwuhn.countries ../data/school_data.csv
+"""
+import csv
+import json
+import os
+import sys
+
+
+COUNTRY_CODES_FILE = os.path.join(os.path.dirname(__file__), 'country_codes.json')
+
+# What country_converter returns for names it cannot match
+NOT_FOUND = 'not found'
+
+_COUNTRY_CODES = None
+
+
+def _nameKey(country_name):
+    return ' '.join(country_name.split()).casefold()
+
+
+def loadCountryCodes(path=COUNTRY_CODES_FILE):
+    """Load a frozen name -> ISO-2 mapping, keyed on the case and whitespace folded name."""
+    with open(path, 'r') as codes_file:
+        return {_nameKey(name): code for name, code in json.load(codes_file).items()}
+
+
+def getCountryCodes():
+    """Get the frozen mapping, shared for the whole run."""
+    global _COUNTRY_CODES  # pylint: disable=global-statement
+    if _COUNTRY_CODES is None:
+        _COUNTRY_CODES = loadCountryCodes()
+    return _COUNTRY_CODES
+
+
+def convertNames(country_names):
+    """Convert names with country_converter, in one batched call."""
+    import country_converter as coco  # pylint: disable=import-outside-toplevel
+    if not country_names:
+        return []
+    country_codes = coco.convert(names=list(country_names), to='ISO2', not_found=NOT_FOUND)
+    # A single name comes back as a plain string
+    return [country_codes] if isinstance(country_codes, str) else list(country_codes)
+
+
+def resolveCountryCodes(country_names, country_codes=None):
+    """Resolve each name to its ISO-2 code, in order.
+
+    Unknown names are converted by country_converter (and added to country_codes for the rest
+    of the run); names it cannot match either resolve to 'not found'.
+    """
+    country_codes = getCountryCodes() if country_codes is None else country_codes
+    unknown_names = list(dict.fromkeys(
+        name for name in country_names if _nameKey(name) not in country_codes))
+    if unknown_names:
+        print('Resolving %s countries missing from %s: %s' % (
+            len(unknown_names), os.path.basename(COUNTRY_CODES_FILE), ', '.join(unknown_names)))
+        for name, code in zip(unknown_names, convertNames(unknown_names)):
+            country_codes[_nameKey(name)] = code
+    return [country_codes[_nameKey(name)] for name in country_names]
+
+
+def freezeCountryCodes(country_names, path=COUNTRY_CODES_FILE):
+    """Add the names (and their resolved codes) to the frozen mapping file."""
+    with open(path, 'r') as codes_file:
+        frozen = json.load(codes_file)
+    frozen_keys = {_nameKey(name) for name in frozen}
+    new_names = list(dict.fromkeys(
+        name for name in country_names if _nameKey(name) not in frozen_keys))
+    for name, code in zip(new_names, convertNames(new_names)):
+        if code != NOT_FOUND:
+            frozen[name] = code
+
+    with open(path, 'w') as codes_file:
+        json.dump(dict(sorted(frozen.items())), codes_file, indent=2, ensure_ascii=False)
+        codes_file.write('\n')
+    return frozen
+
+
+if __name__ == '__main__':
+    seen_names = []
+    for csv_path in sys.argv[1:]:
+        with open(csv_path, 'r') as csv_file:
+            # Older snapshots have no Country column
+            seen_names.extend(row.get('Country') or '' for row in csv.DictReader(csv_file))
+    seen_names = [name for name in seen_names if name]
+    print('%s countries frozen' % len(freezeCountryCodes(seen_names)))
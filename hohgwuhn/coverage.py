@@ -0,0 +1,169 @@
+"""Precomputed nearest-school lookup table over a global latitude / longitude grid.
+
+Run after loadSchoolData, `python -m hohgwuhn.coverage` divides the world into square cells of
+COVERAGE_RESOLUTION degrees, and finds the school nearest to the center of every cell with the
+spatial index of nearest.py, COVERAGE_CHUNK_CELLS cells at a time.  The grid is written straight
+to disk as a .npy of (rows, columns) records:
+    - school: the position of the cell's nearest school in the schools file; a grid is only
+      built from at least one school, so every cell has one
+    - km: the haversine distance in kilometers from the cell's center to that school
+which np.load memory-maps, so a lookup reads a single 8 byte record without loading the grid.
+The schools (ids and coordinates) are saved next to it, as '<grid>.schools.npz'.
+
+    python -m hohgwuhn.coverage --resolution 0.25
+    python -m hohgwuhn.coverage --lookup 42.24 -88.31
+
+A lookup answers with the nearest school to the center of the point's cell, so it can differ
+from the exact nearest school for points close to the halfway line between two schools; the
+distance it reports is from the point itself to that school.  Schools are identified by their
+row in the geodata file, or by an id column.
+"""
+import argparse
+import os
+
+import numpy as np
+
+from . import nearest
+
+
+COVERAGE_GRID_FILE = '../data/school_coverage.npy'
+COVERAGE_RESOLUTION = float(os.environ.get('COVERAGE_RESOLUTION', 0.25))
+# Cells whose nearest schools are found at once; bounds the build's working memory
+COVERAGE_CHUNK_CELLS = int(os.environ.get('COVERAGE_CHUNK_CELLS', 1 << 16))
+
+CELL_DTYPE = np.dtype([('school', '<i4'), ('km', '<f4')])
+
+
+def _schoolsPath(grid_file):
+    return '%s.schools.npz' % os.path.splitext(grid_file)[0]
+
+
+def gridShape(resolution):
+    """(rows, columns) of a world grid with cells of about resolution degrees."""
+    rows = max(1, int(round(180 / resolution)))
+    return rows, 2 * rows
+
+
+def cellCenters(rows, columns, first_row, last_row):
+    """Latitudes / longitudes of the centers of rows first_row to last_row, row by row."""
+    cell_degrees = 180 / rows
+    lat = -90 + (np.arange(first_row, last_row) + 0.5) * cell_degrees
+    lon = -180 + (np.arange(columns) + 0.5) * cell_degrees
+    return np.repeat(lat, columns), np.tile(lon, last_row - first_row)
+
+
+class CoverageGrid:
+    """Nearest school of every cell of a world grid, answering lookups in O(1)."""
+    def __init__(self, cells, school_ids, school_lat, school_lon):
+        self.cells = cells
+        self.school_ids = np.asarray(school_ids)
+        self.school_lat = np.asarray(school_lat, dtype=np.float64)
+        self.school_lon = np.asarray(school_lon, dtype=np.float64)
+        self.rows, self.columns = cells.shape
+        self.cell_degrees = 180 / self.rows
+
+    @classmethod
+    def build(cls, lat, lon, grid_file, resolution=COVERAGE_RESOLUTION, school_ids=None,
+              chunk_cells=COVERAGE_CHUNK_CELLS):
+        """Build the grid for schools at the given latitudes / longitudes into grid_file.
+
+        Cells are written to the memory-mapped file as they are found, so only chunk_cells of
+        them are in memory at once.
+        """
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        school_ids = np.arange(len(lat)) if school_ids is None else np.asarray(school_ids)
+        # Index the schools by position, so the grid can refer to them by position
+        index = nearest.SchoolIndex.build(lat, lon, np.arange(len(lat)))
+
+        rows, columns = gridShape(resolution)
+        cells = np.lib.format.open_memmap(grid_file, mode='w+', dtype=CELL_DTYPE,
+                                          shape=(rows, columns))
+        rows_per_chunk = max(1, chunk_cells // columns)
+        for first_row in range(0, rows, rows_per_chunk):
+            last_row = min(rows, first_row + rows_per_chunk)
+            distances, positions = index.nearest(
+                *cellCenters(rows, columns, first_row, last_row), k=1)
+            cells['school'][first_row:last_row] = positions[:, 0].reshape(-1, columns)
+            cells['km'][first_row:last_row] = distances[:, 0].reshape(-1, columns)
+        cells.flush()
+
+        np.savez(_schoolsPath(grid_file), school_ids=school_ids, lat=lat, lon=lon)
+        return cls(cells, school_ids, lat, lon)
+
+    @classmethod
+    def load(cls, grid_file=COVERAGE_GRID_FILE):
+        """Memory-map a grid saved by `build`."""
+        cells = np.load(grid_file, mmap_mode='r', allow_pickle=False)
+        with np.load(_schoolsPath(grid_file), allow_pickle=False) as schools:
+            return cls(cells, schools['school_ids'], schools['lat'], schools['lon'])
+
+    def cellOf(self, lat, lon):
+        """(row, column) of the cells holding the given points."""
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        row = np.clip(((lat + 90) // self.cell_degrees).astype(np.int64), 0, self.rows - 1)
+        column = (((lon + 180) % 360) // self.cell_degrees).astype(np.int64) % self.columns
+        return row, column
+
+    def lookup(self, lat, lon):
+        """Find the nearest school of each point's cell.
+
+        Returns (school_ids, distances_km), with the distances from the points themselves.
+        """
+        lat = np.atleast_1d(np.asarray(lat, dtype=np.float64))
+        lon = np.atleast_1d(np.asarray(lon, dtype=np.float64))
+        positions = self.cells['school'][self.cellOf(lat, lon)]
+        distances = nearest.haversine(
+            lat, lon, self.school_lat[positions], self.school_lon[positions])
+        return self.school_ids[positions], distances
+
+
+def loadLocatedSchools(data_file=None, id_column=None):
+    """Load (lat, lon, school_ids) of the geocoded schools of a geodata CSV.
+
+    Schools are identified by id_column, or by their row in the file.
+    """
+    # pylint: disable=import-outside-toplevel
+    import pandas as pd
+    if data_file is None:
+        from . import geocoder_googs as geocoder
+        data_file = geocoder.SCHOOL_GEODATA_FILE
+    school_df = pd.read_csv(data_file, dtype=str, keep_default_na=False)
+    lat = pd.to_numeric(school_df['Latitude'], errors='coerce').to_numpy()
+    lon = pd.to_numeric(school_df['Longitude'], errors='coerce').to_numpy()
+    located = np.isfinite(lat) & np.isfinite(lon)
+    school_ids = (
+        school_df[id_column].to_numpy().astype(str) if id_column else np.arange(len(school_df)))
+    return lat[located], lon[located], school_ids[located]
+
+
+def buildCoverageFile(data_file=None, grid_file=COVERAGE_GRID_FILE,
+                      resolution=COVERAGE_RESOLUTION, id_column=None):
+    """Build the coverage grid of the geocoded schools in a geodata CSV."""
+    lat, lon, school_ids = loadLocatedSchools(data_file, id_column)
+    if not len(lat):
+        raise ValueError('No geocoded schools to build a coverage grid from')
+    grid = CoverageGrid.build(lat, lon, grid_file, resolution, school_ids)
+    print('Built a %sx%s coverage grid of %s schools into %s' % (
+        grid.rows, grid.columns, len(lat), grid_file))
+    return grid
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data-file', help='Geodata CSV (default: SCHOOL_GEODATA_FILE)')
+    parser.add_argument('--grid-file', default=COVERAGE_GRID_FILE)
+    parser.add_argument('--resolution', type=float, default=COVERAGE_RESOLUTION,
+                        help='Cell size in degrees')
+    parser.add_argument('--id-column', help='Identify schools by this column, not their row')
+    parser.add_argument('--lookup', nargs=2, type=float, metavar=('LAT', 'LON'),
+                        help='Look up the nearest school in an existing grid')
+    args = parser.parse_args()
+
+    if args.lookup:
+        found_ids, found_km = CoverageGrid.load(args.grid_file).lookup(*args.lookup)
+        print('Nearest school: %s, %.1f km' % (found_ids[0], found_km[0]))
+    else:
+        buildCoverageFile(args.data_file, args.grid_file, args.resolution, args.id_column)
@@ -1,52 +1,132 @@
 """Fetches school data from the official WKSA website via web scraping with BS4."""
 # pylint: disable=invalid-name
 
+from concurrent.futures import ThreadPoolExecutor
 import csv
 from datetime import datetime
+import functools
 import io
+import os
 import re
 
 from bs4 import BeautifulSoup
-import country_converter as coco
-import phonenumbers as libphone
+import lxml.etree
+import lxml.html
 import requests
 
+from . import checkpoint
 from . import gcs
+from . import instrumentation
+from . import normalize
+from . import phone_cache
+from . import scheduler
+from . import shards
+from .countries import resolveCountryCodes
+from .page_cache import getPageCache
+from .school import CSV_HEADER, School, toRow
 
 
 SCHOOL_EXPORT_FILE = '../data/school_data.csv'
 
+KSW_SCHOOLS_PAGE = 'http://www.kuksoolwon.com/school-directory/'
+
+# Max number of pages fetched at once.  1 fetches every page serially.  Within it, the number
+# in flight adapts to how the site copes (see scheduler.py).
+FETCH_CONCURRENCY = int(os.environ.get('WKSA_FETCH_CONCURRENCY', 8))
+# fetchData stops fetching after this many seconds, under the function's 540s timeout
+FETCH_DEADLINE_SECONDS = int(os.environ.get('WKSA_FETCH_DEADLINE_SECONDS', 480))
+
+# Country page parser, one of PAGE_PARSERS: 'lxml' (default) or 'soup' (BeautifulSoup)
+PAGE_PARSER = os.environ.get('WKSA_PAGE_PARSER', 'lxml')
+
+_SESSION = None
+_SCHEDULER = None
+
+
+class DirectoryIncomplete(Exception):
+    """Some country pages could not be fetched, so the scrape would be missing their schools."""
+
 
 def isDirectRun():
     """Checks if this is being called as main or not."""
     return __name__ == '__main__'
 
+def getSession():
+    """Get the keep-alive session shared by all page fetches."""
+    global _SESSION  # pylint: disable=global-statement
+    if _SESSION is None:
+        _SESSION = requests.Session()
+        # Size the pool so concurrent fetches never throw away a connection
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=FETCH_CONCURRENCY, pool_maxsize=FETCH_CONCURRENCY)
+        _SESSION.mount('http://', adapter)
+        _SESSION.mount('https://', adapter)
+    return _SESSION
+
+def getScheduler():
+    """Get the scheduler of this run's requests, without a deadline unless fetchData set one."""
+    global _SCHEDULER  # pylint: disable=global-statement
+    if _SCHEDULER is None:
+        _SCHEDULER = scheduler.RequestScheduler(FETCH_CONCURRENCY)
+    return _SCHEDULER
+
+def startScheduler(deadline_seconds=FETCH_DEADLINE_SECONDS):
+    """Start a run's requests over, with a fresh concurrency limit and deadline."""
+    global _SCHEDULER  # pylint: disable=global-statement
+    _SCHEDULER = scheduler.RequestScheduler(
+        FETCH_CONCURRENCY, deadline=checkpoint.Deadline(deadline_seconds))
+    return _SCHEDULER
+
+def scheduledSession():
+    """The shared session, with its requests going through the run's scheduler."""
+    return getScheduler().wrap(getSession())
+
 def pullWksaCountryPages():
     """Scrapes the WKSA schools website for the list of countries WKSA has locations in."""
-    KSW_SCHOOLS_PAGE = 'http://www.kuksoolwon.com/school-directory/'
-    r = requests.get(KSW_SCHOOLS_PAGE)
-    schools_page = BeautifulSoup(r.text, 'lxml')
+    page = getPageCache().fetch(scheduledSession(), 'GET', KSW_SCHOOLS_PAGE)
+    if page['parsed'] is not None:
+        print('Reusing %s cached countries for WKSA' % len(page['parsed']))
+        return page['parsed']
+
+    schools_page = BeautifulSoup(page['body'], 'lxml')
     schools_navigation = schools_page.select('#menu-schools-submenu > li > a')
 
     print('Found %s countries for WKSA e' % len(schools_navigation))
 
+    country_names = [country_link.get_text() for country_link in schools_navigation]
+    country_codes = resolveCountryCodes(country_names)
+
     ksw_countries = []
-    for country_link in schools_navigation:
+    for country_link, country_name, country_code in zip(
+            schools_navigation, country_names, country_codes):
         link_href = country_link['href']
-        country_name = country_link.get_text()
-
-        country_code = coco.convert(names=[country_name], to='ISO2')
         print('%s  ->  %s (%s)' % (country_code, country_name, link_href))
         ksw_countries.append({
             'name': country_name,
             'link': link_href,
             'ISO-2': country_code
         })
+    getPageCache().storeParsed(page, ksw_countries)
     return ksw_countries
 
 
 # Country page processing
-def _getSchoolsContent(country_page, country_name, country_code):
+def _school(country_name, country_code, region, city, website, contact, instructor):
+    return School(
+        country_name=country_name,
+        country_code=country_code,
+        region=region.strip(),
+        city=city.strip(),
+        website=website,
+
+        # Instructors hand-edit this section, so remove excessive newlines
+        address=str(re.sub(r'(\r?\n)+', ' ', contact).strip()),
+        instructor=instructor.strip()
+    )
+
+def _soupSchools(page_body, country_name, country_code):
+    """Parse the schools with BeautifulSoup, building the tree of the whole page."""
+    country_page = BeautifulSoup(page_body, 'lxml')
     school_list = []
     subpage = country_page.select('div.schools_content > div')
 
@@ -62,20 +142,68 @@ def _getSchoolsContent(country_page, country_name, country_code):
             contact_div = section.select_one('div.contact')
             _ = [contact_br.insert_after('\n') for contact_br in contact_div.select('br')]
 
-            school_list.append({
-                'country_name': country_name,
-                'country_code': country_code,
-                'region': ksw_region.strip(),
-                'city': city_div.get_text().strip(),
+            school_list.append(_school(
+                country_name, country_code, ksw_region, city_div.get_text(),
+                # Homepage may not be present
+                city_div.a['href'] if city_div.a else '',
+                contact_div.get_text(),
+                section.select_one('div.instructor').get_text()
+            ))
+    return school_list
+
+def _hasClass(class_name):
+    """XPath predicate matching elements with the given class, like the CSS .class selector."""
+    return 'contains(concat(" ", normalize-space(@class), " "), " %s ")' % class_name
+
+_SCHOOL_SECTIONS = lxml.etree.XPath('//div[%s]/div' % _hasClass('schools_content'))
+_CITY_DIV = lxml.etree.XPath('.//div[%s]' % _hasClass('city'))
+_CONTACT_DIV = lxml.etree.XPath('.//div[%s]' % _hasClass('contact'))
+_INSTRUCTOR_DIV = lxml.etree.XPath('.//div[%s]' % _hasClass('instructor'))
+# The text BeautifulSoup's get_text() sees, which leaves out scripts, styles and comments
+_TEXT_NODES = lxml.etree.XPath('.//text()[not(parent::script or parent::style)]')
+
+def _text(element):
+    return ''.join(_TEXT_NODES(element))
+
+def _lxmlSchools(page_body, country_name, country_code):
+    """Parse the schools with lxml XPath queries, without building any BeautifulSoup objects."""
+    country_page = lxml.html.document_fromstring(page_body)
+    school_list = []
+
+    ksw_region = ''
+    for section in _SCHOOL_SECTIONS(country_page):
+        # Determine if this is a region header or a school
+        if 'region_name' in section.get('class', '').split():
+            ksw_region = _text(section).title()
+        else:
+            city_div = _CITY_DIV(section)[0]
+            city_link = city_div.find('.//a')
 
+            # Addresses are split by <br />s, which become newlines
+            contact_div = _CONTACT_DIV(section)[0]
+            for contact_br in contact_div.iter('br'):
+                contact_br.tail = '\n' + (contact_br.tail or '')
+
+            school_list.append(_school(
+                country_name, country_code, ksw_region, _text(city_div),
                 # Homepage may not be present
-                'website': city_div.a['href'] if city_div.a else '',
+                city_link.get('href', '') if city_link is not None else '',
+                _text(contact_div),
+                _text(_INSTRUCTOR_DIV(section)[0])
+            ))
+    return school_list
 
-                # Instructors hand-edit this section, so remove excessive newlines
-                'address': str(re.sub(r'(\r?\n)+', ' ', contact_div.get_text()).strip()),
-                'phone_numbers': [],
-                'instructor': section.select_one('div.instructor').get_text().strip()
-            })
+# Parser backend -> function parsing the schools out of a country page
+PAGE_PARSERS = {
+    'lxml': _lxmlSchools,
+    'soup': _soupSchools,
+}
+
+def _getSchoolsContent(page_body, country_name, country_code, parser=None):
+    parseSchools = PAGE_PARSERS[parser or PAGE_PARSER]
+    with instrumentation.timed('parse.page'):
+        school_list = parseSchools(page_body, country_name, country_code)
+    instrumentation.count('parse.schools', len(school_list))
     print('Found %s schools for %s' % (len(school_list), country_name))
     return school_list
 
@@ -83,22 +211,35 @@ def skipDirectoryInfo(*_):
     """No operation, reserved for countries with partial pages."""
     return []
 
+def _pullSchoolsPage(method, country_href, country_name, country_code, data=None):
+    """Fetch and parse a page of schools, reusing the cached schools if the page is unchanged."""
+    page_cache = getPageCache()
+    page = page_cache.fetch(scheduledSession(), method, country_href, data)
+    if page['parsed'] is not None:
+        print('Reusing %s cached schools for %s' % (len(page['parsed']), country_name))
+        return [School.fromDict(school) for school in page['parsed']]
+
+    school_list = _getSchoolsContent(page['body'], country_name, country_code)
+    page_cache.storeParsed(page, [school.toDict() for school in school_list])
+    return school_list
+
 def pullGenericDirectoryInfo(country_href, country_name, country_code):
     """Pull the school information from your average WKSA country page."""
-    r = requests.get(country_href)
-    country_page = BeautifulSoup(r.text, 'lxml')
-    return _getSchoolsContent(country_page, country_name, country_code)
+    return _pullSchoolsPage('GET', country_href, country_name, country_code)
+
+# US regions are navigated by POSTing the region's geo_id
+KSW_USA_GEO_IDS = range(1, 4 + 1)
+
+def pullUsaRegionInfo(country_href, country_name, country_code, geo_id):
+    """Pull the school information for a single US region."""
+    return _pullSchoolsPage(
+        'POST', country_href, country_name, country_code, data={'geo_id': geo_id})
 
 def pullUsaDirectoryInfo(country_href, country_name, country_code):
     """Pull the school information for America, because we're special."""
-    KSW_REGIONS = 4
-
     school_list = []
-    for geo_id in range(1, KSW_REGIONS + 1):
-        r = requests.post(country_href, data={'geo_id': geo_id})
-        usa_page = BeautifulSoup(r.text, 'lxml')
-        subregion_schools = _getSchoolsContent(usa_page, country_name, country_code)
-        school_list.extend(subregion_schools)
+    for geo_id in KSW_USA_GEO_IDS:
+        school_list.extend(pullUsaRegionInfo(country_href, country_name, country_code, geo_id))
     return school_list
 
 # Function map of how special countries should be handled
@@ -107,118 +248,140 @@ SPECIAL_COUNTRY_HANDLING = {
     'BR': skipDirectoryInfo
 }
 
-def separatePhoneNumbers(school_list):
-    """Strips out the phone numbers for a given country from the directory information."""
-    for school in school_list:
-        phone_index_min = len(school['address'])
-        school_address = str(school['address'])
-        for match in libphone.PhoneNumberMatcher(school_address, school['country_code']):
-            school['phone_numbers'].append(
-                str(libphone.format_number(match.number, libphone.PhoneNumberFormat.NATIONAL)))
-            phone_index_min = min(phone_index_min, match.start)
-
-        # Reformat the phone numbers to be semi-colon delimited, if present
-        school['phone_numbers'] = ';'.join(school['phone_numbers'])
+def _directoryTasks(country):
+    """Break a country into the pages that can be fetched independently of each other."""
+    country_args = (country['link'], country['name'], country['ISO-2'])
+    handleCountry = SPECIAL_COUNTRY_HANDLING.get(country['ISO-2'], pullGenericDirectoryInfo)
+    if handleCountry is pullUsaDirectoryInfo:
+        return [
+            functools.partial(pullUsaRegionInfo, *country_args, geo_id)
+            for geo_id in KSW_USA_GEO_IDS
+        ]
+    return [functools.partial(handleCountry, *country_args)]
+
+def _runDirectoryTask(task):
+    """Pull a page of schools, returning (schools, None), or (None, why) if it failed."""
+    try:
+        return task(), None
+    except (scheduler.FetchFailed, requests.RequestException) as error:
+        # A US region page also names its geo_id
+        page = ' '.join(str(arg) for arg in task.args[1:2] + task.args[3:])
+        print('Failed to fetch %s: %s' % (page, error))
+        instrumentation.count('fetch.failed_pages')
+        return None, '%s: %s' % (page, error)
+
+def pullDirectoryInfo(wksa_countries, concurrency=None):
+    """Pull the schools for every country, fetching up to `concurrency` pages at once.
+
+    Schools are always returned in country (then US region) order, so the output is the same
+    no matter how many pages are fetched at a time.
+
+    A page that still fails after its retries does not stop the others, but once they are done
+    DirectoryIncomplete is raised, listing every failed page: a scrape missing a country would
+    have geoETL remove its schools.  Running out of time raises checkpoint.DeadlineExceeded.
+    Either way, the schools fetched so far are discarded; only the page cache keeps their pages
+    for the next run.
+    """
+    concurrency = FETCH_CONCURRENCY if concurrency is None else concurrency
+    tasks = [task for country in wksa_countries for task in _directoryTasks(country)]
+
+    if concurrency <= 1:
+        page_results = [_runDirectoryTask(task) for task in tasks]
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            # map() yields in submission order regardless of completion order
+            page_results = list(executor.map(_runDirectoryTask, tasks))
+
+    failures = [failure for _, failure in page_results if failure is not None]
+    if failures:
+        raise DirectoryIncomplete('%s of %s pages failed, not exporting:\n%s' % (
+            len(failures), len(tasks), '\n'.join(failures)))
+    return [school for school_list, _ in page_results for school in school_list]
+
+def separatePhoneNumbers(school_list, cache=None, workers=None):
+    """Strips out the phone numbers for a given country from the directory information.
+
+    See phone_cache for the memoization and the process pool.
+    """
+    extracted = phone_cache.extractAll(
+        [(school.address, school.country_code) for school in school_list], cache, workers)
+    for school, (phone_numbers, phone_start) in zip(school_list, extracted):
+        # Phone numbers are semi-colon delimited, if present
+        school.phone_numbers = ';'.join(phone_numbers)
 
         # Remove the phone numbers from the address.  Go by section because multiple numbers get
         # are not represented uniformly (e.g. Palmdale, CA)
-        school['address'] = school['address'][:phone_index_min].strip()
-
-
-def exportCSV(school_list, scrape_region='WORLD'):
-    """Write the file locally or buffer for GCS upload."""
-    file_out = open(SCHOOL_EXPORT_FILE, 'w') if isDirectRun() else io.StringIO()
+        school.address = school.address[:phone_start].strip()
+
+
+def exportCSV(school_list, scrape_region='WORLD', streaming=None, shard_by=None):
+    """Write the file locally or buffer for GCS upload.
+
+    When streaming, rows are uploaded through a resumable upload as they are written, and
+    school_list can be any iterable (e.g. a generator) of schools.  With shard_by (default
+    WKSA_SHARD_BY), the GCS upload is split into shards instead; see shards.py.
+    """
+    streaming = gcs.STREAMING if streaming is None else streaming
+    shard_by = shards.SHARD_BY if shard_by is None else shard_by
+    blob_name = '%s/%s' % (scrape_region, datetime.today().strftime('%Y-%m-%d'))
+    if shard_by and not isDirectRun():
+        shards.exportShards(CSV_HEADER, list(map(toRow, school_list)), blob_name, shard_by)
+        return
+    if isDirectRun():
+        file_out = open(SCHOOL_EXPORT_FILE, 'w')
+    elif streaming:
+        file_out = gcs.openBlobWriter(gcs.getFetchBucket(), blob_name)
+    else:
+        file_out = io.StringIO()
 
     with file_out as csvout:
-        writer = csv.DictWriter(
-            csvout,
-            [
-                'country_name', 'country_code', 'city', 'region',
-                'address', 'website', 'phone_numbers', 'instructor'
-            ],
-            lineterminator='\n')
-
-        header = {
-            'country_name': 'Country',
-            'country_code': 'Country Code',
-            'region': 'Region',
-            'city': 'City',
-            'address': 'Address',
-            'website': 'Website',
-            'phone_numbers':'Phone #s',
-            'instructor': 'Instructor'
-        }
-
-        writer.writerow(header)
-        for school in school_list:
-            writer.writerow(school)
-
-        if not isDirectRun():
+        writer = csv.writer(csvout, lineterminator='\n')
+        writer.writerow(CSV_HEADER)
+        writer.writerows(map(toRow, school_list))
+
+        if not isDirectRun() and not streaming:
             # Save to GCS
+            gcs.uploadText(gcs.getFetchBucket(), blob_name, file_out.getvalue())
 
-            blob = gcs.getFetchBucket().blob(
-                '%s/%s' % (scrape_region, datetime.today().strftime('%Y-%m-%d'))
-            )
-            blob.upload_from_string(file_out.getvalue(), content_type='text/csv')
+    if isDirectRun():
+        # Keep a dated columnar copy in the local scrape history
+        from . import snapshots  # pylint: disable=import-outside-toplevel
+        snapshots.convertCSV(SCHOOL_EXPORT_FILE, datetime.today().strftime('%Y-%m-%d'), 'scrape')
 
 
 def handleHankuk(wksa_schools):
-    """Korean schools are formatted differently and needs some adjustment before geocoding."""
-    for school in wksa_schools:
-        if school['country_code'] != 'KR':
-            # School must be Korea
-            continue
-
-        # The 4th column has the region, but may contain multiple cities for a region
-        city_set = re.sub(r'\s[/|]\s', ' ', school['region']).split()
-        if len(city_set) > 1:
-            # Figure out which city we're in by using the address
-            for region in city_set:
-                if region in school['address']:
-                    school['region'] = region
-
-        # Split address as KR addresses list the instructor last, throwing off geocoding
-        tokenized_address = school['address'].split()
-        if school['region'] == school['address'].split()[-1]:
-            # If the last token in the address is the City, the City column is the Instructor.
-            # Replace it with token before the city in the address (should be district).
-            new_boundary = school['address'].split()[-2]
-            school['address'] += ' %s' % school['city']
-
-            # Keep the Instructor and retokenize the address
-            school['instructor'] = school['city']
-            school['city'] = new_boundary
-            tokenized_address = school['address'].split()
-
-        elif school['region'] not in school['address']:
-            # If region isn't in the address, then the City is in the Region. Fix all 3
-            # e.g. Dong-Gu Daegu
-            school['address'] += ' %s' % school['city']
-
-            # Region is generally last in KR WKSA addresses
-            school['region'] = school['city'].split()[-1]
-
-            # Retokenize the address and set the new city
-            tokenized_address = school['address'].split()
-            new_boundary = school['address'].split()[-2]
-            school['city'] = new_boundary
-
-        if school['region'] == tokenized_address[-3]:
-            # The last two tokens are the Instructor.  Cut and replace to Instructor column
-            school['instructor'] = ' '.join(tokenized_address[-2:])
-            school['address'] = ' '.join(tokenized_address[:-2])
+    """Korean schools are formatted differently and needs some adjustment before geocoding.
+
+    Only runs the KR rules of normalize.py; fetchData runs every country's.
+    """
+    normalize.normalizeSchools(wksa_schools, country_codes=['KR'])
 
 
 def fetchData():
     """Fetch all the data from the KSW website."""
-    wksa_countries = pullWksaCountryPages()
-    wksa_schools = []
-    for country in wksa_countries:
-        handleCountry = SPECIAL_COUNTRY_HANDLING.get(country['ISO-2'], pullGenericDirectoryInfo)
-        wksa_schools.extend(handleCountry(country['link'], country['name'], country['ISO-2']))
-    separatePhoneNumbers(wksa_schools)
-    handleHankuk(wksa_schools)
-    exportCSV(wksa_schools)
+    run_scheduler = startScheduler()
+    with instrumentation.timed('fetch.countries'):
+        wksa_countries = pullWksaCountryPages()
+    with instrumentation.timed('fetch.directory'):
+        try:
+            wksa_schools = pullDirectoryInfo(wksa_countries)
+        finally:
+            run_scheduler.report()
+    getPageCache().evict()
+    getPageCache().report()
+    phones = phone_cache.openPhoneCache()
+    try:
+        with instrumentation.timed('fetch.phones'):
+            separatePhoneNumbers(wksa_schools, phones)
+        with instrumentation.timed('fetch.normalize'):
+            normalize.normalizeSchools(wksa_schools)
+        with instrumentation.timed('fetch.export'):
+            exportCSV(wksa_schools)
+    finally:
+        # Keep whatever was extracted in the cache, even when the run fails
+        phones.close()
+    phones.report()
+    instrumentation.count('fetch.schools', len(wksa_schools))
     print('Exported %s WKSA schools' % len(wksa_schools))
 
 
@@ -0,0 +1,240 @@
+"""Offline city centroids, answering the City/Region geocoding fallback without the API.
+
+When a school's full address is not found, geocodeSchools falls back to its City and Region.
+City centroids never change, so with `GEOCODE_GAZETTEER` set to a compiled gazetteer (a local
+path or 'gs://<bucket>/<object>'), those lookups are answered locally and only the cities the
+gazetteer does not know are sent to Google.
+
+A gazetteer is compiled once from a GeoNames city dump (cities500.txt, cities15000.txt, ...)
+and, optionally, its admin1CodesASCII.txt, so regions match by name as well as by code:
+
+    python -m hohgwuhn.gazetteer cities15000.txt admin1CodesASCII.txt gazetteer.npz
+
+The compiled file is a few NumPy arrays (normalized names, float32 coordinates, populations),
+loaded without parsing.  Lookups go, in order, through (country, region, city), then (country,
+city), then a fuzzy match on the city name (e.g. 'Crystal Lke') within the region and then the
+country.  A city outside the given region only answers when it is the only city of its name in
+the country, or when no region was given (then the most populous city of the name wins), so
+e.g. 'Springfield, Illinois' never lands in Missouri; it goes to Google instead.  Answers look
+like a Google 'APPROXIMATE' result, addressed with the matched city's own region, so the rest
+of the pipeline treats them like any locality.
+"""
+import csv
+import difflib
+import io
+import os
+import re
+import sys
+import unicodedata
+
+import numpy as np
+
+from . import gcs
+
+
+GAZETTEER_LOCATION = os.environ.get('GEOCODE_GAZETTEER', '')
+
+# Minimum difflib ratio for a fuzzy city name match
+FUZZY_CUTOFF = 0.85
+
+# Columns of the GeoNames dump; see https://download.geonames.org/export/dump/readme.txt
+GEONAMES_NAME = 1
+GEONAMES_ASCII_NAME = 2
+GEONAMES_LATITUDE = 4
+GEONAMES_LONGITUDE = 5
+GEONAMES_COUNTRY = 8
+GEONAMES_ADMIN1 = 10
+GEONAMES_POPULATION = 14
+
+# Saved as UTF-8 bytes, a quarter of the size of NumPy's fixed width unicode
+TEXT_COLUMNS = ['country', 'region_keys', 'city_keys', 'ascii_keys', 'names', 'region_names']
+
+_COMBINING_MARKS = re.compile('[\u0300-\u036f]')
+_NON_WORD = re.compile(r'[\W_]+')
+
+
+def normalizeName(name):
+    """Fold case, accents, punctuation and runs of whitespace out of a place name."""
+    name = _COMBINING_MARKS.sub('', unicodedata.normalize('NFKD', name))
+    return _NON_WORD.sub(' ', unicodedata.normalize('NFC', name).casefold()).strip()
+
+
+class Gazetteer:
+    """City centroids indexed by normalized (country, region, city) names."""
+    def __init__(self, country, region_keys, city_keys, ascii_keys, names, region_names, lat,
+                 lon, population):
+        self.country = country
+        self.region_keys = region_keys
+        self.city_keys = city_keys
+        self.ascii_keys = ascii_keys
+        self.names = names
+        # Display name of each city's region: its admin1 name, or its code without one
+        self.region_names = region_names
+        self.lat = lat
+        self.lon = lon
+        self.population = population
+        # Fuzzy matches found so far, by (country, region, city) key
+        self._fuzzy_memo = {}
+        self._buildIndex()
+
+    def _buildIndex(self):
+        # Visit the most populous cities first, so they win any shared key
+        order = np.argsort(-self.population, kind='stable').tolist()
+        country = self.country.tolist()
+        region_keys = self.region_keys.tolist()
+        city_keys = self.city_keys.tolist()
+        ascii_keys = self.ascii_keys.tolist()
+
+        self.places = {}
+        self.country_cities = {}
+        # Number of cities known by each (country, city) key
+        self.city_counts = {}
+        self.region_pools = {}
+        self.country_pools = {}
+        for index in order:
+            # ASCII keys are only kept where they differ from the city key
+            city_names = {city_keys[index], ascii_keys[index] or city_keys[index]}
+            # Region keys are '|' joined, as a region can be known by its code and its name
+            regions = region_keys[index].split('|')
+            for city in city_names:
+                self.city_counts[(country[index], city)] = (
+                    self.city_counts.get((country[index], city), 0) + 1)
+                self.country_cities.setdefault((country[index], city), index)
+                self.country_pools.setdefault(country[index], {}).setdefault(city, index)
+                for region in regions:
+                    self.places.setdefault((country[index], region, city), index)
+                    self.region_pools.setdefault(
+                        (country[index], region), {}).setdefault(city, index)
+
+    @classmethod
+    def fromGeoNames(cls, cities_file, admin1_file=None):
+        """Compile a gazetteer from GeoNames city and (optionally) admin1 code dumps."""
+        admin1_names = {}
+        if admin1_file:
+            for row in csv.reader(admin1_file, delimiter='\t', quoting=csv.QUOTE_NONE):
+                if len(row) >= 3:
+                    # e.g. 'US.IL' -> 'Illinois', and its keys, also under its ASCII name
+                    admin1_names[row[0]] = (
+                        row[1], {normalizeName(row[1]), normalizeName(row[2])})
+
+        columns = {
+            'country': [], 'region_keys': [], 'city_keys': [], 'ascii_keys': [], 'names': [],
+            'region_names': [], 'lat': [], 'lon': [], 'population': [],
+        }
+        for row in csv.reader(cities_file, delimiter='\t', quoting=csv.QUOTE_NONE):
+            if len(row) <= GEONAMES_POPULATION:
+                continue
+            country, admin1 = row[GEONAMES_COUNTRY], row[GEONAMES_ADMIN1]
+            region_name, region_keys = admin1_names.get(
+                '%s.%s' % (country, admin1), (admin1, set()))
+            regions = {normalizeName(admin1)} | region_keys
+            columns['country'].append(country)
+            columns['region_keys'].append('|'.join(sorted(regions)))
+            city_key, ascii_key = normalizeName(row[GEONAMES_NAME]), normalizeName(
+                row[GEONAMES_ASCII_NAME])
+            columns['city_keys'].append(city_key)
+            columns['ascii_keys'].append('' if ascii_key == city_key else ascii_key)
+            columns['names'].append(row[GEONAMES_NAME])
+            columns['region_names'].append(region_name)
+            columns['lat'].append(float(row[GEONAMES_LATITUDE]))
+            columns['lon'].append(float(row[GEONAMES_LONGITUDE]))
+            columns['population'].append(int(row[GEONAMES_POPULATION] or 0))
+
+        return cls(
+            np.array(columns['country'], dtype=str),
+            np.array(columns['region_keys'], dtype=str),
+            np.array(columns['city_keys'], dtype=str),
+            np.array(columns['ascii_keys'], dtype=str),
+            np.array(columns['names'], dtype=str),
+            np.array(columns['region_names'], dtype=str),
+            np.array(columns['lat'], dtype=np.float32),
+            np.array(columns['lon'], dtype=np.float32),
+            np.array(columns['population'], dtype=np.int32),
+        )
+
+    def save(self, path):
+        """Save the gazetteer as an uncompressed .npz, with its names as UTF-8 bytes."""
+        np.savez(
+            path, lat=self.lat, lon=self.lon, population=self.population,
+            **{column: np.char.encode(getattr(self, column), 'utf-8') for column in TEXT_COLUMNS})
+
+    @classmethod
+    def load(cls, path_or_file):
+        """Load a gazetteer saved with `save`."""
+        with np.load(path_or_file, allow_pickle=False) as saved:
+            text = {column: np.char.decode(saved[column], 'utf-8') for column in TEXT_COLUMNS}
+            return cls(
+                lat=saved['lat'], lon=saved['lon'], population=saved['population'], **text)
+
+    def __len__(self):
+        return len(self.lat)
+
+    def _outsideRegion(self, country_code, region, city):
+        """Whether a city of the country outside the region may answer for it."""
+        # With several cities of the name, the region has to pick; guessing only goes without one
+        return not region or self.city_counts.get((country_code, city), 0) == 1
+
+    def _fuzzyMatch(self, country_code, region, city):
+        key = (country_code, region, city)
+        if key not in self._fuzzy_memo:
+            index = None
+            region_pool = self.region_pools.get((country_code, region)) or {}
+            matches = difflib.get_close_matches(city, region_pool, n=1, cutoff=FUZZY_CUTOFF)
+            if matches:
+                index = region_pool[matches[0]]
+            else:
+                country_pool = self.country_pools.get(country_code) or {}
+                matches = difflib.get_close_matches(city, country_pool, n=1, cutoff=FUZZY_CUTOFF)
+                if matches and self._outsideRegion(country_code, region, matches[0]):
+                    index = country_pool[matches[0]]
+            self._fuzzy_memo[key] = index
+        return self._fuzzy_memo[key]
+
+    def lookup(self, country_code, region, city):
+        """Get the index of the best matching city, or None if there is no match."""
+        country_code = country_code.strip().upper()
+        region, city = normalizeName(region), normalizeName(city)
+        index = self.places.get((country_code, region, city))
+        if index is None and self._outsideRegion(country_code, region, city):
+            index = self.country_cities.get((country_code, city))
+        if index is None and city:
+            index = self._fuzzyMatch(country_code, region, city)
+        return index
+
+    def geocode(self, country_code, region, city):
+        """Get a Google-style geocoding result for the city, or None if there is no match."""
+        index = self.lookup(country_code, region, city)
+        if index is None:
+            return None
+        address_parts = [self.names[index], self.region_names[index], self.country[index]]
+        return {
+            'formatted_address': ', '.join(part for part in address_parts if part),
+            'geometry': {
+                'location': {'lat': float(self.lat[index]), 'lng': float(self.lon[index])},
+                'location_type': 'APPROXIMATE',
+            },
+        }
+
+
+def openGazetteer(location=GAZETTEER_LOCATION):
+    """Load the gazetteer configured by GEOCODE_GAZETTEER, or None if none is configured."""
+    if not location:
+        return None
+    if location.startswith('gs://'):
+        bucket_name, _, blob_name = location[len('gs://'):].partition('/')
+        blob = gcs.getBucket(bucket_name).blob(blob_name)
+        return Gazetteer.load(io.BytesIO(blob.download_as_string()))
+    return Gazetteer.load(location)
+
+
+if __name__ == '__main__':
+    cities_path, admin1_path, output_path = (
+        sys.argv[1:4] if len(sys.argv) == 4 else (sys.argv[1], None, sys.argv[2]))
+    with open(cities_path, 'r', encoding='utf-8') as cities_in:
+        if admin1_path:
+            with open(admin1_path, 'r', encoding='utf-8') as admin1_in:
+                compiled = Gazetteer.fromGeoNames(cities_in, admin1_in)
+        else:
+            compiled = Gazetteer.fromGeoNames(cities_in)
+    compiled.save(output_path)
+    print('Compiled %s cities into %s' % (len(compiled), output_path))
@@ -1,16 +1,62 @@
 """Utility functions for dealing with GCS and associated files."""
-from google.cloud import storage
+import io
+import os
+
+from . import instrumentation
 
 
 GCLOUD_FETCH_BUCKET = 'pandelyon-hoh-gwuhn-fetch'
 GCLOUD_GEOCODE_BUCKET = 'pandelyon-hoh-gwuhn-geocode'
 
-GCS_CLIENT = storage.Client()
+# In streaming mode, files are read and written through chunked / resumable blob streams rather
+# than held whole in memory, so peak memory stays flat no matter how large the files get.
+STREAMING = os.environ.get('HOHGWUHN_STREAMING', '0') == '1'
+# Must be a multiple of 256 KiB for resumable uploads
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+_GCS_CLIENT = None
+
+def getClient():
+    """Get the GCS client, created on first use to keep cold starts fast."""
+    global _GCS_CLIENT  # pylint: disable=global-statement
+    if _GCS_CLIENT is None:
+        from google.cloud import storage  # pylint: disable=import-outside-toplevel
+        _GCS_CLIENT = storage.Client()
+    return _GCS_CLIENT
+
+def getBucket(bucket_name):
+    """Get a bucket by name."""
+    return getClient().get_bucket(bucket_name)
 
 def getFetchBucket():
     """Get the bucket used for storing scraped data."""
-    return GCS_CLIENT.get_bucket(GCLOUD_FETCH_BUCKET)
+    return getBucket(GCLOUD_FETCH_BUCKET)
 
 def getGeocodeBucket():
     """Get the bucket used for storing geocoded data."""
-    return GCS_CLIENT.get_bucket(GCLOUD_GEOCODE_BUCKET)
+    return getBucket(GCLOUD_GEOCODE_BUCKET)
+
+def openBlobReader(bucket, blob_name, streaming=None):
+    """Open a CSV blob for reading as text, streamed in chunks when streaming."""
+    streaming = STREAMING if streaming is None else streaming
+    blob = bucket.blob(blob_name)
+    if streaming:
+        instrumentation.count('gcs.streams_read')
+        return blob.open('r', chunk_size=STREAM_CHUNK_SIZE, newline='')
+    with instrumentation.timed('gcs.download'):
+        content = blob.download_as_string()
+    instrumentation.count('gcs.bytes_read', len(content))
+    return io.StringIO(content.decode(), newline='')
+
+def openBlobWriter(bucket, blob_name, content_type='text/csv'):
+    """Open a blob for writing text through a resumable upload, finished when closed."""
+    instrumentation.count('gcs.streams_written')
+    return bucket.blob(blob_name).open(
+        'w', chunk_size=STREAM_CHUNK_SIZE, content_type=content_type)
+
+def uploadText(bucket, blob_name, text, content_type='text/csv'):
+    """Upload a whole text file to a blob in one request."""
+    content = text.encode()
+    with instrumentation.timed('gcs.upload'):
+        bucket.blob(blob_name).upload_from_string(content, content_type=content_type)
+    instrumentation.count('gcs.bytes_written', len(content))
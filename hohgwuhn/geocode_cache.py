@@ -0,0 +1,207 @@
+"""Persistent cache of Google geocoding results, so unchanged addresses are not paid for twice.
+
+Results are keyed on the normalized (address, country code) pair, and only the fields that
+geocoder_googs needs from each result are kept:
+
+    [{'geometry': {'location': {'lat', 'lng'}, 'location_type'}, 'formatted_address'}, ...]
+
+The backend is chosen by `GEOCODE_CACHE`:
+    - '' (default): caching disabled
+    - 'gs://<bucket>/<object>': a single JSON object in GCS, loaded at start and saved at the end
+    - anything else: a local SQLite database file
+
+Entries older than `GEOCODE_CACHE_TTL` seconds are treated as misses, and only the
+`GEOCODE_CACHE_MAX_ENTRIES` most recently used entries are kept.
+
+A SQLite cache can be shared by concurrent processes, e.g. the workers of shards.runLocal.  It is
+kept in WAL mode and every write commits as it is made, rather than holding the write lock until
+the end of the run; a process waits up to `GEOCODE_CACHE_SQLITE_TIMEOUT` seconds for another's.
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from . import gcs
+
+
+GEOCODE_CACHE_LOCATION = os.environ.get('GEOCODE_CACHE', '')
+GEOCODE_CACHE_TTL = int(os.environ.get('GEOCODE_CACHE_TTL', 180 * 24 * 60 * 60))
+GEOCODE_CACHE_MAX_ENTRIES = int(os.environ.get('GEOCODE_CACHE_MAX_ENTRIES', 50000))
+GEOCODE_CACHE_SQLITE_TIMEOUT = float(os.environ.get('GEOCODE_CACHE_SQLITE_TIMEOUT', 30))
+
+
+def cacheKey(address, country_code):
+    """Normalize an address lookup so trivially different spellings share an entry."""
+    return '%s|%s' % (country_code.strip().upper(), re.sub(r'\s+', ' ', address).strip().lower())
+
+
+def trimResults(results):
+    """Keep only the parts of the geocoding results that are used downstream."""
+    return [{
+        'geometry': {
+            'location': {
+                'lat': result['geometry']['location']['lat'],
+                'lng': result['geometry']['location']['lng'],
+            },
+            'location_type': result['geometry']['location_type'],
+        },
+        'formatted_address': result['formatted_address'],
+    } for result in results]
+
+
+class SqliteCacheBackend:
+    """Keeps cache entries in a table of a local SQLite database."""
+    def __init__(self, db_path, table='geocode', timeout=GEOCODE_CACHE_SQLITE_TIMEOUT):
+        self.table = table
+        # Autocommit, so the write lock is only held for each statement
+        self.connection = sqlite3.connect(
+            db_path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        # Readers carry on while another process writes, and commits skip the fsync, which at
+        # worst loses the last few entries to a power cut
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        # Take the write lock up front, as a read upgraded to a write fails without waiting
+        # when another process committed in between
+        self.connection.execute('BEGIN IMMEDIATE')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS %s ('
+            ' key TEXT PRIMARY KEY, results TEXT, stored_at REAL, last_used REAL)' % table)
+        self.connection.execute(
+            'CREATE INDEX IF NOT EXISTS %s_last_used ON %s (last_used)' % (table, table))
+        self.connection.execute('COMMIT')
+
+    def get(self, key):
+        """Get (results, stored_at) for the key, or None."""
+        row = self.connection.execute(
+            'SELECT results, stored_at FROM %s WHERE key = ?' % self.table, (key,)).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def put(self, key, results, stored_at):
+        """Save the results for the key."""
+        self.connection.execute(
+            'INSERT OR REPLACE INTO %s VALUES (?, ?, ?, ?)' % self.table,
+            (key, json.dumps(results), stored_at, stored_at))
+
+    def touch(self, key, last_used):
+        """Mark the entry as used."""
+        self.connection.execute(
+            'UPDATE %s SET last_used = ? WHERE key = ?' % self.table, (last_used, key))
+
+    def evict(self, expire_before, max_entries):
+        """Drop expired entries and all but the max_entries most recently used ones."""
+        removed = self.connection.execute(
+            'DELETE FROM %s WHERE stored_at < ?' % self.table, (expire_before,)).rowcount
+        removed += self.connection.execute(
+            'DELETE FROM %s WHERE key NOT IN ('
+            ' SELECT key FROM %s ORDER BY last_used DESC LIMIT ?)' % (self.table, self.table),
+            (max_entries,)).rowcount
+        return removed
+
+    def flush(self):
+        """Persist any pending changes."""
+        self.connection.commit()
+
+
+class GCSCacheBackend:
+    """Keeps cache entries in memory, persisted as a single JSON object in GCS."""
+    def __init__(self, blob):
+        self.blob = blob
+        self.entries = json.loads(blob.download_as_string().decode()) if blob.exists() else {}
+        self.dirty = False
+
+    def get(self, key):
+        """Get (results, stored_at) for the key, or None."""
+        entry = self.entries.get(key)
+        return (entry['results'], entry['stored_at']) if entry else None
+
+    def put(self, key, results, stored_at):
+        """Save the results for the key."""
+        self.entries[key] = {'results': results, 'stored_at': stored_at, 'last_used': stored_at}
+        self.dirty = True
+
+    def touch(self, key, last_used):
+        """Mark the entry as used."""
+        self.entries[key]['last_used'] = last_used
+        self.dirty = True
+
+    def evict(self, expire_before, max_entries):
+        """Drop expired entries and all but the max_entries most recently used ones."""
+        live_keys = sorted(
+            (key for key, entry in self.entries.items() if entry['stored_at'] >= expire_before),
+            key=lambda key: self.entries[key]['last_used'],
+            reverse=True
+        )[:max_entries]
+        removed = len(self.entries) - len(live_keys)
+        if removed:
+            self.entries = {key: self.entries[key] for key in live_keys}
+            self.dirty = True
+        return removed
+
+    def flush(self):
+        """Persist any pending changes."""
+        if self.dirty:
+            self.blob.upload_from_string(
+                json.dumps(self.entries), content_type='application/json')
+            self.dirty = False
+
+
+def openCacheBackend(location, table='geocode'):
+    """Get the backend for a GEOCODE_CACHE style location, or None if caching is disabled."""
+    if not location:
+        return None
+    if location.startswith('gs://'):
+        bucket_name, _, blob_name = location[len('gs://'):].partition('/')
+        return GCSCacheBackend(gcs.getBucket(bucket_name).blob(blob_name))
+    return SqliteCacheBackend(location, table)
+
+
+class GeocodeCache:
+    """TTL and LRU bounded cache in front of the geocoding API."""
+    def __init__(self, backend, ttl=GEOCODE_CACHE_TTL, max_entries=GEOCODE_CACHE_MAX_ENTRIES):
+        self.backend = backend
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, address, country_code):
+        """Get the cached results for an address, or None if not cached (or expired)."""
+        key = cacheKey(address, country_code)
+        now = time.time()
+        with self._lock:
+            entry = self.backend.get(key)
+            if entry is None or now - entry[1] > self.ttl:
+                self.misses += 1
+                return None
+            self.backend.touch(key, now)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, address, country_code, results):
+        """Cache the results for an address."""
+        with self._lock:
+            self.backend.put(cacheKey(address, country_code), trimResults(results), time.time())
+
+    def close(self):
+        """Apply eviction and persist the cache."""
+        with self._lock:
+            self.backend.evict(time.time() - self.ttl, self.max_entries)
+            self.backend.flush()
+
+    def report(self):
+        """Print the cache hit rate for this run, returning it."""
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0.0
+        print('Geocode cache: %s hits, %s misses (%.1f%% hit rate)' % (
+            self.hits, self.misses, 100 * hit_rate))
+        return hit_rate
+
+
+def openGeocodeCache(location=GEOCODE_CACHE_LOCATION):
+    """Get the geocode cache configured by GEOCODE_CACHE, or None if caching is disabled."""
+    backend = openCacheBackend(location)
+    return GeocodeCache(backend) if backend else None
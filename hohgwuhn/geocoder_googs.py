@@ -5,21 +5,66 @@ When saving to local disk, uses 'data/school_geodata.csv'.
 When saving to GCS, uses the same folder/file path as fetch.py
 
 Uses the Google Maps Geocoding API.
+
+In incremental mode (the default, disable with GEOCODE_INCREMENTAL=0), the most recent prior
+geodata file is joined against the new scrape, and only schools whose address columns changed
+are sent to the API.
+
+In streaming mode (HOHGWUHN_STREAMING=1), the scrape is read, geocoded and saved to the
+checkpoint GEOCODE_CHUNK_ROWS schools at a time, and the geodata file is then written from the
+checkpoint part by part, so memory stays flat regardless of file size.  The prior
+geodata join needs the whole file, so it is skipped; use the geocode cache for reuse instead.
+
+Progress is checkpointed a chunk of GEOCODE_CHUNK_ROWS schools at a time, so a run that hits its
+deadline or fails resumes where it stopped; see checkpoint.py.  Close to the deadline, chunks are
+geocoded in smaller parts of only as many schools as GEOCODE_QPS allows in the time left, so the
+last part started is not lost to the deadline.  Failed API calls are retried up to
+GEOCODE_RETRIES times, backing off exponentially from GEOCODE_BACKOFF_SECONDS.
+
+With GEOCODE_GAZETTEER set (see gazetteer.py), the City/Region fallback for addresses that were
+not found is answered from an offline gazetteer, and only its misses are sent to the API.
 """
 
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import glob
 import io
-import json
 import os
+import random
+import threading
+import time
 
-import googlemaps
+import numpy as np
 import pandas as pd
 
-from . import fetch_wksa as fetch
+from . import checkpoint
 from . import gcs
+from . import instrumentation
+from . import shards
+from .gazetteer import openGazetteer
+from .geocode_cache import openGeocodeCache
 
 
 SCHOOL_GEODATA_FILE = '../data/school_geodata.csv'
 
+GEOCODE_INCREMENTAL = os.environ.get('GEOCODE_INCREMENTAL', '1') != '0'
+
+# The googlemaps client throttles itself to the QPS.  Use enough workers to keep it saturated
+# despite the round trip time of each call.
+GEOCODE_QPS = int(os.environ.get('GEOCODE_QPS', 30))
+GEOCODE_WORKERS = int(os.environ.get('GEOCODE_WORKERS', 12))
+
+GEOCODE_CHUNK_ROWS = int(os.environ.get('GEOCODE_CHUNK_ROWS', 2000))
+
+GEOCODE_RETRIES = int(os.environ.get('GEOCODE_RETRIES', 4))
+GEOCODE_BACKOFF_SECONDS = float(os.environ.get('GEOCODE_BACKOFF_SECONDS', 1))
+
+# A school is unchanged if all of these match the prior geodata.  Country Code is missing from
+# the oldest (US only) snapshots, so it is only used when present.
+GEOCODE_JOIN_COLUMNS = ['Country Code', 'Region', 'City', 'Address']
+GEOCODE_REQUIRED_JOIN_COLUMNS = ['Region', 'City', 'Address']
+GEOCODE_RESULT_COLUMNS = ['Latitude', 'Longitude', 'Geocode Type', 'Google Address']
+
 
 def exportGeoData(school_df, file_name=None):
     """Write the geodata file from the dataframe, either to GCS or locally."""
@@ -30,33 +75,148 @@ def exportGeoData(school_df, file_name=None):
 
     if file_name:
         # Save to GCS
-        blob = gcs.getGeocodeBucket().blob('%s' % file_name)
-        blob.upload_from_string(file_out.getvalue(), content_type='text/csv')
+        gcs.uploadText(gcs.getGeocodeBucket(), file_name, file_out.getvalue())
+    else:
+        # Keep a dated columnar copy in the local scrape history
+        from . import snapshots  # pylint: disable=import-outside-toplevel
+        file_out.close()
+        snapshots.writeSnapshot(school_df, datetime.today().strftime('%Y-%m-%d'), 'geodata')
 
 class LimitedApiManager:
     """Abstraction around any geocoding APIs that this file may need."""
-    def __init__(self, cps):
+    def __init__(self, cps, cache=None, deadline=None):
+        import googlemaps  # pylint: disable=import-outside-toplevel
         self.client = googlemaps.Client(
             key=os.environ['GOOGLE_GEOCODE_API_KEY'],
             queries_per_second=cps,
         )
+        # Errors worth another try; anything else (e.g. a bad key) fails straight away
+        self.retryable_errors = (
+            googlemaps.exceptions.Timeout,
+            googlemaps.exceptions.TransportError,
+            googlemaps.exceptions.HTTPError,
+            googlemaps.exceptions._OverQueryLimit,  # pylint: disable=protected-access
+        )
+        self.cache = cache
+        self.deadline = deadline or checkpoint.Deadline(0)
+        self.api_calls = 0
+        self._lock = threading.Lock()
 
     def get(self, address, country_code):
-        """Get the geocoding results for a given address."""
+        """Get the geocoding results for a given address, from the cache when possible."""
+        results = self.cache.get(address, country_code) if self.cache else None
+        if results is not None:
+            print('  Cached %s %s results for: %s' % (len(results), country_code, address))
+            instrumentation.count('geocode.cache_hits')
+            return results
+
+        if self.deadline.expired():
+            raise checkpoint.DeadlineExceeded(
+                'No time left to geocode %s (%s)' % (address, country_code))
+
         # Filter by country code to isolate the search to the correct areas
         print('  Fetching %s (%s)' % (address, country_code))
-        results = self.client.geocode(address=address, components={'country': country_code})
+        with self._lock:
+            self.api_calls += 1
+        instrumentation.count('geocode.api_calls')
+        results = self._geocodeWithRetries(address, country_code)
         print('  Found %s %s results for: %s' % (len(results), country_code, address))
+        if self.cache:
+            self.cache.put(address, country_code, results)
         return results
 
+    def _geocodeWithRetries(self, address, country_code):
+        for attempt in range(GEOCODE_RETRIES + 1):
+            try:
+                with instrumentation.timed('geocode.call'):
+                    return self.client.geocode(
+                        address=address, components={'country': country_code})
+            except self.retryable_errors as error:
+                if attempt == GEOCODE_RETRIES:
+                    raise
+                # Full jitter, so threads failing together do not retry together
+                delay = random.uniform(0, GEOCODE_BACKOFF_SECONDS * 2 ** attempt)
+                if not self.deadline.allows(delay):
+                    raise checkpoint.DeadlineExceeded(
+                        'No time left to retry %s (%s)' % (address, country_code)) from error
+                print('  Retrying %s (%s) in %.1fs after %r' % (
+                    address, country_code, delay, error))
+                instrumentation.count('geocode.retries')
+                time.sleep(delay)
+
+    def close(self):
+        """Persist the cache and report how it did for this run."""
+        print('Geocoding API calls: %s' % self.api_calls)
+        if self.cache:
+            self.cache.close()
+            self.cache.report()
 
-def _loadGCSDataFile(file_name):
+
+def _loadGCSDataFile(file_name, streaming=None):
     """Get a file handle for a file from GCS."""
-    file_stream = io.StringIO(
-        gcs.getFetchBucket().blob(file_name).download_as_string().decode(),
-        newline=''
+    return gcs.openBlobReader(gcs.getFetchBucket(), file_name, streaming)
+
+
+def _findPriorGeoData(file_name=None):
+    """Get a file handle for the most recent geodata file before this one, or None.
+
+    On GCS, that is the latest object under the same folder.  Locally, it is the current
+    geodata file (about to be overwritten) or else the latest dated snapshot in data/.
+    """
+    if file_name and shards.isShardName(file_name):
+        # Shards reuse the geodata of the whole scrape before their run
+        file_name = shards.runName(file_name)
+    if file_name:
+        folder = file_name.rsplit('/', 1)[0] + '/' if '/' in file_name else ''
+        prior_names = sorted(
+            blob.name for blob in gcs.getGeocodeBucket().list_blobs(prefix=folder)
+            if blob.name < file_name
+        )
+        if not prior_names:
+            return None
+        print('Reusing geodata from %s' % prior_names[-1])
+        return gcs.openBlobReader(gcs.getGeocodeBucket(), prior_names[-1], streaming=False)
+
+    snapshots = sorted(glob.glob(os.path.join(
+        os.path.dirname(SCHOOL_GEODATA_FILE), '*', os.path.basename(SCHOOL_GEODATA_FILE))))
+    prior_files = [SCHOOL_GEODATA_FILE] if os.path.exists(SCHOOL_GEODATA_FILE) else snapshots[-1:]
+    if not prior_files:
+        return None
+    print('Reusing geodata from %s' % prior_files[0])
+    return open(prior_files[0], 'r')
+
+
+def applyPriorGeoData(school_df, prior_df):
+    """Copy the geocoding results of unchanged schools from the prior geodata.
+
+    Sets the result columns on school_df, blank where there is nothing to reuse, and returns a
+    boolean Series of the rows that still need to be geocoded.
+    """
+    usable_prior = prior_df is not None and all(
+        column in prior_df.columns
+        for column in GEOCODE_REQUIRED_JOIN_COLUMNS + GEOCODE_RESULT_COLUMNS
     )
-    return file_stream
+    if not usable_prior:
+        for column in GEOCODE_RESULT_COLUMNS:
+            school_df[column] = pd.Series('', index=school_df.index, dtype=object)
+        return pd.Series(True, index=school_df.index)
+
+    join_columns = [column for column in GEOCODE_JOIN_COLUMNS if column in prior_df.columns]
+
+    # Only reuse schools that were actually found, and once per address
+    prior_df = prior_df.loc[prior_df['Latitude'] != '', join_columns + GEOCODE_RESULT_COLUMNS]
+    prior_df = prior_df.drop_duplicates(join_columns, keep='last')
+
+    # Left merges keep the row order of the scrape, so results line up with school_df
+    merged = school_df[join_columns].astype(str).merge(
+        prior_df, on=join_columns, how='left', validate='many_to_one')
+    merged.index = school_df.index
+    for column in GEOCODE_RESULT_COLUMNS:
+        school_df[column] = merged[column].astype(object).fillna('')
+
+    needs_geocode = merged['Latitude'].isna()
+    print('Reusing geodata for %s of %s schools' % ((~needs_geocode).sum(), len(school_df)))
+    return needs_geocode
 
 
 def _handleResponse(results, assure_address=True):
@@ -66,6 +226,8 @@ def _handleResponse(results, assure_address=True):
     better to buildings than geographic centers.  So if we are willing to relax
     address constraints, then filter on that type of result when possible.
     """
+    if not results:
+        return None
     if len(results) != 1:
         if assure_address:
             return None
@@ -83,55 +245,290 @@ def _handleResponse(results, assure_address=True):
     return results[0]
 
 
-def loadSchoolData(file_name=None):
-    """Load school data from a file and process it."""
-    data_file = _loadGCSDataFile(file_name) if file_name else open(fetch.SCHOOL_EXPORT_FILE, 'r')
-    geocode_api = LimitedApiManager(30)
-
-    school_df = pd.read_csv(data_file, keep_default_na=False)
-    school_list = []  # Save each row for later re-write
-    for row_tuple in school_df.iterrows():
-        # Fetch the address first.  If it fails, switch to city+state
-        geocode_data = {
-            'lat': '',
-            'lon': '',
-            'type': '',
-            'formatted_address': '',
-        }
-        item = row_tuple[1]
-        print('Processing %s' % item['Address'])
-        geodata = (
-            item['Address'] and _handleResponse(
-                geocode_api.get(address=item['Address'], country_code=item['Country Code'])
-            ) or
-            _handleResponse(
-                geocode_api.get(
-                    address=('%s, %s' % (item['City'], item['Region'])),
-                    country_code=item['Country Code']
-                ),
-                assure_address=False
-            ))
-        if not geodata:
-            print('  Unable to find geodata for:\n%s' % json.dumps(item, indent=2))
-            continue
+def _lookupAll(geocode_api, queries, workers):
+    """Look up each distinct (address, country code) query once, spread over the workers."""
+    unique_queries = list(dict.fromkeys(queries))
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        results = executor.map(
+            lambda query: geocode_api.get(address=query[0], country_code=query[1]),
+            unique_queries
+        )
+        return dict(zip(unique_queries, results))
+
+
+def _lookupGazetteer(gazetteer, places):
+    """Answer each distinct (city, region, country code) place the gazetteer knows."""
+    answers = {}
+    for place in dict.fromkeys(places):
+        geodata = gazetteer.geocode(place[2], place[1], place[0])
+        if geodata:
+            answers[place] = geodata
+    return answers
+
+
+def geocodeSchools(school_df, geocode_api, rows=None, workers=GEOCODE_WORKERS, gazetteer=None,
+                   lookups=None):
+    """Geocode the schools in school_df (or just the rows flagged in `rows`) in place.
+
+    Every address is looked up first, then the City/Region of any school whose address was not
+    found, from the gazetteer when given and the API otherwise.  Identical queries in a run are
+    only sent once (across calls too, when they share a `lookups` dict), and results are written
+    by row position so schools that are not found stay blank.  Returns the number of schools
+    found.
+    """
+    row_count = len(school_df)
+    positions = np.arange(row_count) if rows is None else np.flatnonzero(np.asarray(rows))
+    result_columns = {
+        column: (
+            school_df[column].to_numpy(dtype=object, copy=True) if column in school_df
+            else np.full(row_count, '', dtype=object)
+        )
+        for column in GEOCODE_RESULT_COLUMNS
+    }
+    addresses = school_df['Address'].to_numpy(dtype=object)
+    cities = school_df['City'].to_numpy(dtype=object)
+    regions = school_df['Region'].to_numpy(dtype=object)
+    country_codes = school_df['Country Code'].to_numpy(dtype=object)
+
+    # Fetch the address first.  If it fails, switch to city+state
+    found = {}
+    primary_queries = {
+        position: (addresses[position], country_codes[position])
+        for position in positions if addresses[position]
+    }
+    lookups = {} if lookups is None else lookups
+    lookups.update(_lookupAll(
+        geocode_api, [query for query in primary_queries.values() if query not in lookups],
+        workers
+    ))
+    for position, query in primary_queries.items():
+        geodata = _handleResponse(lookups[query])
+        if geodata:
+            found[position] = geodata
+
+    fallback_places = {
+        position: (cities[position], regions[position], country_codes[position])
+        for position in positions if position not in found
+    }
+    if gazetteer is not None and fallback_places:
+        answers = _lookupGazetteer(gazetteer, fallback_places.values())
+        answered = [position for position, place in fallback_places.items() if place in answers]
+        for position in answered:
+            found[position] = answers[fallback_places.pop(position)]
+        print('Gazetteer answered %s of %s City/Region fallbacks' % (
+            len(answered), len(answered) + len(fallback_places)))
+        instrumentation.count('geocode.gazetteer_hits', len(answered))
+
+    fallback_queries = {
+        position: ('%s, %s' % (city, region), country_code)
+        for position, (city, region, country_code) in fallback_places.items()
+    }
+    lookups.update(_lookupAll(
+        geocode_api, [query for query in fallback_queries.values() if query not in lookups],
+        workers
+    ))
+    for position, query in fallback_queries.items():
+        geodata = _handleResponse(lookups[query], assure_address=False)
+        if geodata:
+            found[position] = geodata
+        else:
+            print('  Unable to find geodata for:\n%s' % (
+                school_df.iloc[position].to_json(indent=2, force_ascii=False)))
+
+    for position, geodata in found.items():
         geometry = geodata['geometry']
+        result_columns['Latitude'][position] = geometry['location']['lat']
+        result_columns['Longitude'][position] = geometry['location']['lng']
+        result_columns['Geocode Type'][position] = geometry['location_type']
+        result_columns['Google Address'][position] = geodata['formatted_address']
+
+    for column, values in result_columns.items():
+        school_df[column] = values
+    print('Geocoded %s of %s schools' % (len(found), len(positions)))
+    return len(found)
+
+
+def _partRows(needed, deadline):
+    """How many rows of `needed` to geocode as one part, given the time left to the deadline.
+
+    Each school may take two API calls (its address, then its City/Region) at GEOCODE_QPS, and
+    only the rows flagged in `needed` are geocoded.  Returns 0 if there is no time for any.
+    """
+    remaining = deadline.remaining()
+    if remaining is None or not needed.any():
+        return len(needed)
+    budget = int(GEOCODE_QPS * remaining / 2)
+    if budget < 1:
+        return 0
+    return int(np.searchsorted(np.cumsum(needed), budget, side='right'))
+
+
+def _geocodeChunk(chunk_df, start, geocode_api, needed, progress, deadline, gazetteer=None,
+                  lookups=None):
+    """Geocode a chunk starting at row `start` of the scrape, as one or more checkpoint parts.
+
+    Parts already in the checkpoint are reused.  Returns the parts as (start, dataframe), or
+    None if the deadline passed before the chunk was done.
+    """
+    parts = []
+    offset = 0
+    while offset < len(chunk_df):
+        saved_df = progress.load(
+            start + offset, chunk_df.iloc[offset:], GEOCODE_JOIN_COLUMNS) if progress else None
+        if saved_df is None:
+            part_rows = _partRows(needed[offset:], deadline)
+            if not part_rows:
+                return None
+            saved_df = chunk_df.iloc[offset:offset + part_rows].copy()
+            try:
+                geocodeSchools(
+                    saved_df, geocode_api, needed[offset:offset + part_rows],
+                    gazetteer=gazetteer, lookups=lookups)
+            except checkpoint.DeadlineExceeded as error:
+                print(error)
+                return None
+            if progress:
+                progress.save(start + offset, saved_df)
+        parts.append((start + offset, saved_df))
+        offset += len(saved_df)
+    return parts
+
+
+def geocodeInChunks(school_df, geocode_api, rows=None, progress=None, deadline=None,
+                    chunk_rows=GEOCODE_CHUNK_ROWS, gazetteer=None):
+    """Geocode the schools in school_df (or just the rows flagged in `rows`) in place, a chunk
+    at a time, saving each chunk to the checkpoint and reusing the chunks already in it.
+
+    Returns False, leaving school_df as it was, if the deadline passed before every chunk was
+    done.
+    """
+    rows = np.ones(len(school_df), dtype=bool) if rows is None else np.asarray(rows)
+    deadline = deadline or checkpoint.Deadline(0)
+    result_columns = {
+        column: (
+            school_df[column].to_numpy(dtype=object, copy=True) if column in school_df
+            else np.full(len(school_df), '', dtype=object)
+        )
+        for column in GEOCODE_RESULT_COLUMNS
+    }
+    lookups = {}
+    for start in range(0, len(school_df), chunk_rows):
+        chunk_rows_needed = rows[start:start + chunk_rows]
+        if not chunk_rows_needed.any():
+            continue
+        parts = _geocodeChunk(
+            school_df.iloc[start:start + chunk_rows], start, geocode_api, chunk_rows_needed,
+            progress, deadline, gazetteer=gazetteer, lookups=lookups)
+        if parts is None:
+            return False
+        for part_start, part_df in parts:
+            for column, values in result_columns.items():
+                values[part_start:part_start + len(part_df)] = part_df[column].to_numpy(
+                    dtype=object)
+
+    for column, values in result_columns.items():
+        school_df[column] = values
+    return True
+
+
+def _openGeoDataWriter(file_name=None):
+    if file_name:
+        return gcs.openBlobWriter(gcs.getGeocodeBucket(), file_name)
+    return open(SCHOOL_GEODATA_FILE, 'w')
+
+
+def streamGeoData(data_file, geocode_api, progress, file_name=None,
+                  chunk_rows=GEOCODE_CHUNK_ROWS, gazetteer=None, deadline=None):
+    """Geocode the scrape a chunk at a time, saving each chunk to the checkpoint before reading
+    the next.
+
+    Chunks the checkpoint already holds are skipped, and the geodata file is only written from
+    it once every chunk is done.  Returns the number of schools, or None if the deadline passed
+    first.
+    """
+    deadline = deadline or checkpoint.Deadline(0)
+    starts = []
+    school_count = 0
+    for school_df in pd.read_csv(data_file, keep_default_na=False, chunksize=chunk_rows):
+        parts = _geocodeChunk(
+            school_df, school_count, geocode_api, np.ones(len(school_df), dtype=bool), progress,
+            deadline, gazetteer=gazetteer)
+        if parts is None:
+            return None
+        starts.extend(part_start for part_start, _ in parts)
+        school_count += len(school_df)
+
+    with _openGeoDataWriter(file_name) as file_out:
+        for start in starts:
+            part = progress.read(start)
+            # Every part starts with the header, which is only written once
+            file_out.write(part if start == 0 else part.split('\n', 1)[1])
+    return school_count
+
+
+def loadSchoolData(file_name=None, incremental=GEOCODE_INCREMENTAL, streaming=None,
+                   deadline_seconds=None):
+    """Load school data from a file and process it.
+
+    file_name may also be a continuation object (see checkpoint.py), resuming the file it names.
+    Local runs have no deadline unless one is given.  Returns whether the geodata was written.
+    """
+    streaming = gcs.STREAMING if streaming is None else streaming
+    continuation = 0
+    if file_name and shards.isManifestName(file_name):
+        print('Skipping %s, which lists shards rather than schools' % file_name)
+        return False
+    if file_name:
+        file_name, continuation = checkpoint.resolveTrigger(file_name)
+        data_file = _loadGCSDataFile(file_name, streaming)
+    else:
+        # Only needed for local runs, and pulls in the scraping libraries
+        from . import fetch_wksa as fetch  # pylint: disable=import-outside-toplevel
+        data_file = open(fetch.SCHOOL_EXPORT_FILE, 'r')
+    if deadline_seconds is None:
+        deadline_seconds = checkpoint.GEOCODE_DEADLINE_SECONDS if file_name else 0
+    deadline = checkpoint.Deadline(deadline_seconds)
+    progress = checkpoint.openCheckpoint(file_name)
+    geocode_api = LimitedApiManager(GEOCODE_QPS, cache=openGeocodeCache(), deadline=deadline)
+    gazetteer = openGazetteer()
+
+    prior_file = None
+    try:
+        if streaming:
+            finished = streamGeoData(
+                data_file, geocode_api, progress, file_name, gazetteer=gazetteer,
+                deadline=deadline) is not None
+        else:
+            school_df = pd.read_csv(data_file, keep_default_na=False)
+
+            prior_file = _findPriorGeoData(file_name) if incremental else None
+            prior_df = (
+                pd.read_csv(prior_file, keep_default_na=False, dtype=str) if prior_file else None)
+            needs_geocode = applyPriorGeoData(school_df, prior_df)
+
+            finished = geocodeInChunks(
+                school_df, geocode_api, needs_geocode, progress, deadline, gazetteer=gazetteer)
+            if finished:
+                exportGeoData(school_df, file_name)
+    finally:
+        # Keep whatever was paid for in the cache, even when the run fails
+        data_file.close()
+        if prior_file:
+            prior_file.close()
+        geocode_api.close()
 
-        geocode_data.update({
-            'lat': geometry['location']['lat'],
-            'lon': geometry['location']['lng'],
-            'type': geometry['location_type'],
-            'formatted_address': geodata['formatted_address'],
-        })
-        school_list.append(geocode_data)
-
-    # Create the new CSV columns in the dataframe
-    school_df['Latitude'] = pd.Series([school['lat'] for school in school_list])
-    school_df['Longitude'] = pd.Series([school['lon'] for school in school_list])
-    school_df['Geocode Type'] = pd.Series([school['type'] for school in school_list])
-    school_df['Google Address'] = pd.Series([school['formatted_address'] for school in school_list])
-
-    exportGeoData(school_df, file_name)
-    data_file.close()
+    if finished:
+        progress.clear()
+        if continuation:
+            checkpoint.clearContinuation(file_name)
+        if file_name and shards.isShardName(file_name):
+            shards.mergeIfComplete(shards.runName(file_name))
+    elif file_name:
+        checkpoint.requestContinuation(file_name, continuation + 1, progress)
+    else:
+        print('Deadline reached with %s parts checkpointed, run again to resume' % (
+            len(progress.parts)))
+    return finished
 
 
 def isDirectRun():
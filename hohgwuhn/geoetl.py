@@ -18,38 +18,79 @@ school_location
 * Metadata: Each field in the geocoded file, re-written into snake case
 - scrape_record_id: The scrape_record this school came from
 - Country: For filtering, the denormalized Country from the given scrape_record
+- content_hash: A hash of the fields above, to tell whether the school changed
+===============
+
+School ids are '<country>-<region>-<city>-<address hash>', with the address lower-cased and its
+whitespace collapsed; schools listed more than once with the same address get an occurrence
+suffix ('-2', '-3', ...), so every row of the file has its own document.
+
+The third, a subcollection of each scrape_record, holds read models precomputed from its schools,
+so a front end reads a handful of documents instead of every school (see aggregates.py)
+
+=========
+aggregate
+---------
+- countries: Per-country school counts, centroids and bounding boxes
+- regions-<ISO-2>: The same per region of a country
+- points-<nnnn>: The ids and coordinates of the located schools, packed
+=========
+
+Schools are written in batches of at most FIRESTORE_BATCH_SIZE, committed concurrently.
+Re-loading a file reads back the content_hash of the record's schools, only rewrites the schools
+that changed, and deletes the ones no longer in the file.  The scrape_record itself is written
+last, once all of its schools and aggregates are saved, and lists the aggregate documents in
+`aggregates`.
 """
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 import csv
-import io
+import hashlib
+from itertools import islice
+import json
+import os
 from os.path import getmtime
 import re
 from time import gmtime, strftime
 
-from google.cloud import firestore
-
+from . import checkpoint
 from . import gcs
-from . import geocoder_googs
+from . import instrumentation
+from . import shards
+
+
+_FIRESTORE = None
 
+# Firestore rejects batches of more than 500 writes
+FIRESTORE_BATCH_SIZE = 500
+FIRESTORE_WRITERS = int(os.environ.get('FIRESTORE_WRITERS', 8))
 
-FIRESTORE = firestore.Client()
+def getFirestore():
+    """Get the Firestore client, created on first use to keep cold starts fast."""
+    global _FIRESTORE  # pylint: disable=global-statement
+    if _FIRESTORE is None:
+        from google.cloud import firestore  # pylint: disable=import-outside-toplevel
+        _FIRESTORE = firestore.Client()
+    return _FIRESTORE
 
 def _loadGCSDataFile(file_name):
-    file_stream = io.StringIO(
-        gcs.getGeocodeBucket().blob(file_name).download_as_string().decode(),
-        newline=''
-    )
-    return file_stream
+    return gcs.openBlobReader(gcs.getGeocodeBucket(), file_name)
 
 def loadCountryFile(file_name=None):
+    if file_name and (checkpoint.isInternalName(file_name) or shards.isShardName(file_name)):
+        print('Skipping %s, which is not a geodata file' % file_name)
+        return None
+
     # Get derived fields
-    country_file = (
-        _loadGCSDataFile(file_name) if file_name else open(geocoder_googs.SCHOOL_GEODATA_FILE, 'r')
-    )
-    country_name, scrape_date = (
-        file_name.split('/')[-2:] if file_name else (
+    if file_name:
+        country_file = _loadGCSDataFile(file_name)
+        country_name, scrape_date = file_name.split('/')[-2:]
+    else:
+        # Only needed for local runs, and pulls in pandas and googlemaps
+        from . import geocoder_googs  # pylint: disable=import-outside-toplevel
+        country_file = open(geocoder_googs.SCHOOL_GEODATA_FILE, 'r')
+        country_name, scrape_date = (
             'USA', strftime('%Y-%m-%d', gmtime(getmtime(geocoder_googs.SCHOOL_GEODATA_FILE)))
         )
-    )
 
     #####   Build the document sets
     # Scrape Record
@@ -60,11 +101,25 @@ def loadCountryFile(file_name=None):
         'gcs_location': file_name or ''
     }
 
-    # Schools
-    school_data = csv.DictReader(country_file)
-    school_list = []
+    # Schools, read lazily so large files are never held in memory at once.  Only the columns
+    # of the aggregates are kept, and summarized once every school is read.
+    from . import aggregates  # pylint: disable=import-outside-toplevel
+    geo_columns = aggregates.GeoColumns()
+    schools = _schoolDocuments(
+        csv.DictReader(country_file), country_name, scrape_record_id, geo_columns)
+
+    ##### Add all of them to Cloud Firestore
+    school_counts = saveScrapeRecord(
+        getFirestore(), scrape_record_id, scrape_record, schools, geo_columns.documents)
+    country_file.close()
+    return school_counts
+
+
+def _schoolDocuments(school_data, country_name, scrape_record_id, geo_columns=None):
+    """Yield (school id, school document) for each row of the geodata file."""
+    id_counts = {}
     for item in school_data:
-        school_list.append({
+        school = {
             # Geocoded data
             'region': item['Region'],
             'city': item['City'],
@@ -80,29 +135,130 @@ def loadCountryFile(file_name=None):
             # Scrape record data
             'country': country_name,
             'scrape_record_id': scrape_record_id
-        })
+        }
+        school_id = _uniqueId(_schoolId(school), id_counts)
+        if geo_columns is not None:
+            geo_columns.add(
+                school_id, item.get('Country Code', ''), item['Region'],
+                item['Latitude'], item['Longitude'])
+        yield school_id, school
 
-    ##### Add all of them to Cloud Firestore
-    batch = FIRESTORE.batch()
-    scrape_record_ref = FIRESTORE.collection('scrape_record').document(scrape_record_id)
-    # Scrape record
-    batch.set(scrape_record_ref, scrape_record)
+
+def _schoolId(school):
+    # Several schools share a city, so tell them apart by address
+    address = ' '.join(school['raw_address'].lower().split())
+    # Remove spacing and bad characters
+    return re.sub(
+        r'[/\s]',
+        '',
+        '%s-%s-%s-%s' % (
+            school['country'], school['region'], school['city'],
+            hashlib.sha1(address.encode()).hexdigest()[:8])
+    )
+
+
+def _uniqueId(school_id, id_counts):
+    """Suffix the repeats of an id with their occurrence, e.g. '-2' for the second."""
+    id_counts[school_id] = id_counts.get(school_id, 0) + 1
+    return school_id if id_counts[school_id] == 1 else '%s-%s' % (school_id, id_counts[school_id])
+
+
+def _schoolHash(school):
+    return hashlib.sha1(json.dumps(school, sort_keys=True).encode()).hexdigest()
+
+
+def commitInChunks(client, writes, chunk_size=FIRESTORE_BATCH_SIZE, workers=FIRESTORE_WRITERS):
+    """Commit (document reference, document) writes in concurrent batches of chunk_size.
+
+    A document of None deletes the referenced document.  Writes can be any iterable.  Only a
+    couple of chunks per worker are buffered at a time, so memory stays bounded for any number
+    of writes.  Returns the number of batches committed.
+    """
+    def commitChunk(chunk):
+        batch = client.batch()
+        for document_ref, document in chunk:
+            if document is None:
+                batch.delete(document_ref)
+            else:
+                batch.set(document_ref, document)
+        with instrumentation.timed('firestore.commit'):
+            batch.commit()
+        instrumentation.count('firestore.writes', len(chunk))
+
+    workers = max(1, workers)
+    writes = iter(writes)
+    chunk_count = 0
+    pending = set()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for chunk in iter(lambda: list(islice(writes, chunk_size)), []):
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                # Raise any failed commit here
+                _ = [future.result() for future in done]
+            pending.add(executor.submit(commitChunk, chunk))
+            chunk_count += 1
+        _ = [future.result() for future in pending]
+    return chunk_count
+
+
+def saveScrapeRecord(client, scrape_record_id, scrape_record, schools,
+                     aggregate_documents=None):
+    """Save the scrape record and its (school id, school) pairs, skipping unchanged schools.
+
+    Schools are compared with the content_hash of the record's saved schools, and saved schools
+    that are no longer listed are deleted.  aggregate_documents, if given, is called once every
+    school is saved, and returns the record's aggregate documents (document id -> document),
+    which are always rewritten.
+
+    Returns the number of schools (written, skipped).
+    """
+    scrape_record_ref = client.collection('scrape_record').document(scrape_record_id)
+    school_collection = scrape_record_ref.collection('school_location')
+    # Read from the schools themselves, so even a save cut short is picked up where it stopped
+    previous_hashes = {
+        snapshot.id: (snapshot.to_dict() or {}).get('content_hash')
+        for snapshot in school_collection.select(['content_hash']).stream()
+    }
 
     # Schools, stored as a subcollection of the record
-    for school in school_list:
-        # Imperfect and remove spacing and bad characters
-        school_id = re.sub(
-            r'[/\s]',
-            '',
-            '%s-%s-%s' % (country_name, school['region'], school['city'])
-        )
-        batch.set(
-            scrape_record_ref.collection('school_location').document(school_id),
-            school
-        )
+    school_ids = set()
+    counts = {'written': 0}
+
+    def changedSchools():
+        for school_id, school in schools:
+            # Two writes to one document in concurrent batches would race, so never send them
+            if school_id in school_ids:
+                raise ValueError('School id %s is not unique in %s' % (
+                    school_id, scrape_record_id))
+            school_ids.add(school_id)
+            content_hash = _schoolHash(school)
+            if previous_hashes.get(school_id) != content_hash:
+                counts['written'] += 1
+                yield school_collection.document(school_id), dict(
+                    school, content_hash=content_hash)
 
     # Save
-    batch.commit()
+    commitInChunks(client, changedSchools())
+    removed_ids = sorted(set(previous_hashes) - school_ids)
+    commitInChunks(client, (
+        (school_collection.document(school_id), None) for school_id in removed_ids))
+    aggregate_ids = []
+    if aggregate_documents is not None:
+        with instrumentation.timed('firestore.aggregates'):
+            documents = aggregate_documents()
+        aggregate_ids = sorted(documents)
+        commitInChunks(client, (
+            (scrape_record_ref.collection('aggregate').document(document_id), document)
+            for document_id, document in documents.items()
+        ))
+
+    # Scrape record, last so it is only ever saved once all of its schools are
+    scrape_record_ref.set(dict(scrape_record, aggregates=aggregate_ids))
+
+    skipped = len(school_ids) - counts['written']
+    print('Wrote %s schools to %s, skipped %s unchanged, removed %s' % (
+        counts['written'], scrape_record_id, skipped, len(removed_ids)))
+    return counts['written'], skipped
 
 
 def isDirectRun():
@@ -1,7 +1,30 @@
+"""Exports the geocoded schools for maps.
+
+`exportGeoJSON` writes the schools as a GeoJSON FeatureCollection, plus a cluster pyramid: for
+every zoom level from 0 to CLUSTER_MAX_ZOOM, the schools grouped by a grid of CLUSTER_CELL_PX
+pixel cells in Web Mercator, each cluster with its school count, centroid and bounding box.  A
+front end renders the overview at any zoom from that level's file alone (<zoom>.geojson in
+SCHOOL_CLUSTER_DIR, listed in its index.json), without touching the schools themselves.
+
+The pyramid is built bottom up: schools are binned into cells at the deepest level once, and
+each level above merges the cells of the one below, four into one.
+
+    python -m hohgwuhn.geovis                 # writes SCHOOL_GEOJSON_FILE and SCHOOL_CLUSTER_DIR
+    python -m hohgwuhn.geovis --static-maps   # opens Google Static Maps tabs to eyeball them
+
+Static map URLs are only good for a quick visual check; they hold ~MAX_EST_MARKER_COUNT
+markers each.
+"""
+import argparse
 import csv
+import json
+import os
 from urllib.parse import quote
 import webbrowser
 
+import numpy as np
+import pandas as pd
+
 from . import geocoder_googs as geocoder
 
 GOOGLE_STATIC_MAPS_ENDPOINT = (
@@ -18,11 +41,22 @@ GOOGLE_STATIC_MAPS_ENDPOINT = (
 MAX_EST_MARKER_COUNT = (2048 - len(GOOGLE_STATIC_MAPS_ENDPOINT)) / (
     len(quote(',|')) + 2 * (1 + 3 + 1 + 7))
 
+SCHOOL_GEOJSON_FILE = '../data/school_geodata.geojson'
+SCHOOL_CLUSTER_DIR = '../data/school_clusters'
+
+# Clusters are the schools within the same CLUSTER_CELL_PX square of 256px Web Mercator tiles
+CLUSTER_CELL_PX = int(os.environ.get('GEOVIS_CLUSTER_CELL_PX', 64))
+CLUSTER_MAX_ZOOM = int(os.environ.get('GEOVIS_CLUSTER_MAX_ZOOM', 16))
+TILE_PX = 256
+
+# Web Mercator's latitude limit, beyond which y is unbounded
+MAX_LATITUDE = 85.05112878
+
 
 def exportMapsUrls():
 
     marker_data = [[]]  # Generate a sanity-check list of Google Static Map urls
-    with open(geocoder.SCHOOL_GEODATA_FILE, 'rb') as csv_in:
+    with open(geocoder.SCHOOL_GEODATA_FILE, 'r', newline='') as csv_in:
         school_data = csv.DictReader(csv_in)
         for school in school_data:
             if len(marker_data[-1]) >= MAX_EST_MARKER_COUNT:
@@ -36,5 +70,166 @@ def exportMapsUrls():
         webbrowser.open_new_tab(map_url)
 
 
+def toMercator(lat, lon):
+    """Project degrees onto the unit Web Mercator square, x and y in [0, 1), y down."""
+    lat = np.clip(np.asarray(lat, dtype=np.float64), -MAX_LATITUDE, MAX_LATITUDE)
+    x = (np.asarray(lon, dtype=np.float64) + 180) / 360
+    y = 0.5 - np.log(np.tan(np.pi / 4 + np.radians(lat) / 2)) / (2 * np.pi)
+    return np.clip(x, 0, np.nextafter(1, 0)), np.clip(y, 0, np.nextafter(1, 0))
+
+
+def fromMercator(x, y):
+    """Invert toMercator, returning (lat, lon) in degrees."""
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * np.asarray(y)))))
+    return lat, np.asarray(x) * 360 - 180
+
+
+def _mergeCells(cells):
+    """Merge the rows of cells sharing the same (cell_x, cell_y) into one cluster each."""
+    keys = (cells['cell_x'] << 32) | cells['cell_y']
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+
+    merged = {
+        'cell_x': cells['cell_x'][order][starts],
+        'cell_y': cells['cell_y'][order][starts],
+    }
+    for column in ['count', 'sum_x', 'sum_y']:
+        merged[column] = np.add.reduceat(cells[column][order], starts)
+    for column in ['min_lat', 'min_lon', 'first']:
+        merged[column] = np.minimum.reduceat(cells[column][order], starts)
+    for column in ['max_lat', 'max_lon']:
+        merged[column] = np.maximum.reduceat(cells[column][order], starts)
+    return merged
+
+
+def buildClusterPyramid(lat, lon, max_zoom=CLUSTER_MAX_ZOOM, cell_px=CLUSTER_CELL_PX):
+    """Cluster points for every zoom level from 0 to max_zoom.
+
+    Returns a list indexed by zoom, each level a dict of NumPy arrays with one entry per
+    cluster: count, lat / lon (the centroid), min_lat / min_lon / max_lat / max_lon (the
+    bounding box), and first, the index of the cluster's first point.
+    """
+    lat, lon = np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64)
+    x, y = toMercator(lat, lon)
+    # Cells across the world at the deepest level; each level up halves it
+    cells_across = (TILE_PX // cell_px) << max_zoom
+    cells = {
+        'cell_x': (x * cells_across).astype(np.int64),
+        'cell_y': (y * cells_across).astype(np.int64),
+        'count': np.ones(len(lat), dtype=np.int64),
+        'sum_x': x,
+        'sum_y': y,
+        'min_lat': lat,
+        'min_lon': lon,
+        'max_lat': lat,
+        'max_lon': lon,
+        'first': np.arange(len(lat), dtype=np.int64),
+    }
+
+    levels = []
+    for _ in range(max_zoom, -1, -1):
+        cells = _mergeCells(cells)
+        centroid_lat, centroid_lon = fromMercator(
+            cells['sum_x'] / cells['count'], cells['sum_y'] / cells['count'])
+        levels.append(dict(cells, lat=centroid_lat, lon=centroid_lon))
+        cells = dict(cells, cell_x=cells['cell_x'] >> 1, cell_y=cells['cell_y'] >> 1)
+    return levels[::-1]
+
+
+def _round(values, digits=7):
+    return np.round(values, digits).tolist()
+
+
+def clusterFeatures(level):
+    """Get a zoom level's clusters as a GeoJSON FeatureCollection.
+
+    Single school clusters carry the school's feature id, so they can link to its details.
+    """
+    features = []
+    for count, first, lat, lon, min_lat, min_lon, max_lat, max_lon in zip(
+            level['count'].tolist(), level['first'].tolist(), _round(level['lat']),
+            _round(level['lon']), _round(level['min_lat']), _round(level['min_lon']),
+            _round(level['max_lat']), _round(level['max_lon'])):
+        feature = {
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': [lon, lat]},
+            'bbox': [min_lon, min_lat, max_lon, max_lat],
+            'properties': {'count': count},
+        }
+        if count == 1:
+            feature['properties']['school'] = first
+        features.append(feature)
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def schoolFeatures(school_df):
+    """Get the geocoded schools as a GeoJSON FeatureCollection, with the row as feature id."""
+    properties_df = school_df.drop(columns=['Latitude', 'Longitude'])
+    records = json.loads(properties_df.to_json(orient='records', force_ascii=False))
+    return {
+        'type': 'FeatureCollection',
+        'features': [
+            {
+                'type': 'Feature',
+                'id': school_id,
+                'geometry': {'type': 'Point', 'coordinates': [lon, lat]},
+                'properties': properties,
+            }
+            for school_id, lat, lon, properties in zip(
+                school_df.index.tolist(), _round(school_df['Latitude']),
+                _round(school_df['Longitude']), records)
+        ],
+    }
+
+
+def loadGeocodedSchools(data_file=None):
+    """Load the schools with coordinates from a geodata CSV, numbered from 0."""
+    school_df = pd.read_csv(
+        data_file or geocoder.SCHOOL_GEODATA_FILE, dtype=str, keep_default_na=False)
+    school_df = school_df.drop(columns=[
+        column for column in school_df.columns if column.startswith('Unnamed:')])
+    for column in ['Latitude', 'Longitude']:
+        school_df[column] = pd.to_numeric(school_df[column], errors='coerce')
+    school_df = school_df.dropna(subset=['Latitude', 'Longitude'])
+    return school_df.reset_index(drop=True)
+
+
+def exportGeoJSON(data_file=None, geojson_file=SCHOOL_GEOJSON_FILE,
+                  cluster_dir=SCHOOL_CLUSTER_DIR, max_zoom=CLUSTER_MAX_ZOOM,
+                  cell_px=CLUSTER_CELL_PX):
+    """Write the geocoded schools as GeoJSON, and their cluster pyramid, one file per zoom."""
+    school_df = loadGeocodedSchools(data_file)
+    levels = buildClusterPyramid(
+        school_df['Latitude'].to_numpy(), school_df['Longitude'].to_numpy(), max_zoom, cell_px)
+
+    with open(geojson_file, 'w') as geojson_out:
+        json.dump(schoolFeatures(school_df), geojson_out, ensure_ascii=False)
+    os.makedirs(cluster_dir, exist_ok=True)
+    for zoom, level in enumerate(levels):
+        with open(os.path.join(cluster_dir, '%s.geojson' % zoom), 'w') as level_out:
+            json.dump(clusterFeatures(level), level_out, separators=(',', ':'))
+    with open(os.path.join(cluster_dir, 'index.json'), 'w') as index_out:
+        json.dump({
+            'cell_px': cell_px,
+            'min_zoom': 0,
+            'max_zoom': max_zoom,
+            'schools': len(school_df),
+            'clusters': [len(level['count']) for level in levels],
+        }, index_out, indent=2)
+    print('Exported %s schools, clustered over %s zoom levels' % (len(school_df), max_zoom + 1))
+
+
 if __name__ == '__main__':
-    exportMapsUrls()
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--static-maps', action='store_true',
+                        help='Open Google Static Maps of the schools instead')
+    parser.add_argument('--max-zoom', type=int, default=CLUSTER_MAX_ZOOM)
+    args = parser.parse_args()
+
+    if args.static_maps:
+        exportMapsUrls()
+    else:
+        exportGeoJSON(max_zoom=args.max_zoom)
@@ -0,0 +1,223 @@
+"""Lightweight timers and counters for the pipeline, summarized once per invocation.
+
+Stages wrap their expensive steps (HTTP fetches, parsing, geocode calls, blob I/O, Firestore
+commits, ...) in timers and bump counters for the things worth counting (bytes, API calls,
+cache hits, retries):
+
+    with instrumentation.timed('http.fetch'):
+        r = session.get(url)
+    instrumentation.count('http.bytes', len(r.content))
+
+main.py runs each Cloud Function inside `invocation(name)`, which resets the recorder and, at
+the end, hands one JSON-friendly summary to every configured exporter.  Exporters are chosen by
+`HOHGWUHN_METRICS_EXPORTERS`, a comma separated list of:
+    - 'log' (default): one JSON line on stdout, which lands in the function's logs
+    - 'file:<path>': the JSON line appended to a local file
+    - 'openmetrics:<path>': an OpenMetrics text file, replaced on every invocation
+
+Set `HOHGWUHN_METRICS=0` to disable instrumentation.  Timers then hand back a shared no-op
+context manager and counters return immediately, so the hooks cost next to nothing.
+"""
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+
+
+ENABLED = os.environ.get('HOHGWUHN_METRICS', '1') != '0'
+EXPORTERS_CONFIG = os.environ.get('HOHGWUHN_METRICS_EXPORTERS', 'log')
+
+
+class Recorder:
+    """Thread safe totals of the timers and counters recorded during an invocation."""
+    def __init__(self):
+        self.timers = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def addTime(self, name, seconds):
+        with self._lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                self.timers[name] = {'count': 1, 'seconds': seconds, 'max_seconds': seconds}
+            else:
+                timer['count'] += 1
+                timer['seconds'] += seconds
+                timer['max_seconds'] = max(timer['max_seconds'], seconds)
+
+    def addCount(self, name, value):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def snapshot(self):
+        with self._lock:
+            return (
+                {name: dict(timer) for name, timer in sorted(self.timers.items())},
+                dict(sorted(self.counters.items()))
+            )
+
+
+_RECORDER = Recorder()
+
+
+class _Timer:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        _RECORDER.addTime(self.name, time.perf_counter() - self.start)
+
+
+class _NoopTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        pass
+
+
+_NOOP_TIMER = _NoopTimer()
+
+
+def timed(name):
+    """Context manager adding the time spent inside it to the named timer."""
+    return _Timer(name) if ENABLED else _NOOP_TIMER
+
+
+def count(name, value=1):
+    """Add value to the named counter."""
+    if ENABLED:
+        _RECORDER.addCount(name, value)
+
+
+def summary(invocation_name='', seconds=0.0, status='ok'):
+    """Summarize everything recorded since the last reset."""
+    timers, counters = _RECORDER.snapshot()
+    return {
+        'invocation': invocation_name,
+        'status': status,
+        'seconds': seconds,
+        'timers': timers,
+        'counters': counters,
+    }
+
+
+def reset():
+    """Drop everything recorded so far."""
+    global _RECORDER  # pylint: disable=global-statement
+    _RECORDER = Recorder()
+
+
+# Exporters
+class LogExporter:
+    """Prints the summary as one JSON line."""
+    def export(self, invocation_summary):
+        print(json.dumps(invocation_summary, sort_keys=True))
+
+
+class FileExporter:
+    """Appends the summary as a JSON line to a local file."""
+    def __init__(self, path):
+        self.path = path
+
+    def export(self, invocation_summary):
+        with open(self.path, 'a') as summary_file:
+            summary_file.write(json.dumps(invocation_summary, sort_keys=True) + '\n')
+
+
+def _labels(**labels):
+    return ','.join(
+        '%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for key, value in sorted(labels.items())
+    )
+
+
+class OpenMetricsExporter:
+    """Writes the summary as an OpenMetrics text file, e.g. for a textfile collector."""
+    def __init__(self, path):
+        self.path = path
+
+    @staticmethod
+    def render(invocation_summary):
+        """Get the summary in the OpenMetrics text format."""
+        invocation_name = invocation_summary['invocation']
+        lines = [
+            '# TYPE hohgwuhn_invocation_seconds gauge',
+            'hohgwuhn_invocation_seconds{%s} %r' % (
+                _labels(invocation=invocation_name, status=invocation_summary['status']),
+                invocation_summary['seconds']),
+        ]
+        families = [
+            ('hohgwuhn_timer_seconds', 'seconds', invocation_summary['timers']),
+            ('hohgwuhn_timer_calls', 'count', invocation_summary['timers']),
+        ]
+        for family, field, timers in families:
+            lines.append('# TYPE %s counter' % family)
+            lines.extend(
+                '%s_total{%s} %r' % (
+                    family, _labels(invocation=invocation_name, name=name), timer[field])
+                for name, timer in timers.items()
+            )
+        lines.append('# TYPE hohgwuhn_events counter')
+        lines.extend(
+            'hohgwuhn_events_total{%s} %r' % (
+                _labels(invocation=invocation_name, name=name), value)
+            for name, value in invocation_summary['counters'].items()
+        )
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+    def export(self, invocation_summary):
+        # Write to the side and swap in, so a collector never reads a partial file
+        temp_path = '%s.tmp' % self.path
+        with open(temp_path, 'w') as metrics_file:
+            metrics_file.write(self.render(invocation_summary))
+        os.replace(temp_path, self.path)
+
+
+# Exporter name -> class, taking the text after ':' in the config (if any) as its argument
+EXPORTER_TYPES = {
+    'log': LogExporter,
+    'file': FileExporter,
+    'openmetrics': OpenMetricsExporter,
+}
+
+
+def configureExporters(config=EXPORTERS_CONFIG):
+    """Build the exporters listed in a HOHGWUHN_METRICS_EXPORTERS style config."""
+    exporters = []
+    for exporter_config in filter(None, (part.strip() for part in config.split(','))):
+        exporter_name, _, argument = exporter_config.partition(':')
+        exporter_type = EXPORTER_TYPES[exporter_name]
+        exporters.append(exporter_type(argument) if argument else exporter_type())
+    return exporters
+
+
+@contextmanager
+def invocation(invocation_name, exporters=None):
+    """Record one invocation, exporting its summary when it finishes (or fails)."""
+    if not ENABLED:
+        yield
+        return
+
+    exporters = configureExporters() if exporters is None else exporters
+    reset()
+    start = time.perf_counter()
+    status = 'error'
+    try:
+        yield
+        status = 'ok'
+    finally:
+        invocation_summary = summary(invocation_name, time.perf_counter() - start, status)
+        for exporter in exporters:
+            exporter.export(invocation_summary)
@@ -0,0 +1,235 @@
+"""Finds the schools nearest to any point, using the Latitude / Longitude from the geodata file.
+
+Schools are indexed as points on the unit sphere, in a KD-tree whose leaves are small buckets of
+schools with a bounding box each.  Queries are answered in batches with NumPy: queries are
+grouped by the leaf they fall in, and each group only measures the schools in leaves whose
+bounding box could hold something closer than what the group already found.
+
+Straight line (chord) distance on the unit sphere ranks points the same as great circle
+distance, so the tree works in chord distance and the reported distances are haversine
+kilometers.
+
+    index = SchoolIndex.fromGeoData(pd.read_csv(SCHOOL_GEODATA_FILE, keep_default_na=False))
+    distances_km, school_ids = index.nearest([42.24], [-88.31], k=3)
+    index.save('school_index.npz')
+"""
+import numpy as np
+
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Bounds the (queries x leaves) work arrays to a few MB
+QUERY_CHUNK = 128
+
+
+def toUnitVectors(lat, lon):
+    """Convert latitudes / longitudes in degrees into (n, 3) points on the unit sphere."""
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    lon = np.radians(np.asarray(lon, dtype=np.float64))
+    cos_lat = np.cos(lat)
+    return np.stack([cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)], axis=-1)
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Great circle distance in kilometers between points, broadcasting like NumPy."""
+    lat1, lon1, lat2, lon2 = (
+        np.radians(np.asarray(value, dtype=np.float64)) for value in (lat1, lon1, lat2, lon2))
+    a = (np.sin((lat2 - lat1) / 2) ** 2 +
+         np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def kmToChord(distance_km):
+    """Convert a great circle distance into the matching chord length on the unit sphere."""
+    return 2 * np.sin(np.minimum(np.asarray(distance_km) / EARTH_RADIUS_KM, np.pi) / 2)
+
+
+def bruteForceNearest(lat, lon, school_lat, school_lon, k=1, chunk=1024):
+    """Exact k nearest school positions for each point, by measuring every school.
+
+    Returns (distances_km, positions), each (points, k), for checking and benchmarking.
+    """
+    lat = np.atleast_1d(np.asarray(lat, dtype=np.float64))
+    lon = np.atleast_1d(np.asarray(lon, dtype=np.float64))
+    k = min(k, len(school_lat))
+    distances = np.empty((len(lat), k))
+    positions = np.empty((len(lat), k), dtype=np.int64)
+    for start in range(0, len(lat), chunk):
+        end = start + chunk
+        all_distances = haversine(
+            lat[start:end, None], lon[start:end, None], school_lat[None], school_lon[None])
+        closest = np.argpartition(all_distances, k - 1, axis=1)[:, :k]
+        closest_distances = np.take_along_axis(all_distances, closest, axis=1)
+        closest_order = np.argsort(closest_distances, axis=1, kind='stable')
+        positions[start:end] = np.take_along_axis(closest, closest_order, axis=1)
+        distances[start:end] = np.take_along_axis(closest_distances, closest_order, axis=1)
+    return distances, positions
+
+
+def _buildLeaves(points, leaf_size):
+    """Split points into KD-tree leaves, returning (order, leaf start / end offsets)."""
+    order = np.arange(len(points))
+    leaves = []
+    stack = [(0, len(points))]
+    while stack:
+        start, end = stack.pop()
+        if end - start <= leaf_size:
+            leaves.append((start, end))
+            continue
+        # Split the widest dimension at its median
+        leaf_points = points[order[start:end]]
+        split_dim = np.argmax(leaf_points.max(axis=0) - leaf_points.min(axis=0))
+        middle = (end - start) // 2
+        partition = np.argpartition(leaf_points[:, split_dim], middle)
+        order[start:end] = order[start:end][partition]
+        stack.extend([(start + middle, end), (start, start + middle)])
+    leaves.sort()
+    return order, np.array(leaves, dtype=np.int64).reshape(-1, 2)
+
+
+class SchoolIndex:
+    """Spatial index over school locations, answering k-nearest and within-radius queries."""
+    def __init__(self, lat, lon, school_ids, leaves):
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.school_ids = np.asarray(school_ids)
+        self.leaves = np.asarray(leaves, dtype=np.int64).reshape(-1, 2)
+        self.points = toUnitVectors(self.lat, self.lon)
+
+        self.leaf_lo = np.array([self.points[start:end].min(axis=0) for start, end in self.leaves])
+        self.leaf_hi = np.array([self.points[start:end].max(axis=0) for start, end in self.leaves])
+        self.leaf_sizes = self.leaves[:, 1] - self.leaves[:, 0]
+
+    @classmethod
+    def build(cls, lat, lon, school_ids=None, leaf_size=128):
+        """Build the index for schools at the given latitudes / longitudes."""
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        school_ids = np.arange(len(lat)) if school_ids is None else np.asarray(school_ids)
+        if not len(lat):
+            raise ValueError('Cannot index an empty set of schools')
+
+        order, leaves = _buildLeaves(toUnitVectors(lat, lon), leaf_size)
+        # Store schools in leaf order so each leaf is a contiguous slice
+        return cls(lat[order], lon[order], school_ids[order], leaves)
+
+    @classmethod
+    def fromGeoData(cls, school_df, id_column=None, leaf_size=128):
+        """Build the index from a geodata DataFrame, skipping schools that were not geocoded.
+
+        Schools are identified by id_column, or else by their row in the DataFrame.
+        """
+        located = school_df[
+            (school_df['Latitude'].astype(str) != '') & (school_df['Longitude'].astype(str) != '')
+        ]
+        school_ids = located[id_column] if id_column else located.index
+        return cls.build(
+            located['Latitude'].astype(float).to_numpy(),
+            located['Longitude'].astype(float).to_numpy(),
+            np.asarray(school_ids).astype(str) if id_column else np.asarray(school_ids),
+            leaf_size
+        )
+
+    def save(self, path):
+        """Save the index as an uncompressed .npz, which loads without any rebuilding."""
+        np.savez(
+            path, lat=self.lat, lon=self.lon, school_ids=self.school_ids, leaves=self.leaves)
+
+    @classmethod
+    def load(cls, path):
+        """Load an index saved with `save`."""
+        with np.load(path, allow_pickle=False) as saved:
+            return cls(saved['lat'], saved['lon'], saved['school_ids'], saved['leaves'])
+
+    def __len__(self):
+        return len(self.lat)
+
+    def _leafLowerBounds(self, points):
+        """Smallest possible chord distance from each point to anything in each leaf."""
+        gap = np.maximum(self.leaf_lo[None] - points[:, None], points[:, None] - self.leaf_hi[None])
+        return np.sqrt((np.maximum(gap, 0) ** 2).sum(axis=-1))
+
+    def _leafPositions(self, leaf_mask):
+        return np.concatenate([
+            np.arange(start, end) for start, end in self.leaves[leaf_mask]
+        ])
+
+    def _chordDistances(self, points, positions):
+        # |a - b|^2 = 2 - 2 a.b for unit vectors
+        return np.sqrt(np.maximum(2 - 2 * points @ self.points[positions].T, 0))
+
+    def _queryGroups(self, points):
+        """Group query positions by the leaf they are closest to, in groups of QUERY_CHUNK."""
+        home_leaves = np.concatenate([
+            np.argmin(self._leafLowerBounds(points[start:start + QUERY_CHUNK]), axis=1)
+            for start in range(0, len(points), QUERY_CHUNK)
+        ])
+        by_leaf = np.argsort(home_leaves, kind='stable')
+        boundaries = np.flatnonzero(np.diff(home_leaves[by_leaf])) + 1
+        for group in np.split(by_leaf, boundaries):
+            for start in range(0, len(group), QUERY_CHUNK):
+                yield group[start:start + QUERY_CHUNK]
+
+    def nearest(self, lat, lon, k=1):
+        """Find the k nearest schools to each point.
+
+        Returns (distances_km, school_ids), each of shape (points, k), nearest first.
+        """
+        points = toUnitVectors(np.atleast_1d(lat), np.atleast_1d(lon))
+        k = min(k, len(self))
+        result_positions = np.empty((len(points), k), dtype=np.int64)
+
+        for group in self._queryGroups(points):
+            group_points = points[group]
+            lower_bounds = self._leafLowerBounds(group_points)
+
+            # Any k schools give an upper bound on the k-th nearest distance of each query
+            seed_leaves = np.argsort(lower_bounds.max(axis=0))
+            seed_count = np.searchsorted(np.cumsum(self.leaf_sizes[seed_leaves]), k) + 1
+            seed_mask = np.zeros(len(self.leaves), dtype=bool)
+            seed_mask[seed_leaves[:seed_count]] = True
+            seed_distances = self._chordDistances(group_points, self._leafPositions(seed_mask))
+            upper_bounds = np.partition(seed_distances, k - 1, axis=1)[:, k - 1]
+
+            # Only leaves that could hold something closer need to be measured
+            candidates = self._leafPositions((lower_bounds <= upper_bounds[:, None]).any(axis=0))
+            distances = self._chordDistances(group_points, candidates)
+            closest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+            closest_order = np.argsort(
+                np.take_along_axis(distances, closest, axis=1), axis=1, kind='stable')
+            result_positions[group] = candidates[np.take_along_axis(closest, closest_order, axis=1)]
+
+        distances_km = haversine(
+            np.atleast_1d(lat)[:, None], np.atleast_1d(lon)[:, None],
+            self.lat[result_positions], self.lon[result_positions]
+        )
+        return distances_km, self.school_ids[result_positions]
+
+    def withinRadius(self, lat, lon, radius_km):
+        """Find every school within radius_km of each point.
+
+        Returns a list with one (distances_km, school_ids) pair per point, nearest first.
+        """
+        lat = np.atleast_1d(np.asarray(lat, dtype=np.float64))
+        lon = np.atleast_1d(np.asarray(lon, dtype=np.float64))
+        points = toUnitVectors(lat, lon)
+        # Pad the chord slightly so rounding never drops a school right on the edge
+        radius_chord = kmToChord(radius_km) + 1e-12
+        results = [None] * len(points)
+
+        for group in self._queryGroups(points):
+            lower_bounds = self._leafLowerBounds(points[group])
+            leaf_mask = (lower_bounds <= radius_chord).any(axis=0)
+            candidates = (
+                self._leafPositions(leaf_mask) if leaf_mask.any()
+                else np.empty(0, dtype=np.int64)
+            )
+            distances = self._chordDistances(points[group], candidates)
+            for row, query in enumerate(group):
+                in_range = candidates[distances[row] <= radius_chord]
+                distances_km = haversine(
+                    lat[query], lon[query], self.lat[in_range], self.lon[in_range])
+                nearest_first = np.argsort(distances_km, kind='stable')
+                results[query] = (
+                    distances_km[nearest_first], self.school_ids[in_range][nearest_first])
+        return results
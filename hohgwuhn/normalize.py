@@ -0,0 +1,108 @@
+"""Per-country cleanup of scraped schools before geocoding.
+
+Rules are registered for one or more country codes with the `rule` decorator, and compiled once
+into a dict of country code -> tuple of rules.  `normalizeSchools` then looks each school's
+country up in that dict, so a school of a country without rules costs a single dict miss, and
+splits the address into tokens once for all of its country's rules.
+
+A rule is called as `rule(school, tokens)`, where tokens are the whitespace separated words of
+school.address.  It updates the school in place and returns the tokens of the address as it
+left it, so the next rule need not split the address again.
+
+    @rule('KR')
+    def handleHankuk(school, tokens):
+        ...
+        return tokens
+"""
+import re
+
+
+_RULES = {}
+_COMPILED = {}
+
+
+def rule(*country_codes):
+    """Register a function as a normalization rule of the given countries, run in order."""
+    def register(function):
+        for country_code in country_codes:
+            _RULES.setdefault(country_code, []).append(function)
+        compileRules()
+        return function
+    return register
+
+
+def compileRules():
+    """Freeze the registered rules into the lookup normalizeSchools dispatches on."""
+    _COMPILED.clear()
+    _COMPILED.update((country_code, tuple(rules)) for country_code, rules in _RULES.items())
+    return _COMPILED
+
+
+def normalizeSchools(schools, country_codes=None):
+    """Apply the rules of each school's country, in place.  Returns the number of schools seen
+    by a rule.
+
+    With country_codes, only the rules of those countries are applied.
+    """
+    compiled = _COMPILED if country_codes is None else {
+        country_code: _COMPILED[country_code]
+        for country_code in country_codes if country_code in _COMPILED
+    }
+    rules_of = compiled.get
+    normalized = 0
+    for school in schools:
+        rules = rules_of(school.country_code)
+        if rules is None:
+            continue
+        tokens = school.address.split()
+        for apply in rules:
+            tokens = apply(school, tokens)
+        normalized += 1
+    return normalized
+
+
+# Separators between the several regions some Korean schools list, e.g. 'Seoul | Gyeonggi'
+_KR_REGION_SEPARATOR = re.compile(r'\s[/|]\s')
+
+
+@rule('KR')
+def handleHankuk(school, tokens):
+    """Korean schools are formatted differently and needs some adjustment before geocoding."""
+    # The 4th column has the region, but may contain multiple cities for a region
+    city_set = _KR_REGION_SEPARATOR.sub(' ', school.region).split()
+    if len(city_set) > 1:
+        # Figure out which city we're in by using the address
+        for region in city_set:
+            if region in school.address:
+                school.region = region
+
+    # Split address as KR addresses list the instructor last, throwing off geocoding
+    if school.region == tokens[-1]:
+        # If the last token in the address is the City, the City column is the Instructor.
+        # Replace it with token before the city in the address (should be district).
+        new_boundary = tokens[-2]
+        school.address += ' %s' % school.city
+
+        # Keep the Instructor, and the address's tokens with the city appended
+        school.instructor = school.city
+        tokens = tokens + school.city.split()
+        school.city = new_boundary
+
+    elif school.region not in school.address:
+        # If region isn't in the address, then the City is in the Region. Fix all 3
+        # e.g. Dong-Gu Daegu
+        school.address += ' %s' % school.city
+
+        # Region is generally last in KR WKSA addresses
+        school.region = school.city.split()[-1]
+
+        # Append the city's tokens and set the new city
+        tokens = tokens + school.city.split()
+        school.city = tokens[-2]
+
+    if school.region == tokens[-3]:
+        # The last two tokens are the Instructor.  Cut and replace to Instructor column
+        school.instructor = ' '.join(tokens[-2:])
+        school.address = ' '.join(tokens[:-2])
+        tokens = tokens[:-2]
+    return tokens
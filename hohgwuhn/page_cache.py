@@ -0,0 +1,243 @@
+"""Caches scraped WKSA pages so unchanged pages are neither re-downloaded nor re-parsed.
+
+Each cached page records its body, the ETag / Last-Modified validators the server sent, a hash
+of the body, and whatever was parsed out of it (the country list or the schools).  Later runs
+send conditional requests with those validators; when the server answers 304, or sends back a
+body with the same hash, the parsed result is reused as-is.
+
+The cache lives on local disk or in GCS, as chosen by `WKSA_PAGE_CACHE`:
+    - '' (default): caching disabled, every page is fetched and parsed
+    - 'gs://<bucket>/<prefix>': one JSON object per page under the prefix
+    - anything else: a local directory holding one JSON file per page
+
+Entries whose body is older than `WKSA_PAGE_CACHE_MAX_AGE` seconds are dropped, and the least
+recently used entries are evicted once the cache is larger than `WKSA_PAGE_CACHE_MAX_BYTES`.
+Entries written with another PAGE_CACHE_FORMAT are dropped too, so a change to the parsed results
+never has to read entries of an older shape.
+"""
+import copy
+import hashlib
+import json
+import os
+import time
+
+from . import gcs
+from . import instrumentation
+
+
+PAGE_CACHE_LOCATION = os.environ.get('WKSA_PAGE_CACHE', '')
+PAGE_CACHE_MAX_BYTES = int(os.environ.get('WKSA_PAGE_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+PAGE_CACHE_MAX_AGE = int(os.environ.get('WKSA_PAGE_CACHE_MAX_AGE', 60 * 24 * 60 * 60))
+# Version of the entries' layout, including the parsed results; bump it whenever either changes
+PAGE_CACHE_FORMAT = 1
+
+_PAGE_CACHE = None
+
+
+class LocalPageStore:
+    """Stores cache entries as JSON files in a local directory."""
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, '%s.json' % key)
+
+    def read(self, key):
+        """Get the entry for the key, or None if it is not cached."""
+        try:
+            with open(self._path(key), 'r') as entry_file:
+                return json.load(entry_file)
+        except (OSError, ValueError):
+            return None
+
+    def write(self, key, entry):
+        """Save the entry for the key, replacing any previous one."""
+        # Write to the side and swap in so concurrent readers never see a partial file
+        temp_path = '%s.%s.tmp' % (self._path(key), os.getpid())
+        with open(temp_path, 'w') as entry_file:
+            json.dump(entry, entry_file)
+        os.replace(temp_path, self._path(key))
+
+    def delete(self, key):
+        """Remove the entry for the key, if present."""
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def entries(self):
+        """List (key, size in bytes, last used timestamp) for every cached entry."""
+        entry_list = []
+        for file_name in os.listdir(self.directory):
+            if not file_name.endswith('.json'):
+                continue
+            stat = os.stat(os.path.join(self.directory, file_name))
+            entry_list.append((file_name[:-len('.json')], stat.st_size, stat.st_mtime))
+        return entry_list
+
+
+class GCSPageStore:
+    """Stores cache entries as JSON objects under a prefix of a GCS bucket."""
+    def __init__(self, bucket, prefix=''):
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+
+    def _blobName(self, key):
+        return '%s/%s.json' % (self.prefix, key) if self.prefix else '%s.json' % key
+
+    def read(self, key):
+        """Get the entry for the key, or None if it is not cached."""
+        blob = self.bucket.get_blob(self._blobName(key))
+        return json.loads(blob.download_as_string().decode()) if blob else None
+
+    def write(self, key, entry):
+        """Save the entry for the key, replacing any previous one."""
+        self.bucket.blob(self._blobName(key)).upload_from_string(
+            json.dumps(entry), content_type='application/json')
+
+    def delete(self, key):
+        """Remove the entry for the key, if present."""
+        blob = self.bucket.get_blob(self._blobName(key))
+        if blob:
+            blob.delete()
+
+    def entries(self):
+        """List (key, size in bytes, last used timestamp) for every cached entry."""
+        prefix = '%s/' % self.prefix if self.prefix else ''
+        return [
+            (blob.name[len(prefix):-len('.json')], blob.size, blob.updated.timestamp())
+            for blob in self.bucket.list_blobs(prefix=prefix)
+            if blob.name.endswith('.json')
+        ]
+
+
+def openPageStore(location):
+    """Get the store for a WKSA_PAGE_CACHE style location, or None if caching is disabled."""
+    if not location:
+        return None
+    if location.startswith('gs://'):
+        bucket_name, _, prefix = location[len('gs://'):].partition('/')
+        return GCSPageStore(gcs.getBucket(bucket_name), prefix)
+    return LocalPageStore(location)
+
+
+def _pageKey(method, url, data):
+    request_id = json.dumps([method, url, data], sort_keys=True)
+    return hashlib.sha1(request_id.encode()).hexdigest()
+
+
+class PageCache:
+    """Conditional-request cache of WKSA pages and the results parsed from them."""
+    def __init__(self, store=None, max_bytes=PAGE_CACHE_MAX_BYTES, max_age=PAGE_CACHE_MAX_AGE):
+        self.store = store
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        # Page description -> 'hit' or 'miss' for the pages fetched during this run
+        self.stats = {}
+
+    def fetch(self, session, method, url, data=None):
+        """Fetch a page, revalidating any cached copy.
+
+        Returns the cache entry for the page.  Its 'parsed' value is None when the page changed
+        (or was never cached) and has to be parsed again; see `storeParsed`.
+        """
+        key = _pageKey(method, url, data)
+        entry = self.store.read(key) if self.store else None
+        if entry and (entry.get('format') != PAGE_CACHE_FORMAT
+                      or time.time() - entry['stored_at'] > self.max_age):
+            self.store.delete(key)
+            entry = None
+
+        headers = {}
+        if entry and entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+
+        send = session.post if method == 'POST' else session.get
+        request_args = {'data': data} if data is not None else {}
+        with instrumentation.timed('http.fetch'):
+            r = send(url, headers=headers, **request_args)
+        instrumentation.count('http.bytes', len(r.content))
+
+        if entry and r.status_code == 304:
+            is_hit = True
+        else:
+            body_hash = hashlib.sha256(r.text.encode()).hexdigest()
+            is_hit = bool(entry) and entry['body_hash'] == body_hash and (
+                entry['parsed'] is not None)
+            if not is_hit:
+                entry = {
+                    'format': PAGE_CACHE_FORMAT,
+                    'key': key,
+                    'url': url,
+                    'data': data,
+                    'body': r.text,
+                    'body_hash': body_hash,
+                    'stored_at': time.time(),
+                    'parsed': None,
+                }
+            entry['etag'] = r.headers.get('ETag', '')
+            entry['last_modified'] = r.headers.get('Last-Modified', '')
+
+        page_name = '%s %s %s' % (method, url, json.dumps(data, sort_keys=True) if data else '')
+        self.stats[page_name.strip()] = 'hit' if is_hit else 'miss'
+        instrumentation.count('page_cache.hits' if is_hit else 'page_cache.misses')
+
+        if is_hit and self.store:
+            # Rewrite on every hit to keep the validators fresh and mark the entry as recently used
+            self.store.write(key, entry)
+        return copy.deepcopy(entry) if is_hit else entry
+
+    def storeParsed(self, entry, parsed):
+        """Save the result parsed from a freshly fetched page alongside it."""
+        if not self.store:
+            return
+        # Copy, as the caller goes on to modify the parsed results in place
+        entry['parsed'] = copy.deepcopy(parsed)
+        self.store.write(entry['key'], entry)
+
+    def evict(self):
+        """Drop entries unused for max_age, then least recently used ones until under max_bytes."""
+        if not self.store:
+            return 0
+
+        now = time.time()
+        evicted = 0
+        live_entries = []
+        for key, size, last_used in self.store.entries():
+            if now - last_used > self.max_age:
+                self.store.delete(key)
+                evicted += 1
+            else:
+                live_entries.append((last_used, size, key))
+
+        total_bytes = sum(size for _, size, _ in live_entries)
+        for _, size, key in sorted(live_entries):
+            if total_bytes <= self.max_bytes:
+                break
+            self.store.delete(key)
+            total_bytes -= size
+            evicted += 1
+        return evicted
+
+    def report(self):
+        """Print the hit/miss result of each page fetched this run, returning the totals."""
+        totals = {'hit': 0, 'miss': 0}
+        if not self.store:
+            return totals
+
+        for page_name, result in sorted(self.stats.items()):
+            totals[result] += 1
+            print('  Page cache %s: %s' % (result, page_name))
+        print('Page cache: %s hits, %s misses' % (totals['hit'], totals['miss']))
+        return totals
+
+
+def getPageCache():
+    """Get the page cache configured by WKSA_PAGE_CACHE, shared for the whole run."""
+    global _PAGE_CACHE  # pylint: disable=global-statement
+    if _PAGE_CACHE is None:
+        _PAGE_CACHE = PageCache(openPageStore(PAGE_CACHE_LOCATION))
+    return _PAGE_CACHE
@@ -0,0 +1,155 @@
+"""Memoized phone number extraction, so unchanged addresses are not re-parsed by phonenumbers.
+
+Extraction results are keyed on the exact (address, country code) pair, plus the phonenumbers
+version as its metadata decides what counts as a number.  Each result is the list of formatted
+numbers and where the first one starts in the address.
+
+The store is chosen by `WKSA_PHONE_CACHE`, like `GEOCODE_CACHE`:
+    - '' (default): results only live for the run
+    - 'gs://<bucket>/<object>': a single JSON object in GCS, loaded at start and saved at the end
+    - anything else: a local SQLite database file
+
+Misses are parsed over a process pool of `WKSA_PHONE_WORKERS` when there are at least
+`WKSA_PHONE_PARALLEL_MIN` of them, as phonenumbers is pure Python.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import os
+import re
+import threading
+import time
+
+import phonenumbers as libphone
+
+from . import instrumentation
+from .geocode_cache import openCacheBackend
+
+
+PHONE_CACHE_LOCATION = os.environ.get('WKSA_PHONE_CACHE', '')
+PHONE_CACHE_MAX_ENTRIES = int(os.environ.get('WKSA_PHONE_CACHE_MAX_ENTRIES', 100000))
+PHONE_WORKERS = int(os.environ.get('WKSA_PHONE_WORKERS', os.cpu_count() or 1))
+PHONE_PARALLEL_MIN = int(os.environ.get('WKSA_PHONE_PARALLEL_MIN', 500))
+
+# Every number phonenumbers matches has at least two digits, split by at most a few punctuation
+# characters, so text without such a pair cannot hold a number
+_PHONE_CANDIDATE = re.compile(r'\d\D{0,4}\d')
+
+
+def extractPhoneNumbers(address, country_code):
+    """Find the phone numbers in an address.
+
+    Returns (formatted national numbers, index the first number starts at, or None).
+    """
+    if not _PHONE_CANDIDATE.search(address):
+        return [], None
+
+    phone_numbers = []
+    phone_start = None
+    for match in libphone.PhoneNumberMatcher(address, country_code):
+        phone_numbers.append(
+            str(libphone.format_number(match.number, libphone.PhoneNumberFormat.NATIONAL)))
+        phone_start = match.start if phone_start is None else min(phone_start, match.start)
+    return phone_numbers, phone_start
+
+
+def _extractChunk(lookups):
+    """Process pool entry point, extracting a chunk of (address, country code) lookups."""
+    return [extractPhoneNumbers(address, country_code) for address, country_code in lookups]
+
+
+def cacheKey(address, country_code):
+    """Key on the exact text, as the address split has to match an uncached parse exactly."""
+    return '%s|%s|%s' % (libphone.__version__, country_code, address)
+
+
+class PhoneCache:
+    """Memo of phone number extraction results, optionally persisted by a cache backend."""
+    def __init__(self, backend=None, max_entries=PHONE_CACHE_MAX_ENTRIES):
+        self.backend = backend
+        self.max_entries = max_entries
+        self.memo = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, address, country_code):
+        """Get the cached (numbers, start) for an address, or None if not cached."""
+        key = cacheKey(address, country_code)
+        with self._lock:
+            result = self.memo.get(key)
+            if result is None and self.backend:
+                entry = self.backend.get(key)
+                if entry:
+                    result = tuple(entry[0])
+                    self.memo[key] = result
+                    self.backend.touch(key, time.time())
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return result
+
+    def put(self, address, country_code, result):
+        """Cache the (numbers, start) extracted from an address."""
+        key = cacheKey(address, country_code)
+        with self._lock:
+            self.memo[key] = tuple(result)
+            if self.backend:
+                self.backend.put(key, list(result), time.time())
+
+    def close(self):
+        """Apply the size cap and persist the cache."""
+        if not self.backend:
+            return
+        with self._lock:
+            # Results never go stale for a given phonenumbers version, so only the cap applies
+            self.backend.evict(0, self.max_entries)
+            self.backend.flush()
+
+    def report(self):
+        """Print the cache hit rate for this run, returning it."""
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0.0
+        print('Phone cache: %s hits, %s misses (%.1f%% hit rate)' % (
+            self.hits, self.misses, 100 * hit_rate))
+        return hit_rate
+
+
+def openPhoneCache(location=PHONE_CACHE_LOCATION):
+    """Get the phone cache configured by WKSA_PHONE_CACHE, persisted if a location is set."""
+    return PhoneCache(openCacheBackend(location, table='phone'))
+
+
+def extractAll(lookups, cache=None, workers=None):
+    """Extract the phone numbers for a list of (address, country code) lookups, in order.
+
+    Cached results are reused, duplicates are only parsed once, and the rest are parsed over a
+    process pool when there are enough of them.
+    """
+    cache = PhoneCache() if cache is None else cache
+    workers = PHONE_WORKERS if workers is None else workers
+
+    results = {}
+    for lookup in set(lookups):
+        result = cache.get(*lookup)
+        if result is not None:
+            results[lookup] = result
+    missing = [lookup for lookup in dict.fromkeys(lookups) if lookup not in results]
+    instrumentation.count('phones.cached', len(results))
+    instrumentation.count('phones.parsed', len(missing))
+
+    if workers > 1 and len(missing) >= PHONE_PARALLEL_MIN:
+        # Hand each worker a few large chunks, as every task pays for pickling
+        chunk_size = -(-len(missing) // (workers * 4))
+        chunks = [missing[i:i + chunk_size] for i in range(0, len(missing), chunk_size)]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            extracted = [
+                result for chunk_results in executor.map(_extractChunk, chunks)
+                for result in chunk_results
+            ]
+    else:
+        extracted = _extractChunk(missing)
+
+    for lookup, result in zip(missing, extracted):
+        cache.put(*lookup, result)
+        results[lookup] = tuple(result)
+    return [results[lookup] for lookup in lookups]
@@ -0,0 +1,219 @@
+"""Polite, adaptive scheduling of the scraper's requests to the WKSA site.
+
+Every page fetch goes through a RequestScheduler, which caps how many requests are in flight
+with an AIMD (additive increase, multiplicative decrease) limit:
+    - each fast, successful response raises the limit by 1 / limit, so about one more request
+      in flight per round of requests, up to the scraper's WKSA_FETCH_CONCURRENCY
+    - a 5xx or 429 response, a timeout, a connection error, or a response slower than
+      WKSA_FETCH_SLOW_SECONDS halves it, down to 1.  Requests sent before the last decrease do
+      not decrease it again, so one bad round only halves the limit once.
+
+A 429 / 503 response's Retry-After pauses every new request until it has passed.  Each request
+times out after WKSA_FETCH_TIMEOUT_SECONDS, and is retried WKSA_FETCH_RETRIES times with full
+jitter exponential backoff from WKSA_FETCH_BACKOFF_SECONDS, before failing with FetchFailed.  No
+request or retry is started past the run's deadline (see checkpoint.Deadline), and timeouts are
+cut short to end by it; past it, requests fail with DeadlineExceeded.
+
+    run_scheduler = RequestScheduler(8, deadline=checkpoint.Deadline(480))
+    response = run_scheduler.wrap(session).get(url)
+    run_scheduler.report()
+"""
+from email.utils import parsedate_to_datetime
+import os
+import random
+import threading
+import time
+
+import requests
+
+from . import instrumentation
+from .checkpoint import Deadline, DeadlineExceeded
+
+
+FETCH_TIMEOUT_SECONDS = float(os.environ.get('WKSA_FETCH_TIMEOUT_SECONDS', 30))
+FETCH_RETRIES = int(os.environ.get('WKSA_FETCH_RETRIES', 4))
+FETCH_BACKOFF_SECONDS = float(os.environ.get('WKSA_FETCH_BACKOFF_SECONDS', 1))
+# Responses slower than this are taken as the site struggling, and back off like errors
+FETCH_SLOW_SECONDS = float(os.environ.get('WKSA_FETCH_SLOW_SECONDS', 5))
+
+RETRYABLE_ERRORS = (requests.Timeout, requests.ConnectionError)
+
+
+class FetchFailed(Exception):
+    """A request still failed after all of its retries."""
+
+
+def isRetryable(response):
+    return response.status_code == 429 or response.status_code >= 500
+
+
+def retryAfterSeconds(response, now=None):
+    """Seconds the response's Retry-After asks to wait, or None without a usable one."""
+    value = response.headers.get('Retry-After', '').strip()
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+    return max(0.0, retry_at - (time.time() if now is None else now))
+
+
+class ScheduledSession:
+    """Sends a session's GET / POST requests through a scheduler, like a requests.Session."""
+    def __init__(self, scheduler, session):
+        self.scheduler = scheduler
+        self.session = session
+
+    def get(self, url, **kwargs):
+        return self.scheduler.request(self.session.get, url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.scheduler.request(self.session.post, url, **kwargs)
+
+
+class RequestScheduler:
+    """Admits requests up to an AIMD concurrency limit, retrying failed ones politely."""
+    def __init__(self, max_concurrency, deadline=None, timeout=FETCH_TIMEOUT_SECONDS,
+                 retries=FETCH_RETRIES, backoff_seconds=FETCH_BACKOFF_SECONDS,
+                 slow_seconds=FETCH_SLOW_SECONDS, initial_concurrency=2):
+        self.max_concurrency = max(1, max_concurrency)
+        self.limit = float(min(self.max_concurrency, max(1, initial_concurrency)))
+        self.deadline = deadline or Deadline(0)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_seconds = backoff_seconds
+        self.slow_seconds = slow_seconds
+
+        self.in_flight = 0
+        # Bumped on every decrease; requests sent in an older epoch cannot decrease again
+        self.epoch = 0
+        self.paused_until = 0.0
+        self.stats = {
+            'requests': 0, 'attempts': 0, 'retries': 0, 'failed': 0, 'timeouts': 0,
+            'errors': 0, 'throttled': 0, 'decreases': 0, 'peak_limit': self.limit,
+        }
+        self.started = None
+        self.finished = None
+        self._condition = threading.Condition()
+
+    def wrap(self, session):
+        return ScheduledSession(self, session)
+
+    def _acquire(self):
+        """Wait for room under the limit, returning the epoch the request is sent in."""
+        with self._condition:
+            while True:
+                if self.deadline.expired():
+                    raise DeadlineExceeded('Fetch deadline passed with requests left to send')
+                now = time.monotonic()
+                if now >= self.paused_until and self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    if self.started is None:
+                        self.started = now
+                    return self.epoch
+
+                wait = self.paused_until - now if now < self.paused_until else None
+                remaining = self.deadline.remaining()
+                if remaining is not None:
+                    wait = remaining if wait is None else min(wait, remaining)
+                self._condition.wait(wait)
+
+    def _release(self, epoch, outcome):
+        """Adjust the limit by a request's outcome: 'fast', 'slow', 'failed' or None."""
+        with self._condition:
+            self.in_flight -= 1
+            self.finished = time.monotonic()
+            if outcome == 'fast':
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+                self.stats['peak_limit'] = max(self.stats['peak_limit'], self.limit)
+            elif outcome in ('slow', 'failed') and epoch == self.epoch:
+                self.limit = max(1.0, self.limit / 2)
+                self.epoch += 1
+                self.stats['decreases'] += 1
+            self._condition.notify_all()
+
+    def _pause(self, seconds):
+        with self._condition:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.stats['throttled'] += 1
+            self._condition.notify_all()
+
+    def _timeout(self):
+        remaining = self.deadline.remaining()
+        return self.timeout if remaining is None else max(0.001, min(self.timeout, remaining))
+
+    def _count(self, name):
+        with self._condition:
+            self.stats[name] += 1
+
+    def _send(self, send, url, kwargs):
+        """Send one attempt, returning (response, retryable error)."""
+        epoch = self._acquire()
+        outcome = None
+        start = time.monotonic()
+        try:
+            response = send(url, timeout=self._timeout(), **kwargs)
+        except RETRYABLE_ERRORS as error:
+            outcome = 'failed'
+            self._count('timeouts' if isinstance(error, requests.Timeout) else 'errors')
+            return None, error
+        else:
+            outcome = (
+                'failed' if isRetryable(response)
+                else 'slow' if time.monotonic() - start > self.slow_seconds else 'fast')
+            return response, None
+        finally:
+            self._count('attempts')
+            self._release(epoch, outcome)
+
+    def request(self, send, url, **kwargs):
+        """Send a request with send(url, timeout=..., **kwargs), e.g. session.get, with retries.
+
+        Returns the response, which may still be an error other than 5xx / 429.
+        """
+        for attempt in range(self.retries + 1):
+            response, error = self._send(send, url, kwargs)
+            if error is None and not isRetryable(response):
+                self._count('requests')
+                return response
+
+            problem = error if error is not None else 'HTTP %s' % response.status_code
+            if attempt == self.retries:
+                self._count('failed')
+                instrumentation.count('http.failed')
+                raise FetchFailed('%s failed after %s attempts: %s' % (
+                    url, attempt + 1, problem)) from error
+
+            # Full jitter, so requests failing together do not retry together
+            delay = random.uniform(0, self.backoff_seconds * 2 ** attempt)
+            retry_after = retryAfterSeconds(response) if response is not None else None
+            if retry_after is not None:
+                self._pause(retry_after)
+                delay = max(delay, retry_after)
+            if not self.deadline.allows(delay):
+                raise DeadlineExceeded('No time left to retry %s after %s' % (url, problem))
+            print('  Retrying %s in %.1fs after %s' % (url, delay, problem))
+            self._count('retries')
+            instrumentation.count('http.retries')
+            time.sleep(delay)
+        return None
+
+    def throughput(self):
+        """Successful requests per second, from the first request sent to the last answered."""
+        if self.started is None or self.finished is None or self.finished <= self.started:
+            return 0.0
+        return self.stats['requests'] / (self.finished - self.started)
+
+    def report(self):
+        """Print how the run went, returning the stats with the achieved throughput."""
+        stats = dict(self.stats, limit=self.limit, requests_per_second=self.throughput())
+        print(
+            'Fetched %(requests)s pages at %(requests_per_second).1f/s: %(retries)s retries, '
+            '%(failed)s failed, %(timeouts)s timeouts, %(throttled)s Retry-After, '
+            'concurrency %(limit).1f (peak %(peak_limit).1f, %(decreases)s decreases)' % stats)
+        return stats
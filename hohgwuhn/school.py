@@ -0,0 +1,45 @@
+"""The school record passed through the fetch_wksa pipeline, from page parsing to CSV export."""
+from dataclasses import dataclass
+from operator import attrgetter
+
+
+# Field -> CSV column, in the order the columns are written
+CSV_COLUMNS = {
+    'country_name': 'Country',
+    'country_code': 'Country Code',
+    'city': 'City',
+    'region': 'Region',
+    'address': 'Address',
+    'website': 'Website',
+    'phone_numbers': 'Phone #s',
+    'instructor': 'Instructor',
+}
+
+FIELDS = tuple(CSV_COLUMNS)
+CSV_HEADER = tuple(CSV_COLUMNS.values())
+
+
+@dataclass(slots=True)
+class School:
+    """A single WKSA school.  phone_numbers is semicolon delimited, empty until extracted."""
+    country_name: str
+    country_code: str
+    city: str
+    region: str
+    address: str
+    website: str = ''
+    phone_numbers: str = ''
+    instructor: str = ''
+
+    def toDict(self):
+        """Get the school as a plain dict, e.g. for JSON."""
+        return dict(zip(FIELDS, toRow(self)))
+
+    @classmethod
+    def fromDict(cls, school):
+        """Build a school from a dict made by `toDict`."""
+        return cls(**school)
+
+
+# school -> tuple of its values in CSV column order, fetched in a single C call
+toRow = attrgetter(*FIELDS)
@@ -0,0 +1,280 @@
+"""Sharded geocoding: one geocodeFile run per country, or per fixed-size chunk of the scrape.
+
+With WKSA_SHARD_BY set, fetchData does not write a single 'WORLD/<date>' scrape.  Instead it
+writes, under the run prefix '_shards/WORLD/<date>/' of the fetch bucket, a manifest.json listing
+every shard, and then the shards themselves:
+    - 'country': one shard per country, e.g. 'US-000.csv', splitting any country of more than
+      WKSA_SHARD_ROWS schools over several
+    - 'rows': shards of WKSA_SHARD_ROWS schools each, e.g. 'part-00000.csv'
+
+Each shard triggers its own geocodeFile, which writes the geocoded shard to the geocode bucket
+under the same name.  The run that finds every shard of the manifest geocoded merges them, in
+manifest order, into 'WORLD/<date>' in the geocode bucket, which geoETL loads as before.  The
+merge is claimed with a create-only marker object, so it happens once even when the last shards
+finish together.  geoETL ignores everything under '_shards/'.
+
+Concurrent shards each load and save the geocode cache on their own, so use a SQLite cache (or
+none) rather than a single gs:// object when sharding.  Local workers can share a SQLite cache file,
+as each write commits on its own; see geocode_cache.py.
+
+Locally, the scrape is sharded the same way and geocoded over a pool of GEOCODE_SHARD_WORKERS
+processes, sharing GEOCODE_QPS between them:
+
+    python -m hohgwuhn.shards --by country --workers 4
+    python -m hohgwuhn.shards --merge WORLD/2019-01-01     # (re)merge the shards of a GCS run
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import csv
+from datetime import datetime
+import io
+import json
+import os
+import shutil
+
+from . import checkpoint
+from . import gcs
+
+
+SHARD_PREFIX = '_shards/'
+MANIFEST_NAME = 'manifest.json'
+MERGED_MARKER = '_merged'
+LOCAL_SHARD_DIR = '../data/shards'
+
+SHARD_BY = os.environ.get('WKSA_SHARD_BY', '')
+SHARD_ROWS = int(os.environ.get('WKSA_SHARD_ROWS', 5000))
+SHARD_WORKERS = int(os.environ.get('GEOCODE_SHARD_WORKERS', os.cpu_count() or 1))
+
+
+def isShardName(blob_name):
+    """Whether a blob is a shard or manifest of a sharded run."""
+    return blob_name.startswith(SHARD_PREFIX)
+
+
+def isManifestName(blob_name):
+    return isShardName(blob_name) and blob_name.endswith('/' + MANIFEST_NAME)
+
+
+def shardPrefix(run_name):
+    """The prefix of a run's shards, e.g. '_shards/WORLD/2019-01-01/'."""
+    return '%s%s/' % (SHARD_PREFIX, run_name)
+
+
+def runName(shard_name):
+    """The run a shard belongs to, e.g. 'WORLD/2019-01-01'."""
+    return shard_name[len(SHARD_PREFIX):].rsplit('/', 1)[0]
+
+
+def planShards(rows, country_column, by, max_rows=SHARD_ROWS):
+    """Split the rows of a scrape into shards, as an ordered dict of shard name to rows."""
+    if by == 'rows':
+        return {
+            'part-%05d.csv' % (start // max_rows): rows[start:start + max_rows]
+            for start in range(0, len(rows), max_rows)
+        }
+    if by != 'country':
+        raise ValueError('Unknown sharding %r, expected country or rows' % by)
+
+    countries = {}
+    for row in rows:
+        countries.setdefault(row[country_column] or 'XX', []).append(row)
+    return {
+        '%s-%03d.csv' % (country_code, start // max_rows): country_rows[start:start + max_rows]
+        for country_code, country_rows in countries.items()
+        for start in range(0, len(country_rows), max_rows)
+    }
+
+
+def _csvText(header, rows):
+    text_out = io.StringIO()
+    writer = csv.writer(text_out, lineterminator='\n')
+    writer.writerow(header)
+    writer.writerows(rows)
+    return text_out.getvalue()
+
+
+def _manifest(run_name, header, planned):
+    return {
+        'run': run_name,
+        'header': list(header),
+        'shards': [{'name': name, 'rows': len(rows)} for name, rows in planned.items()],
+    }
+
+
+def exportShards(header, rows, run_name, by=SHARD_BY, max_rows=SHARD_ROWS):
+    """Write a scrape to the fetch bucket as the shards of a run, after their manifest.
+
+    The manifest goes first, so no shard can find the run complete before all are listed.
+    """
+    planned = planShards(rows, header.index('Country Code'), by, max_rows)
+    manifest = _manifest(run_name, header, planned)
+    bucket = gcs.getFetchBucket()
+    gcs.uploadText(
+        bucket, shardPrefix(run_name) + MANIFEST_NAME, json.dumps(manifest, indent=2),
+        content_type='application/json')
+    for name, shard_rows in planned.items():
+        gcs.uploadText(bucket, shardPrefix(run_name) + name, _csvText(header, shard_rows))
+    print('Exported %s schools in %s shards under %s' % (
+        len(rows), len(planned), shardPrefix(run_name)))
+    return manifest
+
+
+def _countRows(text):
+    """Get (header, row count) of a CSV text."""
+    reader = csv.reader(io.StringIO(text, newline=''))
+    header = next(reader, None)
+    return header, sum(1 for _ in reader)
+
+
+def _checkShard(shard, text, header):
+    shard_header, row_count = _countRows(text)
+    if row_count != shard['rows']:
+        raise ValueError('Shard %s has %s rows, but the manifest lists %s' % (
+            shard['name'], row_count, shard['rows']))
+    if header is not None and shard_header != header:
+        raise ValueError('Shard %s does not have the columns of the others' % shard['name'])
+    return shard_header
+
+
+def _claimMerge(bucket, run_name):
+    """Create the run's merge marker, unless another run already has."""
+    from google.api_core.exceptions import PreconditionFailed  # pylint: disable=C0415
+    try:
+        bucket.blob(shardPrefix(run_name) + MERGED_MARKER).upload_from_string(
+            b'', if_generation_match=0)
+    except PreconditionFailed:
+        return False
+    return True
+
+
+def mergeIfComplete(run_name, force=False):
+    """Merge a run's geocoded shards into its geodata file, once every one of them is done.
+
+    Returns whether this call merged them.  With force, merge even if already claimed.
+    """
+    manifest_blob = gcs.getFetchBucket().blob(shardPrefix(run_name) + MANIFEST_NAME)
+    manifest = json.loads(manifest_blob.download_as_string().decode())
+    bucket = gcs.getGeocodeBucket()
+    prefix = shardPrefix(run_name)
+    done = {blob.name[len(prefix):] for blob in bucket.list_blobs(prefix=prefix)}
+    missing = [shard['name'] for shard in manifest['shards'] if shard['name'] not in done]
+    if missing:
+        print('%s of %s shards of %s geocoded' % (
+            len(manifest['shards']) - len(missing), len(manifest['shards']), run_name))
+        return False
+
+    # Check every shard before writing anything, so a bad one cannot publish a partial file
+    header = None
+    for shard in manifest['shards']:
+        header = _checkShard(
+            shard, gcs.openBlobReader(bucket, prefix + shard['name'], streaming=False).read(),
+            header)
+    if not _claimMerge(bucket, run_name) and not force:
+        print('Shards of %s are already being merged' % run_name)
+        return False
+
+    with gcs.openBlobWriter(bucket, run_name) as file_out:
+        for index, shard in enumerate(manifest['shards']):
+            text = gcs.openBlobReader(bucket, prefix + shard['name'], streaming=False).read()
+            # Every shard starts with the header, which is only written once
+            file_out.write(text if index == 0 else text.split('\n', 1)[1])
+    for shard in manifest['shards']:
+        bucket.blob(prefix + shard['name']).delete()
+    print('Merged %s shards into %s' % (len(manifest['shards']), run_name))
+    return True
+
+
+def _geocodeLocalShard(shard_dir, name, queries_per_second, api_factory):
+    """Geocode one local shard into shard_dir/geocoded, checkpointed like a GCS run."""
+    # pylint: disable=import-outside-toplevel
+    import pandas as pd
+    from . import geocoder_googs as geocoder
+
+    school_df = pd.read_csv(os.path.join(shard_dir, name), keep_default_na=False)
+    # pylint: disable=protected-access
+    prior_file = geocoder._findPriorGeoData() if geocoder.GEOCODE_INCREMENTAL else None
+    prior_df = pd.read_csv(prior_file, keep_default_na=False, dtype=str) if prior_file else None
+    if prior_file:
+        prior_file.close()
+    needs_geocode = geocoder.applyPriorGeoData(school_df, prior_df)
+
+    progress = checkpoint.Checkpoint(
+        checkpoint.LocalCheckpointStore(os.path.join(shard_dir, '_checkpoints', name)))
+    geocode_api = (api_factory or geocoder.LimitedApiManager)(
+        queries_per_second, cache=geocoder.openGeocodeCache())
+    try:
+        geocoder.geocodeInChunks(
+            school_df, geocode_api, needs_geocode, progress, gazetteer=geocoder.openGazetteer())
+    finally:
+        geocode_api.close()
+
+    os.makedirs(os.path.join(shard_dir, 'geocoded'), exist_ok=True)
+    school_df.to_csv(os.path.join(shard_dir, 'geocoded', name), index=False)
+    progress.clear()
+    return name
+
+
+def runLocal(scrape_file=None, by='country', max_rows=SHARD_ROWS, workers=SHARD_WORKERS,
+             shard_dir=None, api_factory=None):
+    """Geocode the local scrape shard by shard over a process pool, then merge the shards.
+
+    api_factory(queries_per_second, cache=...) builds each worker's API manager; it defaults to
+    LimitedApiManager, and must be picklable.
+    """
+    # pylint: disable=import-outside-toplevel
+    import pandas as pd
+    from . import geocoder_googs as geocoder
+    if scrape_file is None:
+        from . import fetch_wksa as fetch
+        scrape_file = fetch.SCHOOL_EXPORT_FILE
+    shard_dir = shard_dir or os.path.join(LOCAL_SHARD_DIR, datetime.today().strftime('%Y-%m-%d'))
+
+    with open(scrape_file, 'r', newline='') as scrape_in:
+        reader = csv.reader(scrape_in)
+        header = next(reader)
+        planned = planShards(list(reader), header.index('Country Code'), by, max_rows)
+    os.makedirs(shard_dir, exist_ok=True)
+    for name, rows in planned.items():
+        # Shards geocoded by an earlier, interrupted run are not redone
+        if not os.path.exists(os.path.join(shard_dir, 'geocoded', name)):
+            with open(os.path.join(shard_dir, name), 'w', newline='') as shard_out:
+                shard_out.write(_csvText(header, rows))
+    pending = [
+        name for name in planned
+        if not os.path.exists(os.path.join(shard_dir, 'geocoded', name))
+    ]
+
+    workers = max(1, min(workers, len(pending) or 1))
+    queries_per_second = max(1, geocoder.GEOCODE_QPS // workers)
+    print('Geocoding %s of %s shards over %s processes at %s QPS each' % (
+        len(pending), len(planned), workers, queries_per_second))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for name in executor.map(
+                _geocodeLocalShard, [shard_dir] * len(pending), pending,
+                [queries_per_second] * len(pending), [api_factory] * len(pending)):
+            print('  Geocoded shard %s' % name)
+
+    school_df = pd.concat([
+        pd.read_csv(os.path.join(shard_dir, 'geocoded', name), keep_default_na=False, dtype=str)
+        for name in planned
+    ], ignore_index=True)
+    geocoder.exportGeoData(school_df)
+    shutil.rmtree(shard_dir)
+    print('Merged %s shards, %s schools' % (len(planned), len(school_df)))
+    return school_df
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--by', choices=['country', 'rows'], default=SHARD_BY or 'country')
+    parser.add_argument('--rows', type=int, default=SHARD_ROWS, help='Max schools per shard')
+    parser.add_argument('--workers', type=int, default=SHARD_WORKERS)
+    parser.add_argument('--merge', metavar='RUN',
+                        help='Merge the geocoded shards of a GCS run, e.g. WORLD/2019-01-01')
+    args = parser.parse_args()
+
+    if args.merge:
+        mergeIfComplete(args.merge, force=True)
+    else:
+        runLocal(by=args.by, max_rows=args.rows, workers=args.workers)
@@ -0,0 +1,126 @@
+"""Columnar store for the dated scrape history in data/<date>/.
+
+Each CSV snapshot (school_data.csv from exportCSV, school_geodata.csv from exportGeoData) gets a
+compact Arrow IPC twin next to it (school_data.arrow, school_geodata.arrow), with:
+    - Country, Country Code, Region, City and Geocode Type as dictionary encoded (categorical)
+    - Latitude and Longitude as float64, null where the school was not geocoded
+    - everything else as strings
+
+The Arrow files are uncompressed, so they are opened memory-mapped and read without copying.
+Twins are created on first use, so the CSVs stay the source of truth.
+
+    listSnapshots()  ->  ['2015-07-06', ..., '2019-01-01']
+    openSnapshot('2019-01-01', columns=['City', 'Latitude', 'Longitude'])  ->  pyarrow.Table
+    loadHistory(columns=['Country Code', 'City'])  ->  DataFrame with a Snapshot column
+"""
+import os
+
+import pandas as pd
+import pyarrow as pa
+
+
+SNAPSHOT_DIR = '../data'
+
+# Snapshot kind -> the file name (without extension) used for it
+SNAPSHOT_KINDS = {
+    'scrape': 'school_data',
+    'geodata': 'school_geodata',
+}
+
+CATEGORICAL_COLUMNS = ['Country', 'Country Code', 'Region', 'City', 'Geocode Type']
+COORDINATE_COLUMNS = ['Latitude', 'Longitude']
+
+
+def _snapshotPath(date, kind, extension, data_dir):
+    return os.path.join(data_dir, date, '%s.%s' % (SNAPSHOT_KINDS[kind], extension))
+
+
+def listSnapshots(kind='geodata', data_dir=SNAPSHOT_DIR):
+    """List the dates with a snapshot of the given kind, oldest first."""
+    return sorted(
+        date for date in os.listdir(data_dir)
+        if os.path.exists(_snapshotPath(date, kind, 'csv', data_dir)) or
+        os.path.exists(_snapshotPath(date, kind, 'arrow', data_dir))
+    )
+
+
+def toColumnar(school_df):
+    """Convert a scrape or geodata DataFrame into a compactly typed Arrow table."""
+    school_df = school_df.copy()
+    # The index column written by older versions of exportGeoData carries no data
+    school_df = school_df.drop(columns=[
+        column for column in school_df.columns if str(column).startswith('Unnamed:')])
+
+    for column in school_df.columns:
+        if column in COORDINATE_COLUMNS:
+            school_df[column] = pd.to_numeric(school_df[column], errors='coerce').astype('float64')
+        elif column in CATEGORICAL_COLUMNS:
+            school_df[column] = school_df[column].astype(str).astype('category')
+        else:
+            school_df[column] = school_df[column].astype(str).astype(object)
+    return pa.Table.from_pandas(school_df, preserve_index=False)
+
+
+def writeSnapshot(school_df, date, kind='geodata', data_dir=SNAPSHOT_DIR):
+    """Write the Arrow snapshot of a DataFrame for the given date, returning its path."""
+    arrow_path = _snapshotPath(date, kind, 'arrow', data_dir)
+    os.makedirs(os.path.dirname(arrow_path), exist_ok=True)
+
+    table = toColumnar(school_df)
+    # Write to the side and swap in, so readers never map a partial file
+    temp_path = '%s.tmp' % arrow_path
+    with pa.OSFile(temp_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(temp_path, arrow_path)
+    return arrow_path
+
+
+def convertCSV(csv_path, date, kind='geodata', data_dir=SNAPSHOT_DIR):
+    """Write the Arrow snapshot for the given date from any scrape or geodata CSV."""
+    school_df = pd.read_csv(csv_path, keep_default_na=False, dtype=str)
+    return writeSnapshot(school_df, date, kind, data_dir)
+
+
+def convertSnapshot(date, kind='geodata', data_dir=SNAPSHOT_DIR):
+    """Create (or refresh) the Arrow twin of a CSV snapshot."""
+    return convertCSV(_snapshotPath(date, kind, 'csv', data_dir), date, kind, data_dir)
+
+
+def openSnapshot(date, kind='geodata', columns=None, data_dir=SNAPSHOT_DIR):
+    """Open a snapshot as a memory-mapped Arrow table, projected to the given columns.
+
+    Columns missing from older snapshots are skipped.  The Arrow twin is created from the CSV
+    when missing or older than the CSV.
+    """
+    arrow_path = _snapshotPath(date, kind, 'arrow', data_dir)
+    csv_path = _snapshotPath(date, kind, 'csv', data_dir)
+    if not os.path.exists(arrow_path) or (
+            os.path.exists(csv_path) and os.path.getmtime(csv_path) > os.path.getmtime(arrow_path)):
+        convertSnapshot(date, kind, data_dir)
+
+    table = pa.ipc.open_file(pa.memory_map(arrow_path, 'r')).read_all()
+    if columns is not None:
+        table = table.select([column for column in columns if column in table.column_names])
+    return table
+
+
+def iterSnapshots(dates=None, kind='geodata', columns=None, data_dir=SNAPSHOT_DIR):
+    """Lazily yield (date, table) for each snapshot, opening each one only when reached."""
+    for date in listSnapshots(kind, data_dir) if dates is None else dates:
+        yield date, openSnapshot(date, kind, columns, data_dir)
+
+
+def loadHistory(dates=None, kind='geodata', columns=None, data_dir=SNAPSHOT_DIR):
+    """Load several snapshots into one DataFrame, with the snapshot date in a Snapshot column."""
+    tables = []
+    for date, table in iterSnapshots(dates, kind, columns, data_dir):
+        snapshot_column = pa.DictionaryArray.from_arrays(
+            pa.array([0] * table.num_rows, pa.int32()), pa.array([date]))
+        tables.append(table.add_column(0, 'Snapshot', snapshot_column))
+    if not tables:
+        return pd.DataFrame(columns=['Snapshot'] + list(columns or []))
+
+    # Concatenate before converting, so the categorical columns survive as one category set
+    history = pa.concat_tables(tables, promote_options='permissive').unify_dictionaries()
+    return history.combine_chunks().to_pandas()
@@ -1,14 +1,15 @@
-"""Wrapper file for use with Google Cloud Functions."""
-# pylint: disable=line-too-long
-from datetime import datetime
-import os
+"""Wrapper file for use with Google Cloud Functions.
 
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail
+Each function imports only the modules it needs, when it is first called, so a cold start of one
+function does not pay for the libraries of the others.  `benchmarks/bench_startup.py` measures
+the import time and memory of each entry point.
 
-from hohgwuhn import geocoder_googs
-from hohgwuhn import geoetl
-from hohgwuhn import fetch_wksa
+Each function runs inside `instrumentation.invocation`, which prints (or exports, see
+`HOHGWUHN_METRICS_EXPORTERS`) one JSON summary of the stage timings and counters when it ends.
+"""
+# pylint: disable=line-too-long,import-outside-toplevel
+from datetime import datetime
+import os
 
 
 def fetchData(data=None, context=None):
@@ -18,7 +19,13 @@ def fetchData(data=None, context=None):
     Deploy with:
         gcloud functions deploy fetchData --runtime python37 --trigger-topic hoh-gwuhn-scrape --memory 128
     """
-    fetch_wksa.fetchData()
+    from sendgrid import SendGridAPIClient
+    from sendgrid.helpers.mail import Mail
+
+    from hohgwuhn import fetch_wksa, instrumentation
+
+    with instrumentation.invocation('fetchData'):
+        fetch_wksa.fetchData()
     fetch_string = "Data fetch at %s" % datetime.today().strftime('%Y-%m-%d')
     print(fetch_string)
 
@@ -43,10 +50,16 @@ def geocodeFile(data=None, context=None):
     # pylint: disable=unused-argument
     """Wrapper around geocoder_googs.loadSchoolData, intended to be called as GCF via GCS event.
 
+    Runs that reach their deadline upload a '_continue/' object to the same bucket, triggering
+    this again for the rest of the file (see hohgwuhn/checkpoint.py).
+
     Deploy with:
         gcloud functions deploy geocodeFile --runtime python37 --trigger-resource pandelyon-hoh-gwuhn-fetch --memory 128 --trigger-event google.storage.object.finalize --timeout 540
     """
-    geocoder_googs.loadSchoolData(data['name'])
+    from hohgwuhn import geocoder_googs, instrumentation
+
+    with instrumentation.invocation('geocodeFile'):
+        geocoder_googs.loadSchoolData(data['name'])
     print("Data geocode for %s at %s" % (data['name'], datetime.today().strftime('%Y-%m-%d')))
 
 
@@ -57,9 +70,12 @@ def geoETL(data=None, context=None):
     Deploy with:
         gcloud functions deploy geoETL --runtime python37 --trigger-resource pandelyon-hoh-gwuhn-geocode --memory 128 --trigger-event google.storage.object.finalize --timeout 540
     """
+    from hohgwuhn import geoetl, instrumentation
+
     print('GCS Data')
     print(data)
-    geoetl.loadCountryFile(data['name'])
+    with instrumentation.invocation('geoETL'):
+        geoetl.loadCountryFile(data['name'])
     print(
         "Geocode data loaded to Firestore for %s at %s" % (
             data['name'],
@@ -0,0 +1,88 @@
+# pylint: disable=W0621,R0201
+import io
+
+from google.api_core.exceptions import PreconditionFailed
+import pytest
+
+from hohgwuhn import gcs
+
+
+class FakeApiManager:
+    """Stands in for LimitedApiManager, finding only the addresses it is given"""
+    def __init__(self, known_addresses):
+        self.known_addresses = known_addresses
+        self.calls = []
+
+    def get(self, address, country_code):
+        self.calls.append((address, country_code))
+        if address not in self.known_addresses:
+            return []
+        return [{
+            'formatted_address': 'Found %s' % address,
+            'geometry': {
+                'location': {'lat': self.known_addresses[address], 'lng': -1.0},
+                'location_type': 'APPROXIMATE',
+            },
+        }]
+
+
+@pytest.fixture
+def fake_api_manager():
+    """Builds a FakeApiManager around {address: latitude} of the addresses it finds"""
+    return FakeApiManager
+
+
+class FakeBlob:
+    """Stands in for a GCS blob, kept in its bucket's dict"""
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+
+    def upload_from_string(self, data, content_type=None, if_generation_match=None):
+        # pylint: disable=unused-argument
+        if if_generation_match == 0 and self.name in self.bucket.objects:
+            raise PreconditionFailed('%s exists' % self.name)
+        self.bucket.objects[self.name] = data.encode() if isinstance(data, str) else data
+
+    def exists(self):
+        return self.name in self.bucket.objects
+
+    def download_as_string(self):
+        return self.bucket.objects[self.name]
+
+    def open(self, mode, **_):
+        if mode == 'r':
+            return io.StringIO(self.download_as_string().decode(), newline='')
+        blob = self
+
+        class Writer(io.StringIO):
+            def close(self):
+                blob.upload_from_string(self.getvalue())
+                super().close()
+        return Writer()
+
+    def delete(self):
+        del self.bucket.objects[self.name]
+
+
+class FakeBucket:
+    """Stands in for a GCS bucket"""
+    def __init__(self):
+        self.objects = {}
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+    def get_blob(self, name):
+        return FakeBlob(self, name) if name in self.objects else None
+
+    def list_blobs(self, prefix=''):
+        return [FakeBlob(self, name) for name in sorted(self.objects) if name.startswith(prefix)]
+
+
+@pytest.fixture
+def buckets(monkeypatch):
+    """Swap GCS for in-memory fetch and geocode buckets"""
+    buckets = {gcs.GCLOUD_FETCH_BUCKET: FakeBucket(), gcs.GCLOUD_GEOCODE_BUCKET: FakeBucket()}
+    monkeypatch.setattr(gcs, 'getBucket', lambda name: buckets[name])
+    return buckets
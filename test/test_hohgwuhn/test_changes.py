@@ -0,0 +1,136 @@
+# pylint: disable=W0621,R0201
+import io
+import json
+import os
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+
+from hohgwuhn import changes
+
+
+OLD_SCRAPE_CSV = '''Country,Country Code,City,Region,Address,Website,Phone #s,Instructor
+DENMARK,DK,Ikast,Ikast,Bogildvej 2 7430 Ikast,,21 47 32 57,Instr. Phil Brooks
+U.S.A.,US,Crystal Lake,Illinois,"8900 US Hwy 14 Crystal Lke, IL 60012",,(847) 962-8600,PKJN Tim Seitz
+U.S.A.,US,Peoria,Illinois,"1530 N. 8th Street Pekin, IL 61554",,(309) 555-0100,Inst. Joshua Smith
+U.S.A.,US,Austin,Texas,"100 Congress Ave Austin, TX 78701",,(512) 555-0199,Inst. Lee
+U.S.A.,US,Austin,Texas,"100 Congress Ave Austin, TX 78701",,(512) 555-0199,Inst. Lee
+'''
+
+NEW_SCRAPE_CSV = '''Country,Country Code,City,Region,Address,Website,Phone #s,Instructor
+U.S.A.,US,Austin,Texas,"100 Congress Ave Austin, TX 78701",,(512) 555-0199,Inst. Lee
+DENMARK,DK,IKAST,Ikast,"Bøgildvej 2, 7430 Ikast",,21 47 32 57,Instr. Phil Brooks
+U.S.A.,US,Crystal Lake,Illinois,"8900 US Hwy 14 Crystal Lake, IL 60012",,(847) 962-8600,Inst. Tim Seitz
+U.S.A.,US,Pekin,Illinois,"122 S. 14th Street Pekin, IL 61554",,(309) 555-0100,Inst. Joshua Smith
+JAPAN,JP,Tokyo,Tokyo,1-2-3 Shibuya,,03-1234-5678,Inst. Sato
+'''
+
+OLD_GEODATA_CSV = '''City,Region,Address,Phone #s,Instructor,Latitude,Longitude,Geocode Type
+Crystal Lake,Illinois,"8900 US Hwy 14 Crystal Lke, IL 60012",(847) 962-8600,PKJN Tim Seitz,42.26,-88.37,ROOFTOP
+Peoria,Illinois,"1530 N. 8th Street Pekin, IL 61554",(309) 555-0100,Inst. Joshua Smith,40.5986,-89.6
+'''
+
+NEW_GEODATA_CSV = ''',Country,Country Code,City,Region,Address,Website,Phone #s,Instructor,Latitude,Longitude,Geocode Type,Google Address
+0,U.S.A.,US,Crystal Lake,Illinois,"8900 US Hwy 14 Crystal Lke, IL 60012",,(847) 962-8600,PKJN Tim Seitz,42.26,-88.37,ROOFTOP,"8900 US-14, Crystal Lake"
+1,U.S.A.,US,Peoria,Illinois,"1530 N. 8th Street Pekin, IL 61554",,(309) 555-0100,Inst. Joshua Smith,40.5666,-89.6,,
+'''
+
+
+def readCSV(contents):
+    return pd.read_csv(io.StringIO(contents), dtype=str, keep_default_na=False)
+
+
+@pytest.fixture
+def scrape_diff():
+    """The diff between two worldwide scrapes"""
+    return changes.diffSnapshots(
+        readCSV(OLD_SCRAPE_CSV), readCSV(NEW_SCRAPE_CSV), '2018-03-17', '2019-01-01')
+
+
+class TestAlignment:
+    """Verify schools are paired up across snapshots"""
+
+    def test_normalization(self):
+        """Verify case, accents, punctuation and spacing are folded, and other scripts kept"""
+        assert changes.normalizeText(['Crème-Brûlée  St.', 'IKAST', '서울 강남', None]).tolist() == [
+            'creme brulee st', 'ikast', '서울 강남', '']
+
+    def test_passes(self, scrape_diff):
+        """Verify exact, fuzzy and phone matches, with duplicates paired one to one"""
+        pairs = changes.alignSchools(readCSV(OLD_SCRAPE_CSV), readCSV(NEW_SCRAPE_CSV))
+        assert sorted(zip(pairs['row_old'], pairs['row_new'], pairs['match'])) == [
+            (0, 1, 'fuzzy'),
+            (1, 2, 'fuzzy'),
+            (2, 3, 'phone'),
+            (3, 0, 'exact'),
+        ]
+        assert scrape_diff.removed['Address'].tolist() == ['100 Congress Ave Austin, TX 78701']
+        assert scrape_diff.added['Country Code'].tolist() == ['JP']
+
+    def test_signatures_are_reproducible(self):
+        """Verify trigram signatures do not depend on the process's hash seed"""
+        script = ('from hohgwuhn import changes; '
+                  'print(changes.trigramSignatures(["12 Main St", "서울"]).nonzero()[1].tolist())')
+        signature_bits = {
+            subprocess.run(
+                [sys.executable, '-c', script], capture_output=True, text=True, check=True,
+                env=dict(os.environ, PYTHONHASHSEED=seed)).stdout
+            for seed in ['1', '2']
+        }
+        assert len(signature_bits) == 1
+        assert signature_bits.pop().strip() == str(
+            changes.trigramSignatures(['12 Main St', '서울']).nonzero()[1].tolist())
+
+    def test_unrelated_addresses_not_matched(self):
+        """Verify a closed school replaced by a new one in the same city is not a modification"""
+        old_df = readCSV(OLD_SCRAPE_CSV).iloc[[3]]
+        new_df = old_df.assign(
+            Address='77 Riverside Dr Austin, TX 78704', **{'Phone #s': '', 'Instructor': 'X'})
+        diff = changes.diffSnapshots(old_df, new_df)
+        assert (len(diff.added), len(diff.removed), len(diff.modified)) == (1, 1, 0)
+
+
+class TestChanges:
+    """Verify the per-field changes reported for matched schools"""
+
+    def test_field_changes(self, scrape_diff):
+        """Verify changed fields are listed and moves are flagged"""
+        modified = scrape_diff.modified.set_index('New Row')
+        assert modified.loc[1, 'Changed'] == 'City, Address'
+        assert not modified.loc[1, 'Moved']
+        assert modified.loc[2, 'Changed'] == 'Address, Instructor'
+        assert modified.loc[3, 'Moved']
+        assert 0 not in modified.index
+
+        instructor = scrape_diff.changes[scrape_diff.changes['Field'] == 'Instructor']
+        assert instructor[['Old', 'New']].values.tolist() == [['PKJN Tim Seitz', 'Inst. Tim Seitz']]
+
+    def test_summary_and_report(self, scrape_diff):
+        """Verify the summary counts and that the full report is JSON serializable"""
+        assert scrape_diff.summary() == {
+            'old': '2018-03-17',
+            'new': '2019-01-01',
+            'added': 1,
+            'removed': 1,
+            'modified': 3,
+            'moved': 1,
+            'unchanged': 1,
+            'fields': {'Address': 3, 'City': 2, 'Instructor': 1},
+        }
+        report = json.loads(json.dumps(scrape_diff.toDict()))
+        assert report['modified'][0]['changes'] == {
+            'City': ['Ikast', 'IKAST'], 'Address': ['Bogildvej 2 7430 Ikast', 'Bøgildvej 2, 7430 Ikast']}
+
+    def test_geodata_across_schemas(self, tmp_path):
+        """Verify an old US-only geodata file diffs against a newer one, moves by coordinates"""
+        old_path, new_path = tmp_path / 'old.csv', tmp_path / 'new.csv'
+        old_path.write_text(OLD_GEODATA_CSV)
+        new_path.write_text(NEW_GEODATA_CSV)
+
+        diff, = changes.diffHistory([str(old_path), str(new_path)])
+        assert diff.summary()['unchanged'] == 1
+        assert diff.modified['Changed'].tolist() == ['Latitude']
+        assert diff.modified['Moved'].tolist() == [True]
+        assert diff.changes['Old'].tolist() == [40.5986]
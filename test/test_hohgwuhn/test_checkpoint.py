@@ -0,0 +1,240 @@
+# pylint: disable=W0621,R0201
+import io
+import json
+
+import googlemaps
+import pandas as pd
+import pytest
+
+from hohgwuhn import checkpoint, gcs, geoetl
+from hohgwuhn import geocoder_googs as geocoder
+
+
+SCRAPE_NAME = 'U.S.A./2019-01-01'
+
+
+@pytest.fixture
+def buckets(buckets):
+    """The in-memory buckets, holding a scrape of 5000 schools"""
+    scrape = pd.DataFrame({
+        'Country': 'U.S.A.',
+        'Country Code': 'US',
+        'City': ['City %s' % (i % 100) for i in range(5000)],
+        'Region': 'Illinois',
+        'Address': ['%s Main St' % i for i in range(5000)],
+    })
+    buckets[gcs.GCLOUD_FETCH_BUCKET].blob(SCRAPE_NAME).upload_from_string(
+        scrape.to_csv(index=False))
+    return buckets
+
+
+class FakeApiManager:
+    """Stands in for LimitedApiManager, finding every address until its deadline passes"""
+    def __init__(self, calls_before_deadline=None):
+        self.calls_before_deadline = calls_before_deadline
+        self.calls = []
+
+    def get(self, address, country_code):
+        if self.calls_before_deadline is not None and (
+                len(self.calls) >= self.calls_before_deadline):
+            raise checkpoint.DeadlineExceeded('Out of time')
+        self.calls.append((address, country_code))
+        return [{
+            'formatted_address': address,
+            'geometry': {'location': {'lat': 1.5, 'lng': -1.5}, 'location_type': 'ROOFTOP'},
+        }]
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def api_managers(monkeypatch):
+    """Hand out the given fake API managers to loadSchoolData, one per run"""
+    managers = []
+
+    def useManagers(*new_managers):
+        managers.extend(new_managers)
+    monkeypatch.setattr(
+        geocoder, 'LimitedApiManager', lambda *args, **kwargs: managers.pop(0))
+    monkeypatch.setattr(geocoder, 'openGeocodeCache', lambda: None)
+    monkeypatch.setattr(geocoder, 'openGazetteer', lambda: None)
+    return useManagers
+
+
+class TestResume:
+    """Verify runs cut short are picked up by a continuation"""
+
+    @pytest.mark.parametrize('streaming', [False, True])
+    def test_continuation_resumes(self, buckets, api_managers, streaming):
+        """Verify the continuation only geocodes the chunks the first run did not finish"""
+        first_run, second_run = FakeApiManager(calls_before_deadline=2500), FakeApiManager()
+        api_managers(first_run, second_run)
+        fetch_bucket, geocode_bucket = (
+            buckets[gcs.GCLOUD_FETCH_BUCKET], buckets[gcs.GCLOUD_GEOCODE_BUCKET])
+
+        assert not geocoder.loadSchoolData(SCRAPE_NAME, streaming=streaming)
+        assert SCRAPE_NAME not in geocode_bucket.objects
+        assert list(geocode_bucket.objects) == [
+            '_checkpoints/U.S.A./2019-01-01/rows-000000000.csv']
+        continuation_name = '_continue/' + SCRAPE_NAME
+        assert json.loads(fetch_bucket.objects[continuation_name]) == {
+            'file_name': SCRAPE_NAME, 'continuation': 1}
+        # Checkpoints do not reach Firestore
+        assert geoetl.loadCountryFile(list(geocode_bucket.objects)[0]) is None
+
+        assert geocoder.loadSchoolData(continuation_name, streaming=streaming)
+        assert len(second_run.calls) == 3000
+        assert ('2000 Main St', 'US') in second_run.calls
+        assert list(geocode_bucket.objects) == [SCRAPE_NAME]
+        assert continuation_name not in fetch_bucket.objects
+
+        geodata = pd.read_csv(io.BytesIO(geocode_bucket.objects[SCRAPE_NAME]), dtype=str)
+        assert len(geodata) == 5000
+        assert geodata['Latitude'].eq('1.5').all()
+        assert geodata['Google Address'].tolist() == ['%s Main St' % i for i in range(5000)]
+
+    def test_no_progress_does_not_continue(self, buckets, api_managers):
+        """Verify a run that finished no chunk does not trigger another"""
+        api_managers(FakeApiManager(calls_before_deadline=10))
+        assert not geocoder.loadSchoolData(SCRAPE_NAME)
+        assert list(buckets[gcs.GCLOUD_FETCH_BUCKET].objects) == [SCRAPE_NAME]
+
+    def test_changed_scrape_ignores_checkpoint(self, tmp_path):
+        """Verify saved chunks are only reused while they match the scrape"""
+        school_df = pd.DataFrame({
+            'Country Code': ['US', 'US'], 'City': ['A', 'B'], 'Region': ['R', 'R'],
+            'Address': ['1 Main St', '2 Main St'],
+        })
+        progress = checkpoint.Checkpoint(checkpoint.LocalCheckpointStore(str(tmp_path)))
+        assert geocoder.geocodeInChunks(school_df, FakeApiManager(), progress=progress)
+        assert progress.load(0, school_df, geocoder.GEOCODE_JOIN_COLUMNS) is not None
+
+        reopened = checkpoint.Checkpoint(checkpoint.LocalCheckpointStore(str(tmp_path)))
+        school_df.loc[1, 'Address'] = '3 Main St'
+        assert reopened.load(0, school_df, geocoder.GEOCODE_JOIN_COLUMNS) is None
+
+        assert checkpoint.Checkpoint(
+            checkpoint.LocalCheckpointStore(str(tmp_path)), resume=False).parts == set()
+
+
+class ScriptedDeadline:
+    """Stands in for a Deadline, with the given seconds remaining each time it is asked"""
+    def __init__(self, remaining):
+        self.remaining_seconds = list(remaining)
+
+    def remaining(self):
+        return self.remaining_seconds.pop(0)
+
+    def expired(self):
+        return False
+
+
+class TestDeadlineParts:
+    """Verify chunks are cut into parts that fit in the time left"""
+
+    def test_parts_fit_the_time_left(self, tmp_path):
+        """Verify a chunk near the deadline keeps the part it finished, and resumes after it"""
+        school_df = pd.DataFrame({
+            'Country Code': 'US', 'City': 'A', 'Region': 'R',
+            'Address': ['%s Main St' % i for i in range(1000)],
+        })
+        progress = checkpoint.Checkpoint(checkpoint.LocalCheckpointStore(str(tmp_path)))
+        # Time for 300 schools at 2 calls each, then none
+        deadline = ScriptedDeadline([600 / geocoder.GEOCODE_QPS, 0])
+        first_run = FakeApiManager()
+        assert not geocoder.geocodeInChunks(
+            school_df.copy(), first_run, progress=progress, deadline=deadline, chunk_rows=1000)
+        assert len(first_run.calls) == 300
+        assert progress.parts == {'rows-000000000.csv'}
+
+        second_run = FakeApiManager()
+        assert geocoder.geocodeInChunks(
+            school_df, second_run, progress=progress, deadline=checkpoint.Deadline(0),
+            chunk_rows=1000)
+        assert second_run.calls[0] == ('300 Main St', 'US')
+        assert len(second_run.calls) == 700
+        assert progress.parts == {'rows-000000000.csv', 'rows-000000300.csv'}
+        assert school_df['Google Address'].tolist() == ['%s Main St' % i for i in range(1000)]
+
+    def test_only_rows_to_geocode_count(self):
+        """Verify rows that are not geocoded do not use up the time left"""
+        needed = [True, False, False, True, True]
+        assert geocoder._partRows(  # pylint: disable=protected-access
+            pd.Series(needed).to_numpy(), ScriptedDeadline([4 / geocoder.GEOCODE_QPS])) == 4
+        assert geocoder._partRows(  # pylint: disable=protected-access
+            pd.Series(needed).to_numpy(), ScriptedDeadline([1 / geocoder.GEOCODE_QPS])) == 0
+
+
+class FlakyClient:
+    """Stands in for googlemaps.Client, failing with the given errors before answering"""
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def geocode(self, address, components):
+        # pylint: disable=unused-argument
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return [{'formatted_address': address}]
+
+
+@pytest.fixture
+def flaky_manager(monkeypatch):
+    """Builds a LimitedApiManager around a FlakyClient, with a tiny backoff"""
+    monkeypatch.setenv('GOOGLE_GEOCODE_API_KEY', 'AIzaFakeKeyForTesting')
+    monkeypatch.setattr(geocoder, 'GEOCODE_BACKOFF_SECONDS', 0.001)
+
+    def buildManager(errors, deadline=None):
+        manager = geocoder.LimitedApiManager(30, deadline=deadline)
+        manager.client = FlakyClient(errors)
+        return manager
+    return buildManager
+
+
+class TestRetries:
+    """Verify API calls are retried with backoff, within the deadline"""
+
+    def test_transient_errors_are_retried(self, flaky_manager, capsys):
+        """Verify timeouts and rate limiting are retried until the call succeeds"""
+        manager = flaky_manager([
+            googlemaps.exceptions.Timeout(),
+            googlemaps.exceptions._OverQueryLimit('OVER_QUERY_LIMIT'),  # pylint: disable=W0212
+        ])
+        assert manager.get('1 Main St', 'US') == [{'formatted_address': '1 Main St'}]
+        assert manager.client.calls == 3
+        assert 'Retrying 1 Main St' in capsys.readouterr().out
+
+    def test_retries_run_out(self, flaky_manager):
+        """Verify the error is raised once the retries are spent"""
+        manager = flaky_manager([googlemaps.exceptions.TransportError()] * 10)
+        with pytest.raises(googlemaps.exceptions.TransportError):
+            manager.get('1 Main St', 'US')
+        assert manager.client.calls == geocoder.GEOCODE_RETRIES + 1
+
+    def test_other_errors_are_not_retried(self, flaky_manager):
+        """Verify an error a retry cannot fix is raised straight away"""
+        manager = flaky_manager([googlemaps.exceptions.ApiError('REQUEST_DENIED')])
+        with pytest.raises(googlemaps.exceptions.ApiError):
+            manager.get('1 Main St', 'US')
+        assert manager.client.calls == 1
+
+    def test_backoff_past_the_deadline(self, flaky_manager, monkeypatch):
+        """Verify no retry waits past the deadline"""
+        monkeypatch.setattr(geocoder, 'GEOCODE_BACKOFF_SECONDS', 60)
+        # The longest backoff jitter allows, rather than a random one that may fit
+        monkeypatch.setattr(geocoder.random, 'uniform', lambda low, high: high)
+        manager = flaky_manager(
+            [googlemaps.exceptions.Timeout()], deadline=checkpoint.Deadline(5))
+        with pytest.raises(checkpoint.DeadlineExceeded):
+            manager.get('1 Main St', 'US')
+        assert manager.client.calls == 1
+
+    def test_no_call_past_the_deadline(self, flaky_manager):
+        """Verify the API is not called once the deadline has passed"""
+        manager = flaky_manager([], deadline=checkpoint.Deadline(5))
+        manager.deadline.end -= 10
+        with pytest.raises(checkpoint.DeadlineExceeded):
+            manager.get('1 Main St', 'US')
+        assert manager.client.calls == 0
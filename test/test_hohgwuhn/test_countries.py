@@ -0,0 +1,60 @@
+# pylint: disable=W0621,R0201
+import json
+
+import pytest
+
+from hohgwuhn import countries
+
+
+@pytest.fixture
+def country_codes():
+    """A small frozen mapping, as loaded from country_codes.json"""
+    return {'denmark': 'DK', 'u.s.a.': 'US', 'korea': 'KR'}
+
+
+@pytest.fixture
+def conversions(monkeypatch):
+    """Records the batches sent to country_converter"""
+    batches = []
+
+    def fakeConvert(country_names):
+        batches.append(list(country_names))
+        return [{'Brasil': 'BR', 'Atlantis': countries.NOT_FOUND}[name] for name in country_names]
+    monkeypatch.setattr(countries, 'convertNames', fakeConvert)
+    return batches
+
+
+class TestCountryResolution:
+    """Verify names resolve from the frozen mapping, falling back to country_converter"""
+
+    def test_frozen_names_skip_converter(self, country_codes, conversions):
+        """Verify known names, in any case or spacing, never reach country_converter"""
+        codes = countries.resolveCountryCodes(['Denmark', 'U.S.A.', ' KOREA  '], country_codes)
+        assert codes == ['DK', 'US', 'KR']
+        assert conversions == []
+
+    def test_unknown_names_converted_in_one_batch(self, country_codes, conversions):
+        """Verify unknown names are converted together, once, and remembered for the run"""
+        names = ['Brasil', 'Denmark', 'Atlantis', 'Brasil']
+        assert countries.resolveCountryCodes(names, country_codes) == [
+            'BR', 'DK', countries.NOT_FOUND, 'BR']
+        assert conversions == [['Brasil', 'Atlantis']]
+
+        countries.resolveCountryCodes(['Brasil'], country_codes)
+        assert len(conversions) == 1
+
+    def test_shipped_mapping_matches_converter(self):
+        """Verify the frozen mapping agrees with country_converter for every name in it"""
+        with open(countries.COUNTRY_CODES_FILE, 'r') as codes_file:
+            frozen = json.load(codes_file)
+        assert frozen
+        assert countries.convertNames(list(frozen)) == list(frozen.values())
+
+    def test_freeze_adds_new_names(self, tmp_path, conversions):
+        """Verify freezing adds resolvable names and leaves out the unmatched ones"""
+        codes_path = tmp_path / 'country_codes.json'
+        codes_path.write_text(json.dumps({'DENMARK': 'DK'}))
+
+        countries.freezeCountryCodes(['Brasil', 'DENMARK', 'Atlantis'], str(codes_path))
+        assert json.loads(codes_path.read_text()) == {'Brasil': 'BR', 'DENMARK': 'DK'}
+        assert conversions == [['Brasil', 'Atlantis']]
@@ -0,0 +1,70 @@
+# pylint: disable=W0621,R0201
+import numpy as np
+import pytest
+
+from hohgwuhn import coverage, nearest
+
+
+@pytest.fixture
+def schools():
+    """Random school locations"""
+    rng = np.random.default_rng(5)
+    lat = np.degrees(np.arcsin(rng.uniform(-0.8, 0.95, 300)))
+    lon = rng.uniform(-180, 180, 300)
+    return lat, lon
+
+
+@pytest.fixture
+def grid(schools, tmp_path):
+    """A 5 degree grid, built a few rows at a time"""
+    return coverage.CoverageGrid.build(
+        *schools, str(tmp_path / 'coverage.npy'), resolution=5, chunk_cells=200)
+
+
+class TestCoverageGrid:
+    """Verify the grid against a brute force scan of every school"""
+
+    def test_cells_match_brute_force(self, schools, grid):
+        """Verify every cell holds the exact nearest school to its center"""
+        center_lat, center_lon = coverage.cellCenters(grid.rows, grid.columns, 0, grid.rows)
+        distances, positions = nearest.bruteForceNearest(center_lat, center_lon, *schools)
+
+        assert grid.cells.shape == (36, 72)
+        np.testing.assert_allclose(grid.cells['km'].ravel(), distances[:, 0], rtol=1e-6)
+        assert (grid.cells['school'].ravel() == positions[:, 0]).mean() > 0.99
+
+    def test_lookup_is_near_the_nearest(self, schools, grid):
+        """Verify lookups are off from the exact nearest school by at most a cell's diagonal"""
+        rng = np.random.default_rng(9)
+        lat = np.concatenate([rng.uniform(-90, 90, 1000), [90, -90, 0, 0]])
+        lon = np.concatenate([rng.uniform(-180, 180, 1000), [180, -180, 179.99, -179.99]])
+        school_ids, distances = grid.lookup(lat, lon)
+        exact, _ = nearest.bruteForceNearest(lat, lon, *schools)
+
+        center_lat, center_lon = coverage.cellCenters(grid.rows, grid.columns, 0, grid.rows)
+        row, column = grid.cellOf(lat, lon)
+        cell = row * grid.columns + column
+        to_center = nearest.haversine(lat, lon, center_lat[cell], center_lon[cell])
+        assert np.all(distances >= exact[:, 0] - 1e-6)
+        assert np.all(distances <= exact[:, 0] + 2 * to_center + 1e-6)
+        np.testing.assert_allclose(distances, nearest.haversine(
+            lat, lon, schools[0][school_ids], schools[1][school_ids]))
+
+    def test_loaded_grid_is_memory_mapped(self, schools, grid, tmp_path):
+        """Verify a saved grid maps from disk and answers the same"""
+        loaded = coverage.CoverageGrid.load(str(tmp_path / 'coverage.npy'))
+        assert isinstance(loaded.cells, np.memmap)
+        assert loaded.cells.dtype == coverage.CELL_DTYPE
+        np.testing.assert_array_equal(loaded.lookup(*schools)[0], grid.lookup(*schools)[0])
+
+    def test_from_geodata(self, tmp_path):
+        """Verify schools without coordinates are skipped, and ids come from a column"""
+        data_file = tmp_path / 'geodata.csv'
+        data_file.write_text(
+            'City,Latitude,Longitude\nCrystal Lake,42.24,-88.31\nNowhere,,\n'
+            'Phoenix,33.45,-112.07\n')
+        grid = coverage.buildCoverageFile(
+            str(data_file), str(tmp_path / 'coverage.npy'), resolution=10, id_column='City')
+        school_ids, distances = grid.lookup([42, 33, -30], [-88, -112, 100])
+        assert school_ids.tolist() == ['Crystal Lake', 'Phoenix', 'Phoenix']
+        assert distances[0] < 50
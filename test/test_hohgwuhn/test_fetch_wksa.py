@@ -1,52 +1,116 @@
 # pylint: disable=W0621,R0201
 import copy
+import dataclasses
+import functools
+import glob
+import io
+import os
+import random
+import time
+import tracemalloc
 
 import pytest
 
 from hohgwuhn import fetch_wksa as fetch
+from hohgwuhn import page_cache, phone_cache
+from hohgwuhn.school import School
 
 @pytest.fixture
 def us_wksa_school():
     """Sample US school"""
-    return {
-        'country_name': 'U.S.A', 'country_code': 'US', 'region': 'Arizona', 'city': 'Phoenix',
-        'website': '', 'address': 'NEW!!! 126 W. Desert Hills Phoenix, AZ 85086  623-337-0258',
-        'phone_numbers': [], 'instructor': 'Inst. Angela Hoikka'
-    }
+    return School(
+        country_name='U.S.A', country_code='US', region='Arizona', city='Phoenix',
+        website='', address='NEW!!! 126 W. Desert Hills Phoenix, AZ 85086  623-337-0258',
+        instructor='Inst. Angela Hoikka'
+    )
 
 
 @pytest.fixture
 def kr_wksa_school():
     """Sample Korea school"""
     # pylint: disable=line-too-long
-    return {
-        'country_name': 'KOREA', 'country_code': 'KR', 'region': 'Busan', 'city': 'Phil',
-        'website': '',
-        'address': 'No.1001 Youngdong-Plaza JwaDong Haewoondae-Gu Busan Younggeun Gye 051-701-5588 018-563-7503',
-        'phone_numbers': [], 'instructor': ''
-    }
+    return School(
+        country_name='KOREA', country_code='KR', region='Busan', city='Phil',
+        website='',
+        address='No.1001 Youngdong-Plaza JwaDong Haewoondae-Gu Busan Younggeun Gye 051-701-5588 018-563-7503',
+        instructor=''
+    )
 
 @pytest.fixture
 def kr_wksa_school_gangwon():
     """Sample Korea school, formatted as the 설 | 경기 | 강원 schools"""
     # pylint: disable=line-too-long
-    return {
-        'country_name': 'KOREA', 'country_code': 'KR', 'region': 'Seoul | Gyeonggi | Gangwon',
-        'city': 'Boknam Myuong', 'website': '',
-        'address': '1111 3Ban Youngheung8Ri Youngwol-Eup Youngwol-Gun Gangwon 033-373-2124 011-9243-7468',
-        'phone_numbers': [], 'instructor': ''
-    }
+    return School(
+        country_name='KOREA', country_code='KR', region='Seoul | Gyeonggi | Gangwon',
+        city='Boknam Myuong', website='',
+        address='1111 3Ban Youngheung8Ri Youngwol-Eup Youngwol-Gun Gangwon 033-373-2124 011-9243-7468',
+        instructor=''
+    )
 
 @pytest.fixture
 def kr_wksa_school_daegu():
     """The mislabeled Korean 대구 school"""
     # pylint: disable=line-too-long
-    return {
-        'country_name': 'KOREA', 'country_code': 'KR', 'region': 'Seoul | Gyeonggi | Gangwon',
-        'city': 'Dong-Gu Daegu', 'website': '',
-        'address': '136-156 Sinam4-Dong 053-942-4414 053-942-4415',
-        'phone_numbers': [], 'instructor': ''
-    }
+    return School(
+        country_name='KOREA', country_code='KR', region='Seoul | Gyeonggi | Gangwon',
+        city='Dong-Gu Daegu', website='',
+        address='136-156 Sinam4-Dong 053-942-4414 053-942-4415',
+        instructor=''
+    )
+
+
+def _countryPage(country_code, page_id, school_count=3):
+    """Build a minimal WKSA country page with a region header and a few schools."""
+    schools = ''.join(
+        '<div class="school"><div class="city"><a href="http://%s-%s.example">City %s</a></div>'
+        '<div class="contact">%s Main St<br />Suite %s</div>'
+        '<div class="instructor">Inst. %s</div></div>' % (
+            country_code, page_id, i, i, page_id, i)
+        for i in range(school_count)
+    )
+    return (
+        '<html><body><div class="schools_content">'
+        '<div class="region_name">region %s</div>%s'
+        '</div></body></html>' % (page_id, schools)
+    )
+
+
+class FakeResponse:
+    """Just enough of requests.Response for the scraper."""
+    def __init__(self, text, status_code=200, headers=None):
+        self.text = text
+        self.content = text.encode()
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class FakeSession:
+    """Serves generated country pages, responding in a random order when used concurrently."""
+    def __init__(self, max_delay=0.0):
+        self.max_delay = max_delay
+        self.requests = []
+
+    def _respond(self, page_key):
+        self.requests.append(page_key)
+        time.sleep(random.uniform(0, self.max_delay))
+        return FakeResponse(_countryPage(*page_key))
+
+    def get(self, url, **_):
+        return self._respond((url.rsplit('/', 1)[-1], 0))
+
+    def post(self, url, data=None, **_):
+        return self._respond((url.rsplit('/', 1)[-1], data['geo_id']))
+
+
+@pytest.fixture
+def wksa_countries():
+    """Sample of the countries returned by pullWksaCountryPages"""
+    return [
+        {'name': 'DENMARK', 'link': 'http://wksa.example/DK', 'ISO-2': 'DK'},
+        {'name': 'U.S.A.', 'link': 'http://wksa.example/US', 'ISO-2': 'US'},
+        {'name': 'BRAZIL', 'link': 'http://wksa.example/BR', 'ISO-2': 'BR'},
+        {'name': 'GERMANY', 'link': 'http://wksa.example/DE', 'ISO-2': 'DE'},
+    ]
 
 
 class TestSiteScrape:
@@ -72,6 +136,52 @@ class TestSiteScrape:
         """Sanity check for the no-op function"""
         assert fetch.skipDirectoryInfo('some', 'args') == []
 
+    def test_concurrent_fetch_matches_serial(self, monkeypatch, wksa_countries):
+        """Verify concurrent fetching returns the schools in the same order as serial fetching"""
+        monkeypatch.setattr(fetch, 'getSession', lambda: FakeSession())
+        serial_schools = fetch.pullDirectoryInfo(wksa_countries, concurrency=1)
+
+        session = FakeSession(max_delay=0.01)
+        monkeypatch.setattr(fetch, 'getSession', lambda: session)
+        concurrent_schools = fetch.pullDirectoryInfo(wksa_countries, concurrency=8)
+
+        # DK, 4 US regions, and DE.  BR is skipped
+        assert len(session.requests) == 6
+        assert len(serial_schools) == 6 * 3
+        assert concurrent_schools == serial_schools
+        assert [school.region for school in serial_schools[3:15:3]] == [
+            'Region 1', 'Region 2', 'Region 3', 'Region 4'
+        ]
+
+
+# Saved country pages, in the markup the WKSA site serves them with
+PAGE_CORPUS = sorted(glob.glob(os.path.join(os.path.dirname(__file__), 'pages', '*.html')))
+
+
+def _readPage(page_path):
+    with open(page_path, 'r') as page_file:
+        return page_file.read()
+
+
+class TestPageParsers:
+    """Verify the parser backends agree (see benchmarks/bench_parsers.py for their cost)"""
+
+    @pytest.mark.parametrize('page_path', PAGE_CORPUS, ids=os.path.basename)
+    def test_backends_agree(self, page_path):
+        """Verify both backends parse identical school records from each saved page"""
+        page_body = _readPage(page_path)
+        soup_schools = fetch.PAGE_PARSERS['soup'](page_body, 'COUNTRY', 'US')
+        assert soup_schools
+        assert fetch.PAGE_PARSERS['lxml'](page_body, 'COUNTRY', 'US') == soup_schools
+
+    def test_configured_backend_is_used(self, monkeypatch):
+        """Verify WKSA_PAGE_PARSER picks the backend"""
+        used = []
+        monkeypatch.setitem(fetch.PAGE_PARSERS, 'soup', lambda *args: used.append(args) or [])
+        monkeypatch.setattr(fetch, 'PAGE_PARSER', 'soup')
+        fetch._getSchoolsContent('<html></html>', 'DENMARK', 'DK')  # pylint: disable=W0212
+        assert used == [('<html></html>', 'DENMARK', 'DK')]
+
 
 class TestSchoolProcessing:
     """Test utility functions related to fetching data."""
@@ -81,8 +191,8 @@ class TestSchoolProcessing:
         test_school_list = [us_wksa_school]
         fetch.separatePhoneNumbers(test_school_list)
         school = test_school_list[0]
-        assert school['phone_numbers'] == '(623) 337-0258'
-        assert school['address'] == 'NEW!!! 126 W. Desert Hills Phoenix, AZ 85086'
+        assert school.phone_numbers == '(623) 337-0258'
+        assert school.address == 'NEW!!! 126 W. Desert Hills Phoenix, AZ 85086'
 
     def test_kr_phone_number_extracted(self, kr_wksa_school):
         """Verify KR phone numbers are properly extracted."""
@@ -90,8 +200,8 @@ class TestSchoolProcessing:
         test_school_list = [kr_wksa_school]
         fetch.separatePhoneNumbers(test_school_list)
         school = test_school_list[0]
-        assert school['phone_numbers'] == '051-701-5588;018-563-7503'
-        assert school['address'] == 'No.1001 Youngdong-Plaza JwaDong Haewoondae-Gu Busan Younggeun Gye'
+        assert school.phone_numbers == '051-701-5588;018-563-7503'
+        assert school.address == 'No.1001 Youngdong-Plaza JwaDong Haewoondae-Gu Busan Younggeun Gye'
 
     def test_non_kr_school_skips_hankuk(self, us_wksa_school):
         """Verify that a US school gets skipped by Korean-specific processing."""
@@ -111,10 +221,10 @@ class TestSchoolProcessing:
         fetch.handleHankuk(test_school_list)
         school = test_school_list[0]
 
-        assert school['instructor'] == 'Younggeun Gye'
-        assert school['region'] == 'Busan'
-        assert school['address'] == 'No.1001 Youngdong-Plaza JwaDong Haewoondae-Gu Busan'
-        assert school['city'] == 'Phil'
+        assert school.instructor == 'Younggeun Gye'
+        assert school.region == 'Busan'
+        assert school.address == 'No.1001 Youngdong-Plaza JwaDong Haewoondae-Gu Busan'
+        assert school.city == 'Phil'
 
     def test_gangwon_kr_school_gets_corrected(self, kr_wksa_school_gangwon):
         """Verify that a US school gets skipped by Korean-specific processing."""
@@ -125,10 +235,10 @@ class TestSchoolProcessing:
         fetch.handleHankuk(test_school_list)
         school = test_school_list[0]
 
-        assert school['instructor'] == 'Boknam Myuong'
-        assert school['region'] == 'Gangwon'
-        assert school['address'] == '1111 3Ban Youngheung8Ri Youngwol-Eup Youngwol-Gun Gangwon'
-        assert school['city'] == 'Youngwol-Gun'
+        assert school.instructor == 'Boknam Myuong'
+        assert school.region == 'Gangwon'
+        assert school.address == '1111 3Ban Youngheung8Ri Youngwol-Eup Youngwol-Gun Gangwon'
+        assert school.city == 'Youngwol-Gun'
 
     def test_daegu_kr_school_gets_corrected(self, kr_wksa_school_daegu):
         """Verify that a US school gets skipped by Korean-specific processing."""
@@ -139,7 +249,77 @@ class TestSchoolProcessing:
         fetch.handleHankuk(test_school_list)
         school = test_school_list[0]
 
-        assert school['instructor'] == ''
-        assert school['region'] == 'Daegu'
-        assert school['address'] == '136-156 Sinam4-Dong Dong-Gu Daegu'
-        assert school['city'] == 'Dong-Gu'
+        assert school.instructor == ''
+        assert school.region == 'Daegu'
+        assert school.address == '136-156 Sinam4-Dong Dong-Gu Daegu'
+        assert school.city == 'Dong-Gu'
+
+    def test_phone_cache_saved_when_the_run_fails(self, monkeypatch, buckets, us_wksa_school):
+        """Verify the extracted phone numbers are kept for the next run even if this one fails"""
+        monkeypatch.setattr(fetch, 'pullWksaCountryPages', lambda: [])
+        monkeypatch.setattr(fetch, 'pullDirectoryInfo', lambda countries: [us_wksa_school])
+        monkeypatch.setattr(fetch, 'getPageCache', lambda: page_cache.PageCache())
+        # Kept in memory and only saved to GCS by close()
+        openPhones = functools.partial(
+            phone_cache.openPhoneCache, 'gs://%s/phones.json' % fetch.gcs.GCLOUD_FETCH_BUCKET)
+        monkeypatch.setattr(phone_cache, 'openPhoneCache', openPhones)
+
+        separatePhoneNumbers = fetch.separatePhoneNumbers
+
+        def failAfterExtracting(school_list, cache):
+            separatePhoneNumbers(school_list, cache)
+            raise ValueError('Bad address')
+        monkeypatch.setattr(fetch, 'separatePhoneNumbers', failAfterExtracting)
+
+        with pytest.raises(ValueError):
+            fetch.fetchData()
+        assert list(buckets[fetch.gcs.GCLOUD_FETCH_BUCKET].objects) == ['phones.json']
+        assert openPhones().get(
+            'NEW!!! 126 W. Desert Hills Phoenix, AZ 85086  623-337-0258', 'US') is not None
+
+
+class CountingBlobWriter(io.StringIO):
+    """Stands in for a streaming blob writer, keeping only the byte count"""
+    def __init__(self):
+        super().__init__()
+        self.written = 0
+
+    def write(self, s):
+        self.written += len(s)
+        return len(s)
+
+
+class FakeBucket:
+    """Hands out a single streaming blob writer"""
+    def __init__(self):
+        self.writer = CountingBlobWriter()
+
+    def blob(self, _name):
+        return self
+
+    def open(self, mode, **_):
+        assert mode == 'w'
+        return self.writer
+
+
+class TestStreamingExport:
+    """Verify the CSV export can stream schools straight to GCS"""
+
+    def test_memory_ceiling_for_100k_schools(self, monkeypatch, us_wksa_school):
+        """Verify exporting a generator of 100k schools does not buffer the file"""
+        bucket = FakeBucket()
+        monkeypatch.setattr(fetch.gcs, 'getFetchBucket', lambda: bucket)
+        us_wksa_school.phone_numbers = '(623) 337-0258'
+
+        def schools():
+            for i in range(100000):
+                yield dataclasses.replace(us_wksa_school, city='City %s' % i)
+
+        tracemalloc.start()
+        fetch.exportCSV(schools(), streaming=True)
+        _, peak_bytes = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        # ~10 MB of CSV is written, without ever holding more than a few rows
+        assert bucket.writer.written > 9 * 1024 * 1024
+        assert peak_bytes < 1024 * 1024
@@ -0,0 +1,133 @@
+# pylint: disable=W0621,R0201
+import io
+
+import pandas as pd
+import pytest
+
+from hohgwuhn import gazetteer as gz
+from hohgwuhn import geocoder_googs as geocoder
+
+
+def _geonamesRow(geoname_id, name, ascii_name, lat, lon, country, admin1, population):
+    row = [''] * 19
+    row[0], row[gz.GEONAMES_NAME], row[gz.GEONAMES_ASCII_NAME] = str(geoname_id), name, ascii_name
+    row[gz.GEONAMES_LATITUDE], row[gz.GEONAMES_LONGITUDE] = str(lat), str(lon)
+    row[gz.GEONAMES_COUNTRY], row[gz.GEONAMES_ADMIN1] = country, admin1
+    row[gz.GEONAMES_POPULATION] = str(population)
+    return '\t'.join(row)
+
+
+CITIES_TXT = '\n'.join([
+    _geonamesRow(1, 'Crystal Lake', 'Crystal Lake', 42.24113, -88.31619, 'US', 'IL', 40743),
+    _geonamesRow(2, 'Phoenix', 'Phoenix', 33.44838, -112.07404, 'US', 'AZ', 1680992),
+    _geonamesRow(3, 'Springfield', 'Springfield', 39.80172, -89.64371, 'US', 'IL', 114394),
+    _geonamesRow(4, 'Springfield', 'Springfield', 37.21533, -93.29824, 'US', 'MO', 169176),
+    _geonamesRow(5, 'Ikast', 'Ikast', 56.13883, 9.15768, 'DK', '19', 15226),
+    _geonamesRow(6, 'São Paulo', 'Sao Paulo', -23.5475, -46.63611, 'BR', '27', 10021295),
+])
+
+ADMIN1_TXT = '\n'.join([
+    'US.IL\tIllinois\tIllinois\t4896861',
+    'US.AZ\tArizona\tArizona\t5551235',
+    'US.MO\tMissouri\tMissouri\t4398678',
+    'DK.19\tMidtjylland\tMidtjylland\t6418580',
+    'BR.27\tSão Paulo\tSao Paulo\t3448433',
+])
+
+
+@pytest.fixture
+def gazetteer():
+    """A handful of GeoNames cities, with their regions' names"""
+    return gz.Gazetteer.fromGeoNames(io.StringIO(CITIES_TXT), io.StringIO(ADMIN1_TXT))
+
+
+class TestLookup:
+    """Verify cities are found by country, region and city names"""
+
+    def test_exact_by_region_name_and_code(self, gazetteer):
+        """Verify regions match by their name as well as their GeoNames code"""
+        assert gazetteer.names[gazetteer.lookup('US', 'Illinois', 'Crystal Lake')] == 'Crystal Lake'
+        assert gazetteer.lookup('US', 'il', 'crystal lake') == gazetteer.lookup(
+            'US', 'Illinois', 'Crystal Lake')
+
+    def test_case_accents_and_punctuation(self, gazetteer):
+        """Verify names are compared normalized"""
+        assert gazetteer.names[gazetteer.lookup('br', 'SAO PAULO', 'sao-paulo')] == 'São Paulo'
+
+    def test_unknown_region_falls_back_to_country(self, gazetteer):
+        """Verify a region that is not known still finds the city in the country"""
+        assert gazetteer.names[gazetteer.lookup('DK', 'Ikast', 'Ikast')] == 'Ikast'
+
+    def test_region_picks_between_shared_names(self, gazetteer):
+        """Verify the region decides, and the most populous city wins without one"""
+        illinois = gazetteer.lookup('US', 'Illinois', 'Springfield')
+        assert gazetteer.lat[illinois] == pytest.approx(39.80172)
+        assert gazetteer.lat[gazetteer.lookup('US', '', 'Springfield')] == pytest.approx(37.21533)
+
+    def test_other_region_only_for_unique_names(self, gazetteer):
+        """Verify a shared city name outside the region is left to Google, a unique one is not"""
+        assert gazetteer.lookup('US', 'Ohio', 'Springfield') is None
+        assert gazetteer.lookup('US', 'Ohio', 'Springfeld') is None
+        geodata = gazetteer.geocode('US', 'Ohio', 'Crystal Lake')
+        # Addressed by where the city actually is
+        assert geodata['formatted_address'] == 'Crystal Lake, Illinois, US'
+
+    def test_regions_by_code_only(self):
+        """Verify a gazetteer without admin1 names does not guess at region names"""
+        codes_only = gz.Gazetteer.fromGeoNames(io.StringIO(CITIES_TXT))
+        assert codes_only.lookup('US', 'Illinois', 'Springfield') is None
+        assert codes_only.lat[codes_only.lookup('US', 'IL', 'Springfield')] == pytest.approx(
+            39.80172)
+        geodata = codes_only.geocode('US', 'Illinois', 'Crystal Lake')
+        assert geodata['formatted_address'] == 'Crystal Lake, IL, US'
+
+    def test_fuzzy_city(self, gazetteer):
+        """Verify a misspelt city is matched within its region"""
+        geodata = gazetteer.geocode('US', 'Illinois', 'Crystal Lke')
+        assert geodata['formatted_address'] == 'Crystal Lake, Illinois, US'
+        assert geodata['geometry']['location'] == {
+            'lat': pytest.approx(42.24113), 'lng': pytest.approx(-88.31619)}
+        assert geodata['geometry']['location_type'] == 'APPROXIMATE'
+
+    def test_misses(self, gazetteer):
+        """Verify unknown cities and countries are not guessed"""
+        assert gazetteer.lookup('US', 'Illinois', 'Chicago') is None
+        assert gazetteer.lookup('JP', 'Okinawa', 'Crystal Lake') is None
+        assert gazetteer.geocode('US', 'Illinois', '') is None
+
+    def test_save_load(self, gazetteer, tmp_path):
+        """Verify a saved gazetteer loads with the same answers"""
+        gazetteer.save(str(tmp_path / 'gazetteer.npz'))
+        loaded = gz.openGazetteer(str(tmp_path / 'gazetteer.npz'))
+        assert len(loaded) == len(gazetteer) == 6
+        assert loaded.geocode('US', 'Illinois', 'Crystal Lke') == gazetteer.geocode(
+            'US', 'Illinois', 'Crystal Lke')
+
+    def test_unconfigured(self):
+        """Verify there is no gazetteer without a location"""
+        assert gz.openGazetteer('') is None
+
+
+class TestGeocodeSchools:
+    """Verify the gazetteer answers City/Region fallbacks before the API"""
+
+    def test_only_misses_reach_the_api(self, gazetteer, fake_api_manager):
+        """Verify the API only sees the addresses, and the cities the gazetteer lacks"""
+        school_df = pd.DataFrame({
+            'Country Code': ['US', 'US', 'JP', 'US'],
+            'City': ['Crystal Lke', 'Phoenix', 'Kadena AFB', 'Phoenix'],
+            'Region': ['Illinois', 'Arizona', 'Kadena Afb', 'Arizona'],
+            'Address': ['1 Nowhere Rd', '2 Nowhere Rd', 'Bldg. 109', '100 Found Ave'],
+        })
+        geocode_api = fake_api_manager({'Kadena AFB, Kadena Afb': 4.0, '100 Found Ave': 5.0})
+
+        assert geocoder.geocodeSchools(school_df, geocode_api, gazetteer=gazetteer) == 4
+        assert sorted(geocode_api.calls) == sorted([
+            ('1 Nowhere Rd', 'US'), ('2 Nowhere Rd', 'US'), ('Bldg. 109', 'JP'),
+            ('100 Found Ave', 'US'), ('Kadena AFB, Kadena Afb', 'JP'),
+        ])
+        assert school_df['Latitude'].tolist() == [
+            pytest.approx(42.24113), pytest.approx(33.44838), 4.0, 5.0]
+        assert school_df['Google Address'].tolist() == [
+            'Crystal Lake, Illinois, US', 'Phoenix, Arizona, US', 'Found Kadena AFB, Kadena Afb',
+            'Found 100 Found Ave']
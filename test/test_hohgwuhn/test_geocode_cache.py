@@ -0,0 +1,155 @@
+# pylint: disable=W0621,R0201
+from concurrent.futures import ProcessPoolExecutor
+import time
+
+import pytest
+
+from hohgwuhn import geocode_cache
+from hohgwuhn import geocoder_googs as geocoder
+
+
+GEOCODE_RESULT = {
+    'address_components': [],
+    'formatted_address': 'Bøgildvej 2, 7430 Ikast, Denmark',
+    'geometry': {
+        'location': {'lat': 56.1367943, 'lng': 9.1273999},
+        'location_type': 'ROOFTOP',
+        'viewport': {},
+    },
+    'place_id': 'ChIJ',
+    'types': ['street_address'],
+}
+
+
+class FakeGeocodeClient:
+    """Stands in for googlemaps.Client, counting calls"""
+    def __init__(self):
+        self.calls = []
+
+    def geocode(self, address, components):
+        self.calls.append((address, components['country']))
+        return [GEOCODE_RESULT]
+
+
+class FakeBlob:
+    """In-memory stand-in for a GCS blob"""
+    def __init__(self):
+        self.data = None
+
+    def exists(self):
+        return self.data is not None
+
+    def download_as_string(self):
+        return self.data
+
+    def upload_from_string(self, data, content_type=None):
+        # pylint: disable=unused-argument
+        self.data = data.encode()
+
+
+@pytest.fixture
+def api_manager(monkeypatch):
+    """Builds a LimitedApiManager around a fake client and the given cache"""
+    monkeypatch.setenv('GOOGLE_GEOCODE_API_KEY', 'AIzaFakeKeyForTesting')
+
+    def buildManager(cache):
+        manager = geocoder.LimitedApiManager(30, cache=cache)
+        manager.client = FakeGeocodeClient()
+        return manager
+    return buildManager
+
+
+@pytest.fixture(params=['sqlite', 'gcs'])
+def open_cache(request, tmp_path):
+    """Opens the same persistent cache once per run, for each backend"""
+    blob = FakeBlob()
+
+    def openCache(**kwargs):
+        if request.param == 'sqlite':
+            backend = geocode_cache.SqliteCacheBackend(str(tmp_path / 'geocode.sqlite'))
+        else:
+            backend = geocode_cache.GCSCacheBackend(blob)
+        return geocode_cache.GeocodeCache(backend, **kwargs)
+    return openCache
+
+
+class TestGeocodeCache:
+    """Verify repeat lookups are answered from the cache across runs"""
+
+    def test_second_run_makes_no_api_calls(self, api_manager, open_cache):
+        """Verify re-geocoding the same addresses hits only the cache"""
+        addresses = [('Bøgildvej 2 7430 Ikast', 'DK'), ('Ikast, Ikast', 'DK')]
+        first_run = api_manager(open_cache())
+        first_results = [first_run.get(*address) for address in addresses]
+        first_run.close()
+        assert first_run.api_calls == 2
+
+        second_run = api_manager(open_cache())
+        second_results = [second_run.get(*address) for address in addresses]
+        second_run.close()
+        assert second_run.api_calls == 0
+        assert second_run.cache.report() == 1.0
+
+        # Only the fields needed downstream are kept
+        trimmed_result = geocode_cache.trimResults([GEOCODE_RESULT])
+        assert first_results == [[GEOCODE_RESULT]] * 2
+        assert second_results == [trimmed_result] * 2
+        assert 'viewport' not in trimmed_result[0]['geometry']
+        assert geocoder._handleResponse(second_results[0]) == (  # pylint: disable=W0212
+            trimmed_result[0])
+
+    def test_keys_are_normalized(self):
+        """Verify whitespace, case and country code spacing do not split entries"""
+        assert geocode_cache.cacheKey('  Bøgildvej  2\n7430 IKAST ', 'dk ') == (
+            geocode_cache.cacheKey('Bøgildvej 2 7430 Ikast', 'DK'))
+
+    def test_expired_entries_are_misses(self, api_manager, open_cache):
+        """Verify entries older than the TTL are looked up again"""
+        first_run = api_manager(open_cache())
+        first_run.get('Ikast, Ikast', 'DK')
+        first_run.close()
+
+        second_run = api_manager(open_cache(ttl=-1))
+        second_run.get('Ikast, Ikast', 'DK')
+        assert second_run.api_calls == 1
+
+    def test_least_recently_used_are_evicted(self, open_cache):
+        """Verify only the most recently used entries survive eviction"""
+        cache = open_cache(max_entries=2)
+        for address in ['oldest', 'middle', 'newest']:
+            cache.put(address, 'DK', [GEOCODE_RESULT])
+            time.sleep(0.01)
+        assert cache.get('oldest', 'DK')
+        cache.close()
+
+        cache = open_cache(max_entries=2)
+        assert cache.get('oldest', 'DK')
+        assert cache.get('newest', 'DK')
+        assert cache.get('middle', 'DK') is None
+
+
+def _fillCache(db_path, worker, entries):
+    """Process pool entry point, caching entries slowly enough to overlap the other workers"""
+    cache = geocode_cache.GeocodeCache(
+        geocode_cache.SqliteCacheBackend(db_path, timeout=1.5))
+    for index in range(entries):
+        cache.put('%s Main St' % index, 'W%s' % worker, [GEOCODE_RESULT])
+        assert cache.get('%s Main St' % index, 'W%s' % worker)
+        time.sleep(0.01)
+    cache.close()
+    return worker
+
+
+class TestSharedSqlite:
+    """Verify processes can share a SQLite cache file"""
+
+    def test_concurrent_processes(self, tmp_path):
+        """Verify two runs writing at once, each longer than the lock timeout, do not lock out"""
+        db_path = str(tmp_path / 'geocode.sqlite')
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            assert list(executor.map(_fillCache, [db_path] * 2, [0, 1], [250] * 2)) == [0, 1]
+
+        cache = geocode_cache.GeocodeCache(geocode_cache.SqliteCacheBackend(db_path))
+        assert all(
+            cache.get('%s Main St' % index, 'W%s' % worker)
+            for worker in [0, 1] for index in range(250))
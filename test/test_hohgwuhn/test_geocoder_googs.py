@@ -1,6 +1,12 @@
 # pylint: disable=W0621,R0201
+import csv
+import tracemalloc
+
+import pandas as pd
 import pytest
 
+from hohgwuhn import checkpoint
+from hohgwuhn import fetch_wksa as fetch
 from hohgwuhn import geocoder_googs as geocoder
 
 @pytest.fixture
@@ -107,3 +113,169 @@ class TestHandleMapsResponse:
 
         assert test_results
         assert test_results == geocenter_wksa_school[0]
+
+
+@pytest.fixture
+def scraped_df():
+    """A new scrape, with one school unchanged, one moved, one new, and one never found"""
+    return pd.DataFrame({
+        'Country': ['DENMARK', 'U.S.A.', 'U.S.A.', 'JAPAN'],
+        'Country Code': ['DK', 'US', 'US', 'JP'],
+        'City': ['Ikast', 'Crystal Lake', 'Phoenix', 'Kadena AFB'],
+        'Region': ['Ikast', 'Illinois', 'Arizona', 'Kadena Afb'],
+        'Address': [
+            'Bøgildvej 2 7430 Ikast Denmark',
+            '8901 US Hwy 14 Crystal Lake, IL 60012',
+            '126 W. Desert Hills Phoenix, AZ 85086',
+            'Bldg. 109 Kadena Air Base',
+        ],
+        'Instructor': ['Instr. Phil Brooks', 'PKJN Tim Seitz', 'Inst. Angela Hoikka', ''],
+    })
+
+
+@pytest.fixture
+def prior_geodata_df():
+    """The prior geodata, as read back from the previous geodata CSV"""
+    return pd.DataFrame({
+        'Country': ['DENMARK', 'U.S.A.', 'JAPAN'],
+        'Country Code': ['DK', 'US', 'JP'],
+        'City': ['Ikast', 'Crystal Lake', 'Kadena AFB'],
+        'Region': ['Ikast', 'Illinois', 'Kadena Afb'],
+        'Address': [
+            'Bøgildvej 2 7430 Ikast Denmark',
+            '8900 US Hwy 14 Crystal Lake, IL 60012',
+            'Bldg. 109 Kadena Air Base',
+        ],
+        'Instructor': ['Old Instructor', 'PKJN Tim Seitz', ''],
+        'Latitude': ['56.1367943', '42.26001979999999', ''],
+        'Longitude': ['9.1273999', '-88.3685333', ''],
+        'Geocode Type': ['ROOFTOP', 'ROOFTOP', ''],
+        'Google Address': ['Bøgildvej 2, 7430 Ikast, Denmark', '8900 US-14, Crystal Lake', ''],
+    })
+
+
+class TestIncrementalGeocoding:
+    """Verifies reuse of the prior geodata for unchanged schools"""
+
+    def test_only_changed_schools_need_geocoding(self, scraped_df, prior_geodata_df):
+        """Verify unchanged schools reuse results and the rest are left to geocode"""
+        needs_geocode = geocoder.applyPriorGeoData(scraped_df, prior_geodata_df)
+
+        assert needs_geocode.tolist() == [False, True, True, True]
+        assert scraped_df.loc[0, 'Latitude'] == '56.1367943'
+        assert scraped_df.loc[0, 'Google Address'] == 'Bøgildvej 2, 7430 Ikast, Denmark'
+        # The instructor is not part of the address, and is kept from the new scrape
+        assert scraped_df.loc[0, 'Instructor'] == 'Instr. Phil Brooks'
+        assert scraped_df.loc[1:, 'Latitude'].tolist() == ['', '', '']
+
+    def test_prior_without_country_code(self, scraped_df, prior_geodata_df):
+        """Verify older snapshots without a Country Code column are still reused"""
+        prior_geodata_df = prior_geodata_df.drop(columns=['Country', 'Country Code'])
+        needs_geocode = geocoder.applyPriorGeoData(scraped_df, prior_geodata_df)
+        assert needs_geocode.tolist() == [False, True, True, True]
+
+    def test_no_prior_geocodes_everything(self, scraped_df):
+        """Verify everything is geocoded when there is no prior geodata"""
+        needs_geocode = geocoder.applyPriorGeoData(scraped_df, None)
+        assert needs_geocode.all()
+        assert scraped_df['Geocode Type'].tolist() == [''] * 4
+
+
+class TestGeocodeSchools:
+    """Verifies the batched geocoding of a scrape"""
+
+    def test_results_stay_aligned_when_schools_are_skipped(self, scraped_df, fake_api_manager):
+        """Verify an unfound school does not shift the results of the schools after it"""
+        geocode_api = fake_api_manager({
+            '8901 US Hwy 14 Crystal Lake, IL 60012': 2.0,
+            'Bldg. 109 Kadena Air Base': 4.0,
+        })
+        assert geocoder.geocodeSchools(scraped_df, geocode_api, workers=4) == 2
+
+        assert scraped_df['Latitude'].tolist() == ['', 2.0, '', 4.0]
+        assert scraped_df['Google Address'].tolist() == [
+            '', 'Found 8901 US Hwy 14 Crystal Lake, IL 60012', '', 'Found Bldg. 109 Kadena Air Base'
+        ]
+
+    def test_duplicate_fallbacks_are_coalesced(self, scraped_df, fake_api_manager):
+        """Verify identical City/Region fallbacks are only looked up once"""
+        scraped_df['City'] = 'Phoenix'
+        scraped_df['Region'] = 'Arizona'
+        scraped_df['Country Code'] = 'US'
+        geocode_api = fake_api_manager({'Phoenix, Arizona': 3.0})
+
+        assert geocoder.geocodeSchools(scraped_df, geocode_api, workers=4) == 4
+        assert len(geocode_api.calls) == 4 + 1
+        assert scraped_df['Latitude'].tolist() == [3.0] * 4
+
+    def test_only_flagged_rows_are_geocoded(self, scraped_df, prior_geodata_df, fake_api_manager):
+        """Verify reused rows are left untouched"""
+        needs_geocode = geocoder.applyPriorGeoData(scraped_df, prior_geodata_df)
+        geocode_api = fake_api_manager({'126 W. Desert Hills Phoenix, AZ 85086': 5.0})
+
+        assert geocoder.geocodeSchools(scraped_df, geocode_api, needs_geocode) == 1
+        assert ('Bøgildvej 2 7430 Ikast Denmark', 'DK') not in geocode_api.calls
+        assert scraped_df['Latitude'].tolist() == ['56.1367943', '', 5.0, '']
+
+
+class AlwaysFoundApiManager:
+    """Stands in for LimitedApiManager, finding every address"""
+    def get(self, address, country_code):
+        # pylint: disable=unused-argument
+        return [{
+            'formatted_address': address,
+            'geometry': {'location': {'lat': 1.5, 'lng': -1.5}, 'location_type': 'ROOFTOP'},
+        }]
+
+    def close(self):
+        pass
+
+
+def _writeSyntheticScrape(path, school_count):
+    with open(path, 'w', newline='') as file_out:
+        writer = csv.writer(file_out, lineterminator='\n')
+        writer.writerow([
+            'Country', 'Country Code', 'City', 'Region', 'Address', 'Website', 'Phone #s',
+            'Instructor'
+        ])
+        for i in range(school_count):
+            writer.writerow([
+                'U.S.A.', 'US', 'City %s' % (i % 997), 'Region %s' % (i % 50),
+                '%s Main St Suite %s' % (i, i % 7), 'http://school%s.example' % i,
+                '(555) 555-%04d' % (i % 10000), 'Inst. Instructor %s' % i
+            ])
+
+
+class TestStreamingGeocode:
+    """Verifies streaming geocoding keeps memory flat for large files"""
+
+    def test_memory_ceiling_for_100k_schools(self, tmp_path, monkeypatch):
+        """Verify peak memory stays under a fixed ceiling while geocoding 100k schools, from the
+        scrape through the checkpoint parts to the geodata file"""
+        school_count = 100000
+        _writeSyntheticScrape(str(tmp_path / 'school_data.csv'), school_count)
+        monkeypatch.setattr(fetch, 'SCHOOL_EXPORT_FILE', str(tmp_path / 'school_data.csv'))
+        monkeypatch.setattr(geocoder, 'SCHOOL_GEODATA_FILE', str(tmp_path / 'school_geodata.csv'))
+        monkeypatch.setattr(checkpoint, 'LOCAL_CHECKPOINT_DIR', str(tmp_path / 'checkpoint'))
+        monkeypatch.setattr(
+            geocoder, 'LimitedApiManager', lambda *args, **kwargs: AlwaysFoundApiManager())
+        monkeypatch.setattr(geocoder, 'openGeocodeCache', lambda: None)
+        monkeypatch.setattr(geocoder, 'openGazetteer', lambda: None)
+
+        tracemalloc.start()
+        finished = geocoder.loadSchoolData(streaming=True)
+        _, peak_bytes = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        assert finished
+        # The parts are cleared once the geodata file is written
+        assert not (tmp_path / 'checkpoint').exists()
+        # The scrape is ~11 MB of text, and reading it whole into a DataFrame peaks at ~32 MB
+        assert peak_bytes < 12 * 1024 * 1024
+
+        with open(geocoder.SCHOOL_GEODATA_FILE, 'r') as geodata_file:
+            geodata = csv.DictReader(geodata_file)
+            first_school = next(geodata)
+            assert first_school['Latitude'] == '1.5'
+            assert first_school['Google Address'] == '0 Main St Suite 0'
+            assert sum(1 for _ in geodata) == school_count - 1
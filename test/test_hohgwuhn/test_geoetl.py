@@ -0,0 +1,280 @@
+# pylint: disable=W0621,R0201
+import io
+import threading
+
+import numpy as np
+import pytest
+
+from hohgwuhn import aggregates, geoetl
+from hohgwuhn.nearest import toUnitVectors
+
+
+class FakeSnapshot:
+    """Stands in for a Firestore DocumentSnapshot"""
+    def __init__(self, data, document_id=None):
+        self.id = document_id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data) if self.exists else None
+
+
+class FakeDocument:
+    """Stands in for a Firestore DocumentReference, backed by the client's dict"""
+    def __init__(self, client, path):
+        self.client = client
+        self.path = path
+
+    def collection(self, name):
+        return FakeCollection(self.client, '%s/%s' % (self.path, name))
+
+    def get(self):
+        return FakeSnapshot(self.client.documents.get(self.path))
+
+    def set(self, data):
+        with self.client.lock:
+            self.client.documents[self.path] = dict(data)
+
+    def delete(self):
+        with self.client.lock:
+            self.client.documents.pop(self.path, None)
+
+
+class FakeCollection:
+    """Stands in for a Firestore CollectionReference"""
+    def __init__(self, client, path):
+        self.client = client
+        self.path = path
+
+    def document(self, document_id):
+        return FakeDocument(self.client, '%s/%s' % (self.path, document_id))
+
+    def select(self, field_paths):
+        return FakeQuery(self, field_paths)
+
+
+class FakeQuery:
+    """Stands in for a projection Query over a whole collection"""
+    def __init__(self, collection, field_paths):
+        self.collection = collection
+        self.field_paths = field_paths
+
+    def stream(self):
+        prefix = self.collection.path + '/'
+        for path, data in list(self.collection.client.documents.items()):
+            if path.startswith(prefix) and '/' not in path[len(prefix):]:
+                yield FakeSnapshot(
+                    {field: data[field] for field in self.field_paths if field in data},
+                    path[len(prefix):])
+
+
+class FakeBatch:
+    """Stands in for a Firestore WriteBatch, enforcing the 500 write limit"""
+    def __init__(self, client):
+        self.client = client
+        self.writes = []
+
+    def set(self, document_ref, data):
+        self.writes.append((document_ref, data))
+
+    def delete(self, document_ref):
+        self.writes.append((document_ref, None))
+
+    def commit(self):
+        if len(self.writes) > 500:
+            raise ValueError('maximum 500 writes allowed per request')
+        for document_ref, data in self.writes:
+            if data is None:
+                document_ref.delete()
+            else:
+                document_ref.set(data)
+        with self.client.lock:
+            self.client.commits += 1
+
+
+class FakeFirestore:
+    """In-memory stand-in for firestore.Client"""
+    def __init__(self):
+        self.documents = {}
+        self.commits = 0
+        self.lock = threading.Lock()
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def batch(self):
+        return FakeBatch(self)
+
+
+def _geodataFile(school_count, changed_city=None, extra_rows=()):
+    rows = ['Country,Country Code,City,Region,Address,Website,Phone #s,Instructor,'
+            'Latitude,Longitude,Geocode Type,Google Address']
+    for i in range(school_count):
+        instructor = 'Inst. New' if i == changed_city else 'Inst. %s' % i
+        rows.append('U.S.A.,US,City%s,Region,%s Main St,,,%s,1.0,2.0,ROOFTOP,' % (
+            i, i, instructor))
+    rows.extend(extra_rows)
+    return io.StringIO('\n'.join(rows) + '\n', newline='')
+
+
+def _schoolDocuments(client):
+    prefix = 'scrape_record/WORLD-2019-01-01/school_location/'
+    return {
+        path[len(prefix):]: data for path, data in client.documents.items()
+        if path.startswith(prefix)
+    }
+
+
+@pytest.fixture
+def firestore_client(monkeypatch):
+    """Swap Cloud Firestore for the in-memory fake"""
+    client = FakeFirestore()
+    monkeypatch.setattr(geoetl, 'getFirestore', lambda: client)
+    return client
+
+
+class TestLoadCountryFile:
+    """Verify schools are written in chunks and only when changed"""
+
+    def _load(self, monkeypatch, geodata_file):
+        monkeypatch.setattr(geoetl, '_loadGCSDataFile', lambda _: geodata_file)
+        return geoetl.loadCountryFile('WORLD/2019-01-01')
+
+    def test_large_files_are_chunked(self, monkeypatch, firestore_client):
+        """Verify a file over the batch limit is split into multiple commits"""
+        assert self._load(monkeypatch, _geodataFile(1200)) == (1200, 0)
+        # Three batches of schools, then one of aggregates
+        assert firestore_client.commits == 4
+
+        schools = _schoolDocuments(firestore_client)
+        assert len(schools) == 1200
+        assert all(len(school['content_hash']) == 40 for school in schools.values())
+        record = firestore_client.documents['scrape_record/WORLD-2019-01-01']
+        assert record['country'] == 'WORLD'
+        # Hashes live with the schools, so the record stays small however many there are
+        assert 'school_hashes' not in record
+
+    def test_unchanged_schools_are_skipped(self, monkeypatch, firestore_client):
+        """Verify reloading a file only rewrites the schools that changed"""
+        self._load(monkeypatch, _geodataFile(10))
+        assert self._load(monkeypatch, _geodataFile(10, changed_city=3)) == (1, 9)
+
+        school, = [
+            school for school_id, school in _schoolDocuments(firestore_client).items()
+            if school_id.startswith('WORLD-Region-City3-')]
+        assert school['instructor'] == 'Inst. New'
+        assert self._load(monkeypatch, _geodataFile(10, changed_city=3)) == (0, 10)
+
+    def test_schools_sharing_a_city_keep_their_own_documents(self, monkeypatch, firestore_client):
+        """Verify schools of one city, even at one address, neither collide nor get skipped"""
+        shared_city = [
+            'U.S.A.,US,Obera,Misiones,1 Main St,,,Inst. A1,1.0,2.0,ROOFTOP,',
+            'U.S.A.,US,Obera,Misiones,2 Main St,,,Inst. A2,1.0,2.0,ROOFTOP,',
+            'U.S.A.,US,Obera,Misiones,2  MAIN st,,,Inst. A3,1.0,2.0,ROOFTOP,',
+        ]
+        assert self._load(monkeypatch, _geodataFile(2, extra_rows=shared_city)) == (5, 0)
+        assert self._load(monkeypatch, _geodataFile(2, extra_rows=shared_city)) == (0, 5)
+
+        obera = {
+            school_id: school['instructor']
+            for school_id, school in _schoolDocuments(firestore_client).items()
+            if school['city'] == 'Obera'
+        }
+        assert sorted(obera.values()) == ['Inst. A1', 'Inst. A2', 'Inst. A3']
+        # The same address differs only by its occurrence
+        second, third = sorted(
+            school_id for school_id, instructor in obera.items() if instructor != 'Inst. A1')
+        assert third == second + '-2'
+
+    def test_duplicate_ids_are_refused(self, firestore_client):
+        """Verify a school id given twice fails before either write is sent"""
+        schools = [('WORLD-Same', {'city': 'A'}), ('WORLD-Same', {'city': 'B'})]
+        with pytest.raises(ValueError):
+            geoetl.saveScrapeRecord(firestore_client, 'WORLD-2019-01-01', {}, schools)
+        assert firestore_client.commits == 0
+
+    def test_removed_schools_are_deleted(self, monkeypatch, firestore_client):
+        """Verify schools no longer in the file are removed from the record"""
+        self._load(monkeypatch, _geodataFile(10))
+        assert self._load(monkeypatch, _geodataFile(8)) == (0, 8)
+        assert len(_schoolDocuments(firestore_client)) == 8
+
+
+AGGREGATE_ROWS = [
+    ('U.S.A.', 'US', 'Crystal Lake', 'Illinois', '42.24', '-88.31'),
+    ('U.S.A.', 'US', 'Chicago', 'Illinois', '41.88', '-87.63'),
+    ('U.S.A.', 'US', 'Phoenix', 'Arizona', '33.45', '-112.07'),
+    ('U.S.A.', 'US', 'Nowhere', 'Arizona', '', ''),
+    ('FIJI', 'FJ', 'Suva', 'Central', '-18.14', '178.44'),
+    ('FIJI', 'FJ', 'Taveuni', 'Northern', '-16.85', '-179.97'),
+]
+
+
+def _aggregateFile():
+    rows = ['Country,Country Code,City,Region,Address,Website,Phone #s,Instructor,'
+            'Latitude,Longitude,Geocode Type,Google Address']
+    rows.extend(
+        '%s,%s,%s,%s,1 Main St,,,,%s,%s,ROOFTOP,' % row for row in AGGREGATE_ROWS)
+    return io.StringIO('\n'.join(rows) + '\n', newline='')
+
+
+class TestAggregates:
+    """Verify the read models written alongside the schools"""
+
+    def test_documents(self, monkeypatch, firestore_client):
+        """Verify counts, centroids and boxes per country and region, listed on the record"""
+        monkeypatch.setattr(geoetl, '_loadGCSDataFile', lambda _: _aggregateFile())
+        geoetl.loadCountryFile('WORLD/2019-01-01')
+        prefix = 'scrape_record/WORLD-2019-01-01/aggregate/'
+        record = firestore_client.documents['scrape_record/WORLD-2019-01-01']
+        assert record['aggregates'] == ['countries', 'points-0000', 'regions-FJ', 'regions-US']
+
+        countries = firestore_client.documents[prefix + 'countries']
+        assert (countries['schools'], countries['located']) == (6, 5)
+        us, fiji = countries['countries'][1], countries['countries'][0]
+        assert (us['country_code'], us['schools'], us['located']) == ('US', 4, 3)
+        assert us['bbox'] == [33.45, -112.07, 42.24, -87.63]
+        # Fiji straddles the antimeridian, so its centroid is not near longitude 0
+        assert abs(fiji['centroid']['lon']) > 179
+
+        regions = firestore_client.documents[prefix + 'regions-US']['regions']
+        assert [(region['region'], region['schools'], region['located']) for region in regions] == [
+            ('Arizona', 2, 1), ('Illinois', 2, 2)]
+        assert regions[0]['centroid'] == {'lat': 33.45, 'lon': -112.07}
+
+        ids, lat, lon = aggregates.unpackPoints(firestore_client.documents[prefix + 'points-0000'])
+        assert [school_id.rsplit('-', 1)[0] for school_id in ids] == [
+            'WORLD-Illinois-CrystalLake', 'WORLD-Illinois-Chicago', 'WORLD-Arizona-Phoenix',
+            'WORLD-Central-Suva', 'WORLD-Northern-Taveuni']
+        assert set(ids) <= set(_schoolDocuments(firestore_client))
+        assert np.allclose(lat, [42.24, 41.88, 33.45, -18.14, -16.85])
+        assert np.allclose(lon, [-88.31, -87.63, -112.07, 178.44, -179.97])
+
+    def test_matches_per_group_loop(self):
+        """Verify the vectorized stats against summing each region on its own"""
+        rng = np.random.default_rng(7)
+        count = 2000
+        codes = rng.choice(['US', 'DK', 'KR', ''], count).tolist()
+        regions = rng.choice(['North', 'South', 'East'], count).tolist()
+        lat = rng.uniform(-60, 60, count)
+        lon = rng.uniform(-170, 170, count)
+        lats = ['' if i % 13 == 0 else repr(value) for i, value in enumerate(lat.tolist())]
+        documents = aggregates.readModels(
+            [str(i) for i in range(count)], codes, regions, lats, lon.astype(str).tolist(),
+            points_per_document=500)
+
+        assert sorted(name for name in documents if name.startswith('points-')) == [
+            'points-%04d' % index for index in range(4)]
+        for code in ['US', 'DK', 'KR', '']:
+            for entry in documents['regions-%s' % (code or 'XX')]['regions']:
+                members = [
+                    i for i in range(count) if codes[i] == code and regions[i] == entry['region']]
+                located = [i for i in members if lats[i]]
+                assert (entry['schools'], entry['located']) == (len(members), len(located))
+                assert entry['bbox'] == pytest.approx([
+                    lat[located].min(), lon[located].min(),
+                    lat[located].max(), lon[located].max()], abs=1e-6)
+                vectors = toUnitVectors(lat[located], lon[located]).sum(axis=0)
+                assert entry['centroid']['lon'] == pytest.approx(
+                    np.degrees(np.arctan2(vectors[1], vectors[0])), abs=1e-5)
@@ -0,0 +1,79 @@
+# pylint: disable=W0621,R0201
+import json
+
+import numpy as np
+import pytest
+
+from hohgwuhn import geovis
+
+
+GEODATA_CSV = ''',Country,Country Code,City,Region,Address,Website,Phone #s,Instructor,Latitude,Longitude,Geocode Type,Google Address
+0,DENMARK,DK,Ikast,Ikast,Bogildvej 2 7430 Ikast,,21 47 32 57,Instr. Phil Brooks,56.1367943,9.1273999,ROOFTOP,"Bogildvej 2, 7430 Ikast"
+1,U.S.A.,US,Crystal Lake,Illinois,"8900 US Hwy 14 Crystal Lke, IL 60012",,(847) 962-8600,PKJN Tim Seitz,42.26,-88.37,ROOFTOP,
+2,U.S.A.,US,McHenry,Illinois,"1 Main St McHenry, IL 60050",,,Inst. Lee,42.3334,-88.2668,ROOFTOP,
+3,U.S.A.,US,Austin,Texas,"100 Congress Ave Austin, TX 78701",,,Inst. Kim,,,,
+'''
+
+
+@pytest.fixture
+def points():
+    """Two schools ~12km apart in Illinois, and one in Denmark"""
+    return np.array([42.26, 42.3334, 56.1367943]), np.array([-88.37, -88.2668, 9.1273999])
+
+
+class TestClusterPyramid:
+    """Verify the zoom-level clusters"""
+
+    def test_mercator_round_trip(self):
+        """Verify projecting and unprojecting gets the coordinates back"""
+        lat, lon = np.array([-60.0, 0.0, 42.26, 85.0]), np.array([-179.5, 0.0, -88.37, 179.5])
+        x, y = geovis.toMercator(lat, lon)
+        assert ((x >= 0) & (x < 1) & (y >= 0) & (y < 1)).all()
+        np.testing.assert_allclose(geovis.fromMercator(x, y), (lat, lon), atol=1e-9)
+
+    def test_levels_merge_upwards(self, points):
+        """Verify nearby schools share a cluster when zoomed out and split when zoomed in"""
+        levels = geovis.buildClusterPyramid(*points, max_zoom=12)
+        assert len(levels) == 13
+        assert [len(level['count']) for level in (levels[0], levels[5], levels[12])] == [2, 2, 3]
+        for level in levels:
+            assert level['count'].sum() == 3
+
+        illinois = levels[5]['count'] == 2
+        np.testing.assert_allclose(levels[5]['min_lat'][illinois], [42.26])
+        np.testing.assert_allclose(levels[5]['max_lon'][illinois], [-88.2668])
+        assert 42.26 < levels[5]['lat'][illinois][0] < 42.3334
+
+    def test_cluster_features(self, points):
+        """Verify clusters are GeoJSON points, with single schools linking to the school"""
+        level = geovis.buildClusterPyramid(*points, max_zoom=4)[4]
+        features = geovis.clusterFeatures(level)['features']
+        by_count = sorted(features, key=lambda feature: feature['properties']['count'])
+        assert by_count[0]['properties'] == {'count': 1, 'school': 2}
+        assert by_count[0]['geometry']['coordinates'] == [9.1273999, 56.1367943]
+        assert by_count[1]['properties'] == {'count': 2}
+        assert by_count[1]['bbox'] == [-88.37, 42.26, -88.2668, 42.3334]
+
+
+class TestExport:
+    """Verify the GeoJSON export"""
+
+    def test_export(self, tmp_path):
+        """Verify ungeocoded schools are left out and every zoom level gets a file"""
+        data_file = tmp_path / 'school_geodata.csv'
+        data_file.write_text(GEODATA_CSV)
+        geovis.exportGeoJSON(
+            str(data_file), str(tmp_path / 'schools.geojson'), str(tmp_path / 'clusters'),
+            max_zoom=3)
+
+        schools = json.loads((tmp_path / 'schools.geojson').read_text())
+        assert [feature['id'] for feature in schools['features']] == [0, 1, 2]
+        assert schools['features'][1]['properties']['City'] == 'Crystal Lake'
+        assert 'Latitude' not in schools['features'][1]['properties']
+
+        index = json.loads((tmp_path / 'clusters' / 'index.json').read_text())
+        assert index['schools'] == 3
+        assert len(index['clusters']) == 4
+        for zoom in range(4):
+            level = json.loads((tmp_path / 'clusters' / ('%s.geojson' % zoom)).read_text())
+            assert len(level['features']) == index['clusters'][zoom]
@@ -0,0 +1,155 @@
+# pylint: disable=W0621,R0201
+import json
+import timeit
+
+import pytest
+
+from hohgwuhn import geoetl, instrumentation
+
+
+class RecordingExporter:
+    """Keeps every summary exported to it"""
+    def __init__(self):
+        self.summaries = []
+
+    def export(self, invocation_summary):
+        self.summaries.append(invocation_summary)
+
+
+@pytest.fixture
+def enabled(monkeypatch):
+    """Instrumentation switched on, starting from an empty recorder"""
+    monkeypatch.setattr(instrumentation, 'ENABLED', True)
+    instrumentation.reset()
+    yield
+    instrumentation.reset()
+
+
+@pytest.fixture
+def disabled(monkeypatch):
+    """Instrumentation switched off, starting from an empty recorder"""
+    monkeypatch.setattr(instrumentation, 'ENABLED', False)
+    instrumentation.reset()
+
+
+class TestRecording:
+    """Verify timers and counters add up into the invocation summary"""
+
+    def test_timers_and_counters(self, enabled):
+        """Verify repeated timers and counters are totalled"""
+        for _ in range(3):
+            with instrumentation.timed('http.fetch'):
+                pass
+            instrumentation.count('http.bytes', 100)
+        instrumentation.count('geocode.api_calls')
+
+        summary = instrumentation.summary()
+        assert summary['timers']['http.fetch']['count'] == 3
+        assert summary['timers']['http.fetch']['seconds'] >= (
+            summary['timers']['http.fetch']['max_seconds'])
+        assert summary['counters'] == {'geocode.api_calls': 1, 'http.bytes': 300}
+
+    def test_invocation_exports_once(self, enabled):
+        """Verify an invocation starts clean and exports one summary, even when it fails"""
+        instrumentation.count('left.over')
+        exporter = RecordingExporter()
+        with instrumentation.invocation('fetchData', [exporter]):
+            instrumentation.count('fetch.schools', 5)
+        with pytest.raises(ValueError):
+            with instrumentation.invocation('geoETL', [exporter]):
+                raise ValueError('commit failed')
+
+        ok_summary, error_summary = exporter.summaries
+        assert ok_summary['invocation'] == 'fetchData'
+        assert ok_summary['status'] == 'ok'
+        assert ok_summary['counters'] == {'fetch.schools': 5}
+        assert error_summary['status'] == 'error'
+        assert error_summary['counters'] == {}
+
+    def test_firestore_commits_counted(self, enabled):
+        """Verify commitInChunks records a timer per batch and the documents written"""
+        class FakeBatch:
+            def set(self, *_):
+                pass
+
+            def commit(self):
+                pass
+
+        class FakeClient:
+            def batch(self):
+                return FakeBatch()
+
+        geoetl.commitInChunks(FakeClient(), [('ref', {})] * 7, chunk_size=3, workers=2)
+        summary = instrumentation.summary()
+        assert summary['timers']['firestore.commit']['count'] == 3
+        assert summary['counters']['firestore.writes'] == 7
+
+
+class TestExporters:
+    """Verify the configured exporters write the summary out"""
+
+    def test_configure(self, tmp_path):
+        """Verify the exporter config is split into exporters and their paths"""
+        exporters = instrumentation.configureExporters(
+            'log, file:%s,openmetrics:%s' % (tmp_path / 'a.jsonl', tmp_path / 'a.prom'))
+        assert [type(exporter) for exporter in exporters] == [
+            instrumentation.LogExporter, instrumentation.FileExporter,
+            instrumentation.OpenMetricsExporter]
+        assert exporters[1].path == str(tmp_path / 'a.jsonl')
+        assert instrumentation.configureExporters('') == []
+
+    def test_file_and_openmetrics(self, enabled, tmp_path):
+        """Verify the JSON lines accumulate and the OpenMetrics file holds the last invocation"""
+        json_path, metrics_path = tmp_path / 'metrics.jsonl', tmp_path / 'metrics.prom'
+        exporters = [
+            instrumentation.FileExporter(str(json_path)),
+            instrumentation.OpenMetricsExporter(str(metrics_path)),
+        ]
+        for _ in range(2):
+            with instrumentation.invocation('geocodeFile', exporters):
+                with instrumentation.timed('geocode.call'):
+                    pass
+                instrumentation.count('geocode.api_calls', 2)
+
+        lines = json_path.read_text().splitlines()
+        assert len(lines) == 2
+        assert json.loads(lines[0])['counters'] == {'geocode.api_calls': 2}
+
+        metrics = metrics_path.read_text().splitlines()
+        assert metrics[-1] == '# EOF'
+        assert '# TYPE hohgwuhn_events counter' in metrics
+        assert 'hohgwuhn_events_total{invocation="geocodeFile",name="geocode.api_calls"} 2' in (
+            metrics)
+        assert 'hohgwuhn_timer_calls_total{invocation="geocodeFile",name="geocode.call"} 1' in (
+            metrics)
+        assert not list(tmp_path.glob('*.tmp'))
+
+
+class TestDisabled:
+    """Verify disabled instrumentation records nothing and costs next to nothing"""
+
+    def test_nothing_recorded(self, disabled):
+        """Verify nothing is recorded or exported"""
+        exporter = RecordingExporter()
+        with instrumentation.invocation('fetchData', [exporter]):
+            with instrumentation.timed('http.fetch'):
+                instrumentation.count('http.bytes', 100)
+        assert exporter.summaries == []
+        assert instrumentation.summary()['timers'] == {}
+        assert instrumentation.summary()['counters'] == {}
+
+    def test_negligible_overhead(self, disabled):
+        """Verify a disabled timer plus counter adds well under a microsecond per use"""
+        def hooked():
+            with instrumentation.timed('http.fetch'):
+                pass
+            instrumentation.count('http.bytes', 100)
+
+        def bare():
+            pass
+
+        calls = 100000
+        # Best of several runs, to keep scheduler noise out of the comparison
+        hooked_seconds = min(timeit.repeat(hooked, number=calls, repeat=5))
+        bare_seconds = min(timeit.repeat(bare, number=calls, repeat=5))
+        assert (hooked_seconds - bare_seconds) / calls < 1e-6
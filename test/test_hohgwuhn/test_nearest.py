@@ -0,0 +1,76 @@
+# pylint: disable=W0621,R0201
+import numpy as np
+import pandas as pd
+import pytest
+
+from hohgwuhn import nearest
+
+
+@pytest.fixture
+def schools():
+    """Random school locations, denser in the northern hemisphere like the real data"""
+    rng = np.random.default_rng(7)
+    lat = np.degrees(np.arcsin(rng.uniform(-0.6, 0.95, 2000)))
+    lon = rng.uniform(-180, 180, 2000)
+    return lat, lon
+
+
+@pytest.fixture
+def queries():
+    """Query points, including the poles and both sides of the antimeridian"""
+    rng = np.random.default_rng(11)
+    lat = np.concatenate([rng.uniform(-90, 90, 500), [90, -90, 0, 0]])
+    lon = np.concatenate([rng.uniform(-180, 180, 500), [0, 0, 179.99, -179.99]])
+    return lat, lon
+
+
+class TestSchoolIndex:
+    """Verify the spatial index agrees with a brute force scan"""
+
+    def test_haversine_known_distance(self):
+        """Verify the haversine distance from Chicago to Phoenix"""
+        assert nearest.haversine(41.8781, -87.6298, 33.4484, -112.0740) == pytest.approx(
+            2335, rel=0.01)
+
+    def test_k_nearest_matches_brute_force(self, schools, queries):
+        """Verify k-nearest answers are exactly the brute force answers"""
+        index = nearest.SchoolIndex.build(*schools, leaf_size=16)
+        distances, school_ids = index.nearest(*queries, k=5)
+        expected_distances, expected_ids = nearest.bruteForceNearest(*queries, *schools, k=5)
+
+        np.testing.assert_allclose(distances, expected_distances, rtol=1e-9)
+        assert (school_ids[:, 0] == expected_ids[:, 0]).mean() > 0.99
+
+    def test_within_radius_matches_brute_force(self, schools, queries):
+        """Verify within-radius answers hold every school in range, nearest first"""
+        index = nearest.SchoolIndex.build(*schools)
+        results = index.withinRadius(*queries, radius_km=500)
+
+        all_distances = nearest.haversine(
+            queries[0][:, None], queries[1][:, None], schools[0][None], schools[1][None])
+        for (distances, school_ids), expected in zip(results, all_distances):
+            assert set(school_ids) == set(np.flatnonzero(expected <= 500))
+            assert np.all(np.diff(distances) >= 0)
+
+    def test_saved_index_loads_the_same(self, schools, queries, tmp_path):
+        """Verify a saved index answers queries the same after loading"""
+        index = nearest.SchoolIndex.build(*schools, school_ids=np.arange(2000).astype(str))
+        index.save(str(tmp_path / 'index.npz'))
+        loaded = nearest.SchoolIndex.load(str(tmp_path / 'index.npz'))
+
+        assert len(loaded) == 2000
+        for expected, actual in zip(index.nearest(*queries, k=3), loaded.nearest(*queries, k=3)):
+            np.testing.assert_array_equal(expected, actual)
+
+    def test_from_geodata_skips_schools_not_found(self):
+        """Verify schools without coordinates are left out of the index"""
+        school_df = pd.DataFrame({
+            'City': ['Ikast', 'Crystal Lake', 'Kadena AFB'],
+            'Latitude': [56.1367943, '', 26.3556897],
+            'Longitude': [9.1273999, '', 127.7678754],
+        })
+        index = nearest.SchoolIndex.fromGeoData(school_df, id_column='City')
+        distances, school_ids = index.nearest(56.17, 9.55, k=5)
+
+        assert school_ids.tolist() == [['Ikast', 'Kadena AFB']]
+        assert distances[0, 0] == pytest.approx(26.4, abs=0.5)
@@ -0,0 +1,79 @@
+# pylint: disable=W0621,R0201
+import pytest
+
+from hohgwuhn import normalize
+from hohgwuhn.school import School
+
+
+@pytest.fixture
+def rules(monkeypatch):
+    """Register rules for the test only, on top of the real ones"""
+    monkeypatch.setattr(normalize, '_RULES', {
+        country_code: list(country_rules)
+        for country_code, country_rules in normalize._RULES.items()  # pylint: disable=W0212
+    })
+    monkeypatch.setattr(normalize, '_COMPILED', dict(normalize._COMPILED))  # pylint: disable=W0212
+    return normalize.rule
+
+
+def _school(country_code, address, region='Region', city='City'):
+    return School(
+        country_name=country_code, country_code=country_code, city=city, region=region,
+        address=address)
+
+
+class TestEngine:
+    """Verify rules are dispatched by country"""
+
+    def test_dispatch_by_country(self, rules):
+        """Verify each rule only sees the schools of its countries, tokenized once"""
+        seen = []
+
+        @rules('JP', 'DK')
+        def recordTokens(school, tokens):
+            seen.append((school.country_code, tokens))
+            return tokens
+
+        schools = [_school('JP', '1-2 Kadena  Okinawa'), _school('US', '1 Main St'),
+                   _school('DK', 'Bogildvej 2')]
+        assert normalize.normalizeSchools(schools) == 2
+        assert seen == [('JP', ['1-2', 'Kadena', 'Okinawa']), ('DK', ['Bogildvej', '2'])]
+
+    def test_rules_chain_tokens(self, rules):
+        """Verify rules run in registration order, each getting the tokens the last returned"""
+        @rules('JP')
+        def dropFirst(school, tokens):
+            school.address = ' '.join(tokens[1:])
+            return tokens[1:]
+
+        @rules('JP')
+        def keepLast(school, tokens):
+            school.city = tokens[-1]
+            return tokens
+
+        school = _school('JP', 'Bldg. 109 Kadena')
+        normalize.normalizeSchools([school])
+        assert (school.address, school.city) == ('109 Kadena', 'Kadena')
+
+    def test_restricted_countries(self, rules):
+        """Verify country_codes limits the rules applied"""
+        @rules('JP')
+        def upper(school, tokens):
+            school.address = school.address.upper()
+            return tokens
+
+        schools = [_school('JP', 'kadena'), _school('KR', '1 Busan Younggeun Gye', 'Busan')]
+        assert normalize.normalizeSchools(schools, country_codes=['KR']) == 1
+        assert schools[0].address == 'kadena'
+        assert schools[1].instructor == 'Younggeun Gye'
+
+
+class TestHankuk:
+    """Verify the Korean rules, beyond the fetch_wksa tests"""
+
+    def test_instructor_in_city_column(self):
+        """Verify a city column holding the instructor moves to Instructor"""
+        school = _school('KR', '11 Jung-Gu Busan', region='Busan', city='Kim Minsu')
+        normalize.normalizeSchools([school])
+        assert (school.address, school.city, school.instructor) == (
+            '11 Jung-Gu Busan', 'Jung-Gu', 'Kim Minsu')
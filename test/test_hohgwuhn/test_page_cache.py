@@ -0,0 +1,137 @@
+# pylint: disable=W0621,R0201
+import os
+import time
+
+import pytest
+
+from hohgwuhn import fetch_wksa as fetch
+from hohgwuhn import page_cache
+
+
+class FakeResponse:
+    """Just enough of requests.Response for the page cache."""
+    def __init__(self, text, status_code=200, headers=None):
+        self.text = text
+        self.content = text.encode()
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class ConditionalSession:
+    """Serves a single country page, honoring If-None-Match when the page has an ETag."""
+    def __init__(self, body, etag=''):
+        self.body = body
+        self.etag = etag
+        self.sent_headers = []
+
+    def get(self, _url, headers=None, **_):
+        self.sent_headers.append(headers or {})
+        if self.etag and (headers or {}).get('If-None-Match') == self.etag:
+            return FakeResponse('', status_code=304)
+        return FakeResponse(self.body, headers={'ETag': self.etag} if self.etag else {})
+
+
+COUNTRY_PAGE = (
+    '<html><body><div class="schools_content">'
+    '<div class="region_name">jutland</div>'
+    '<div class="school"><div class="city">Ikast</div>'
+    '<div class="contact">Bogildvej 2<br />7430 Ikast</div>'
+    '<div class="instructor">Instr. Phil Brooks</div></div>'
+    '</div></body></html>'
+)
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    """A page cache on local disk, used by the scraper"""
+    test_cache = page_cache.PageCache(page_cache.LocalPageStore(str(tmp_path)))
+    monkeypatch.setattr(fetch, 'getPageCache', lambda: test_cache)
+    return test_cache
+
+
+@pytest.fixture
+def parse_count(monkeypatch):
+    """Counts how many times a country page gets parsed"""
+    counter = {'parsed': 0}
+    real_parser = fetch._getSchoolsContent  # pylint: disable=W0212
+
+    def countingParser(*args):
+        counter['parsed'] += 1
+        return real_parser(*args)
+    monkeypatch.setattr(fetch, '_getSchoolsContent', countingParser)
+    return counter
+
+
+class TestPageCache:
+    """Verify pages are only re-downloaded and re-parsed when they change"""
+
+    def _pull(self, monkeypatch, session):
+        monkeypatch.setattr(fetch, 'getSession', lambda: session)
+        return fetch.pullGenericDirectoryInfo('http://wksa.example/DK', 'DENMARK', 'DK')
+
+    def test_not_modified_reuses_parsed_schools(self, monkeypatch, cache, parse_count):
+        """Verify a 304 reply reuses the schools parsed on the previous run"""
+        session = ConditionalSession(COUNTRY_PAGE, etag='"v1"')
+        first_schools = self._pull(monkeypatch, session)
+        first_schools[0].phone_numbers = 'mutated later in the pipeline'
+
+        second_schools = self._pull(monkeypatch, session)
+        assert session.sent_headers[1] == {'If-None-Match': '"v1"'}
+        assert parse_count['parsed'] == 1
+        assert second_schools[0].phone_numbers == ''
+        assert second_schools[0].address == 'Bogildvej 2 7430 Ikast'
+        assert cache.report() == {'hit': 1, 'miss': 0}
+
+    def test_unchanged_body_without_validators_is_a_hit(self, monkeypatch, cache, parse_count):
+        """Verify a server without ETags still gets hits when the body is unchanged"""
+        session = ConditionalSession(COUNTRY_PAGE)
+        first_schools = self._pull(monkeypatch, session)
+        assert cache.report() == {'hit': 0, 'miss': 1}
+
+        assert self._pull(monkeypatch, session) == first_schools
+        assert parse_count['parsed'] == 1
+
+        session.body = COUNTRY_PAGE.replace('Ikast</div>', 'Herning</div>')
+        assert self._pull(monkeypatch, session)[0].city == 'Herning'
+        assert parse_count['parsed'] == 2
+        assert cache.report() == {'hit': 0, 'miss': 1}
+
+    def test_expired_entries_are_refetched(self, monkeypatch, cache, parse_count):
+        """Verify an entry older than the max age is neither revalidated nor reused"""
+        session = ConditionalSession(COUNTRY_PAGE, etag='"v1"')
+        self._pull(monkeypatch, session)
+
+        cache.max_age = -1
+        self._pull(monkeypatch, session)
+        assert session.sent_headers[1] == {}
+        assert parse_count['parsed'] == 2
+
+    def test_other_format_is_reparsed(self, monkeypatch, cache, parse_count):
+        """Verify entries written in another format are dropped rather than reused"""
+        session = ConditionalSession(COUNTRY_PAGE, etag='"v1"')
+        self._pull(monkeypatch, session)
+        (key, _, _), = cache.store.entries()
+        entry = cache.store.read(key)
+        cache.store.write(key, dict(entry, format=page_cache.PAGE_CACHE_FORMAT - 1))
+
+        assert self._pull(monkeypatch, session)[0].city == 'Ikast'
+        assert session.sent_headers[1] == {}
+        assert parse_count['parsed'] == 2
+        assert cache.store.read(key)['format'] == page_cache.PAGE_CACHE_FORMAT
+
+    def test_evicts_least_recently_used_over_size_cap(self, tmp_path):
+        """Verify eviction drops the oldest entries until under the size cap"""
+        store = page_cache.LocalPageStore(str(tmp_path))
+        for age, key in enumerate(['newest', 'middle', 'oldest']):
+            store.write(key, {'body': 'x' * 100})
+            last_used = time.time() - age * 60
+            os.utime(os.path.join(str(tmp_path), '%s.json' % key), (last_used, last_used))
+
+        entry_size = store.entries()[0][1]
+        cache = page_cache.PageCache(store, max_bytes=2 * entry_size)
+        assert cache.evict() == 1
+        assert sorted(key for key, _, _ in store.entries()) == ['middle', 'newest']
+
+        cache.max_age = 30
+        assert cache.evict() == 1
+        assert [key for key, _, _ in store.entries()] == ['newest']
@@ -0,0 +1,97 @@
+# pylint: disable=W0621,R0201
+import csv
+import os
+
+import phonenumbers as libphone
+import pytest
+
+from hohgwuhn import phone_cache
+
+
+SCHOOL_DATA_FILE = os.path.join(os.path.dirname(__file__), '..', '..', 'data', 'school_data.csv')
+
+
+def referenceSplit(address, country_code):
+    """The address / phone number split as separatePhoneNumbers did it before memoization."""
+    phone_numbers = []
+    phone_index_min = len(address)
+    for match in libphone.PhoneNumberMatcher(address, country_code):
+        phone_numbers.append(
+            str(libphone.format_number(match.number, libphone.PhoneNumberFormat.NATIONAL)))
+        phone_index_min = min(phone_index_min, match.start)
+    return ';'.join(phone_numbers), address[:phone_index_min].strip()
+
+
+def cachedSplit(address, country_code, result):
+    phone_numbers, phone_start = result
+    return ';'.join(phone_numbers), address[:phone_start].strip()
+
+
+@pytest.fixture
+def scraped_lookups():
+    """Addresses as scraped, rebuilt from the exported addresses and phone numbers"""
+    with open(SCHOOL_DATA_FILE, 'r') as school_file:
+        return [
+            ('%s  %s ' % (row['Address'], ' '.join(row['Phone #s'].split(';'))),
+             row['Country Code'])
+            for row in csv.DictReader(school_file)
+        ] + [
+            ('Bogildvej', 'DK'),
+            ('Unit 2B, 1 Main St', 'US'),
+            ('NEW!!! 126 W. Desert Hills Phoenix, AZ 85086  623-337-0258', 'US'),
+            ('136-156 Sinam4-Dong 053-942-4414 053-942-4415', 'KR'),
+        ]
+
+
+class TestPhoneExtraction:
+    """Verify memoized, parallel extraction splits addresses exactly as before"""
+
+    def test_matches_reference_split(self, scraped_lookups):
+        """Verify the split is identical to the original matcher loop for every scraped address"""
+        results = phone_cache.extractAll(scraped_lookups, workers=1)
+        for lookup, result in zip(scraped_lookups, results):
+            assert cachedSplit(*lookup, result) == referenceSplit(*lookup)
+
+    def test_process_pool_matches_serial(self, monkeypatch, scraped_lookups):
+        """Verify fanning out over a process pool gives the same results, in order"""
+        monkeypatch.setattr(phone_cache, 'PHONE_PARALLEL_MIN', 1)
+        serial = phone_cache.extractAll(scraped_lookups, workers=1)
+        assert phone_cache.extractAll(scraped_lookups, workers=2) == serial
+
+    def test_prefilter_skips_matcher(self, monkeypatch):
+        """Verify addresses without a pair of nearby digits never reach phonenumbers"""
+        def failingMatcher(*_):
+            raise AssertionError('matcher should have been skipped')
+        monkeypatch.setattr(phone_cache.libphone, 'PhoneNumberMatcher', failingMatcher)
+
+        assert phone_cache.extractPhoneNumbers('Bogildvej 2, Ikast', 'DK') == ([], None)
+
+    def test_duplicates_parsed_once(self, monkeypatch):
+        """Verify repeated addresses within a run are only parsed once"""
+        calls = []
+        real_extract = phone_cache.extractPhoneNumbers
+
+        def countingExtract(address, country_code):
+            calls.append(address)
+            return real_extract(address, country_code)
+        monkeypatch.setattr(phone_cache, 'extractPhoneNumbers', countingExtract)
+
+        lookups = [('1 Main St (847) 962-8600', 'US')] * 3
+        results = phone_cache.extractAll(lookups, workers=1)
+        assert len(calls) == 1
+        assert results == [(['(847) 962-8600'], 10)] * 3
+
+    def test_persistent_cache_survives_runs(self, monkeypatch, tmp_path, scraped_lookups):
+        """Verify a second run reads every result back from the SQLite store"""
+        location = str(tmp_path / 'phones.sqlite')
+        first_cache = phone_cache.openPhoneCache(location)
+        first_results = phone_cache.extractAll(scraped_lookups, first_cache, workers=1)
+        first_cache.close()
+
+        def failingExtract(*_):
+            raise AssertionError('every address should have been cached')
+        monkeypatch.setattr(phone_cache, 'extractPhoneNumbers', failingExtract)
+
+        second_cache = phone_cache.openPhoneCache(location)
+        assert phone_cache.extractAll(scraped_lookups, second_cache, workers=1) == first_results
+        assert second_cache.report() == 1.0
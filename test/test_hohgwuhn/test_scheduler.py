@@ -0,0 +1,180 @@
+# pylint: disable=W0621,R0201
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import time
+
+import pytest
+import requests
+
+from hohgwuhn import checkpoint, scheduler
+from hohgwuhn import fetch_wksa as fetch
+from hohgwuhn.school import School
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    """Serves /<page>, failing or stalling the attempts the server's script asks for"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        server = self.server
+        with server.lock:
+            attempt = server.attempts.get(self.path, 0)
+            server.attempts[self.path] = attempt + 1
+            server.in_flight += 1
+            server.peak_in_flight = max(server.peak_in_flight, server.in_flight)
+        status, delay, headers = server.script(self.path, attempt)
+        time.sleep(delay)
+        with server.lock:
+            server.in_flight -= 1
+
+        body = ('page %s' % self.path).encode() if status == 200 else b'oops'
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, *_):
+        pass
+
+
+@pytest.fixture
+def flaky_site():
+    """A local HTTP stand-in for the WKSA site, whose failures each test scripts"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FlakyHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.attempts = {}
+    server.in_flight = server.peak_in_flight = 0
+    server.script = lambda path, attempt: (200, 0, {})
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = 'http://127.0.0.1:%s' % server.server_address[1]
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _fetchAll(run_scheduler, urls, workers=8):
+    session = run_scheduler.wrap(requests.Session())
+    results = [None] * len(urls)
+
+    def fetchOne(index):
+        results[index] = session.get(urls[index]).text
+
+    threads = [
+        threading.Thread(target=lambda worker=worker: [
+            fetchOne(index) for index in range(worker, len(urls), workers)])
+        for worker in range(workers)
+    ]
+    _ = [thread.start() for thread in threads]
+    _ = [thread.join() for thread in threads]
+    return results
+
+
+class TestRequestScheduler:
+    """Verify the scheduler against a misbehaving local site"""
+
+    def test_rides_out_errors_and_latency_spikes(self, flaky_site):
+        """Verify 5xx responses and stalled requests are retried until every page is fetched"""
+        def script(path, attempt):
+            page = int(path[1:])
+            if attempt == 0 and page % 5 == 0:
+                return 503, 0, {}
+            if attempt == 0 and page % 7 == 0:
+                return 200, 1.0, {}
+            return 200, 0.005, {}
+        flaky_site.script = script
+
+        run_scheduler = scheduler.RequestScheduler(
+            8, timeout=0.3, backoff_seconds=0.01, slow_seconds=0.2)
+        urls = ['%s/%s' % (flaky_site.url, page) for page in range(60)]
+        assert _fetchAll(run_scheduler, urls) == ['page /%s' % page for page in range(60)]
+
+        stats = run_scheduler.report()
+        assert stats['requests'] == 60
+        assert stats['retries'] == stats['attempts'] - 60 > 0
+        assert stats['timeouts'] > 0 and stats['failed'] == 0
+        assert stats['decreases'] > 0
+        assert stats['requests_per_second'] > 0
+
+    def test_limit_adapts(self, flaky_site):
+        """Verify the limit climbs on fast responses, and is halved once per bad round"""
+        run_scheduler = scheduler.RequestScheduler(
+            6, backoff_seconds=0.01, initial_concurrency=1)
+        _fetchAll(run_scheduler, ['%s/%s' % (flaky_site.url, page) for page in range(80)])
+        assert run_scheduler.limit == 6
+        assert flaky_site.peak_in_flight <= 6
+
+        flaky_site.script = lambda path, attempt: (500, 0, {}) if attempt == 0 else (200, 0, {})
+        _fetchAll(run_scheduler, ['%s/x%s' % (flaky_site.url, page) for page in range(6)], 6)
+        # Six failures sent together halve the limit once, not six times
+        assert run_scheduler.stats['decreases'] >= 1
+        assert run_scheduler.stats['decreases'] < 6
+
+    def test_retry_after_pauses_everyone(self, flaky_site):
+        """Verify a Retry-After holds back the retry and every request sent after it"""
+        flaky_site.script = lambda path, attempt: (
+            (429, 0, {'Retry-After': '1'}) if path == '/0' and attempt == 0 else (200, 0, {}))
+        run_scheduler = scheduler.RequestScheduler(1, backoff_seconds=0.01)
+        session = run_scheduler.wrap(requests.Session())
+
+        start = time.monotonic()
+        session.get(flaky_site.url + '/0')
+        session.get(flaky_site.url + '/1')
+        assert time.monotonic() - start >= 1
+        assert run_scheduler.stats['throttled'] == 1
+
+    def test_retry_after_date(self):
+        """Verify HTTP-date Retry-After values are understood"""
+        response = requests.Response()
+        response.headers['Retry-After'] = 'Wed, 21 Oct 2015 07:28:30 GMT'
+        assert scheduler.retryAfterSeconds(response, now=1445412500) == 10
+        response.headers['Retry-After'] = 'soon'
+        assert scheduler.retryAfterSeconds(response) is None
+
+    def test_gives_up(self, flaky_site):
+        """Verify a page that keeps failing raises FetchFailed after its retries"""
+        flaky_site.script = lambda path, attempt: (502, 0, {})
+        run_scheduler = scheduler.RequestScheduler(4, retries=2, backoff_seconds=0.01)
+        with pytest.raises(scheduler.FetchFailed):
+            run_scheduler.wrap(requests.Session()).get(flaky_site.url + '/0')
+        assert flaky_site.attempts['/0'] == 3
+
+    def test_deadline(self, flaky_site):
+        """Verify a stalled site cannot hold the run past its deadline"""
+        flaky_site.script = lambda path, attempt: (200, 3, {})
+        run_scheduler = scheduler.RequestScheduler(
+            2, deadline=checkpoint.Deadline(0.5), backoff_seconds=0.01)
+
+        start = time.monotonic()
+        with pytest.raises(checkpoint.DeadlineExceeded):
+            run_scheduler.wrap(requests.Session()).get(flaky_site.url + '/0')
+        assert time.monotonic() - start < 2
+
+
+class TestScheduledScrape:
+    """Verify the scraper's pages go through the scheduler"""
+
+    def test_failed_pages_fail_the_run(self, monkeypatch, flaky_site):
+        """Verify a country whose page keeps failing is reported, after the other pages"""
+        flaky_site.script = lambda path, attempt: (500, 0, {}) if path == '/DE' else (200, 0, {})
+        monkeypatch.setattr(fetch, '_SCHEDULER', scheduler.RequestScheduler(
+            4, retries=1, backoff_seconds=0.01))
+        monkeypatch.setattr(fetch, '_getSchoolsContent', lambda body, name, code: [
+            School(country_name=name, country_code=code, city='', region='', address=body)])
+
+        countries = [
+            {'name': name, 'link': '%s/%s' % (flaky_site.url, code), 'ISO-2': code}
+            for name, code in [('DENMARK', 'DK'), ('GERMANY', 'DE'), ('JAPAN', 'JP')]
+        ]
+        with pytest.raises(fetch.DirectoryIncomplete) as failed:
+            fetch.pullDirectoryInfo(countries, concurrency=4)
+        assert str(failed.value).startswith('1 of 3 pages failed')
+        assert 'GERMANY: ' in str(failed.value)
+        assert flaky_site.attempts['/DE'] == 2
+        assert flaky_site.attempts['/DK'] == flaky_site.attempts['/JP'] == 1
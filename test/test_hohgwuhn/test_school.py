@@ -0,0 +1,54 @@
+# pylint: disable=W0621,R0201
+import csv
+import io
+
+import pytest
+
+from hohgwuhn import school as school_module
+from hohgwuhn.school import School
+
+
+@pytest.fixture
+def dk_school():
+    """Sample Denmark school, after phone number extraction"""
+    return School(
+        country_name='DENMARK', country_code='DK', city='Ikast', region='Jylland',
+        address='Bogildvej 2 7430 Ikast', website='http://ikast.example',
+        phone_numbers='21 45 67 89', instructor='Inst. Hansen'
+    )
+
+
+class TestSchool:
+    """Verify the school record and its CSV / dict conversions"""
+
+    def test_slotted(self, dk_school):
+        """Verify records have no per-instance dict"""
+        assert not hasattr(dk_school, '__dict__')
+        with pytest.raises(AttributeError):
+            dk_school.phone_number = 'typo'
+
+    def test_row_matches_header(self, dk_school):
+        """Verify rows come out in the same order as the CSV header"""
+        assert school_module.CSV_HEADER == (
+            'Country', 'Country Code', 'City', 'Region',
+            'Address', 'Website', 'Phone #s', 'Instructor'
+        )
+        row = dict(zip(school_module.CSV_HEADER, school_module.toRow(dk_school)))
+        assert row['City'] == 'Ikast'
+        assert row['Region'] == 'Jylland'
+        assert row['Phone #s'] == '21 45 67 89'
+
+    def test_dict_round_trip(self, dk_school):
+        """Verify records survive the JSON-friendly dict form used by the page cache"""
+        assert School.fromDict(dk_school.toDict()) == dk_school
+
+    def test_csv_round_trip(self, dk_school):
+        """Verify the written rows read back as the original fields"""
+        csvout = io.StringIO()
+        writer = csv.writer(csvout, lineterminator='\n')
+        writer.writerow(school_module.CSV_HEADER)
+        writer.writerows(map(school_module.toRow, [dk_school]))
+
+        csvout.seek(0)
+        rows = list(csv.DictReader(csvout))
+        assert rows == [dict(zip(school_module.CSV_HEADER, school_module.toRow(dk_school)))]
@@ -0,0 +1,154 @@
+# pylint: disable=W0621,R0201
+import io
+import json
+
+import pandas as pd
+import pytest
+
+from hohgwuhn import gcs, geoetl, shards, snapshots
+from hohgwuhn import geocoder_googs as geocoder
+
+
+RUN_NAME = 'WORLD/2019-01-01'
+HEADER = ['Country', 'Country Code', 'City', 'Region', 'Address']
+ROWS = [
+    ['U.S.A.', 'US', 'Crystal Lake', 'Illinois', '1 Main St'],
+    ['DENMARK', 'DK', 'Ikast', 'Ikast', '2 Main St'],
+    ['U.S.A.', 'US', 'Phoenix', 'Arizona', '3 Main St'],
+    ['U.S.A.', 'US', 'Austin', 'Texas', '4 Main St'],
+    ['', '', 'Nowhere', '', '5 Main St'],
+]
+
+
+class FoundApiManager:
+    """Stands in for LimitedApiManager, finding every address; picklable for process pools"""
+    def __init__(self, queries_per_second=30, cache=None, deadline=None):
+        # pylint: disable=unused-argument
+        self.calls = []
+
+    def get(self, address, country_code):
+        self.calls.append((address, country_code))
+        return [{
+            'formatted_address': 'Found %s' % address,
+            'geometry': {'location': {'lat': 1.5, 'lng': -1.5}, 'location_type': 'ROOFTOP'},
+        }]
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def fake_geocoding(monkeypatch):
+    """Geocode with FoundApiManager, without a cache or gazetteer"""
+    monkeypatch.setattr(geocoder, 'LimitedApiManager', FoundApiManager)
+    monkeypatch.setattr(geocoder, 'openGeocodeCache', lambda: None)
+    monkeypatch.setattr(geocoder, 'openGazetteer', lambda: None)
+
+
+class TestPlan:
+    """Verify how scrapes are split"""
+
+    def test_by_country(self):
+        """Verify shards follow countries, splitting the large ones"""
+        planned = shards.planShards(ROWS, 1, 'country', max_rows=2)
+        assert {name: [row[4] for row in rows] for name, rows in planned.items()} == {
+            'US-000.csv': ['1 Main St', '3 Main St'],
+            'US-001.csv': ['4 Main St'],
+            'DK-000.csv': ['2 Main St'],
+            'XX-000.csv': ['5 Main St'],
+        }
+
+    def test_by_rows(self):
+        """Verify fixed-size shards keep the scrape order"""
+        planned = shards.planShards(ROWS, 1, 'rows', max_rows=2)
+        assert list(planned) == ['part-00000.csv', 'part-00001.csv', 'part-00002.csv']
+        assert sum(planned.values(), []) == ROWS
+
+    def test_unknown(self):
+        """Verify a typo in the sharding is not silently ignored"""
+        with pytest.raises(ValueError):
+            shards.planShards(ROWS, 1, 'region')
+
+    def test_names(self):
+        """Verify shard objects are recognized, and map back to their run"""
+        name = shards.shardPrefix(RUN_NAME) + 'US-000.csv'
+        assert shards.isShardName(name) and not shards.isManifestName(name)
+        assert shards.runName(name) == RUN_NAME
+        assert shards.isManifestName(shards.shardPrefix(RUN_NAME) + 'manifest.json')
+        assert not shards.isShardName(RUN_NAME)
+
+
+class TestShardedRun:
+    """Verify shards are geocoded on their own, then merged once all are done"""
+
+    def test_fan_out_and_merge(self, buckets, fake_geocoding):
+        """Verify the last shard to finish merges them all, in manifest order"""
+        fetch_bucket, geocode_bucket = (
+            buckets[gcs.GCLOUD_FETCH_BUCKET], buckets[gcs.GCLOUD_GEOCODE_BUCKET])
+        manifest = shards.exportShards(HEADER, ROWS, RUN_NAME, 'country', max_rows=2)
+        prefix = shards.shardPrefix(RUN_NAME)
+        assert json.loads(fetch_bucket.objects[prefix + 'manifest.json']) == manifest
+        assert len(fetch_bucket.objects) == 5
+
+        assert not geocoder.loadSchoolData(prefix + 'manifest.json')
+        shard_names = [prefix + shard['name'] for shard in manifest['shards']]
+        for shard_name in reversed(shard_names):
+            assert RUN_NAME not in geocode_bucket.objects
+            assert geocoder.loadSchoolData(shard_name)
+            # Geocoded shards do not reach Firestore on their own
+            assert shard_name in geocode_bucket.objects or RUN_NAME in geocode_bucket.objects
+            assert geoetl.loadCountryFile(shard_name) is None
+
+        geodata = pd.read_csv(io.BytesIO(geocode_bucket.objects[RUN_NAME]), dtype=str)
+        assert geodata['Address'].tolist() == [
+            '1 Main St', '3 Main St', '4 Main St', '2 Main St', '5 Main St']
+        assert geodata['Google Address'].tolist() == [
+            'Found %s' % address for address in geodata['Address']]
+        assert sorted(geocode_bucket.objects) == [RUN_NAME, prefix + '_merged']
+
+    def test_merge_is_claimed_once(self, buckets):
+        """Verify a run already merging is left alone, unless forced"""
+        geocode_bucket = buckets[gcs.GCLOUD_GEOCODE_BUCKET]
+        manifest = shards.exportShards(HEADER, ROWS, RUN_NAME, 'rows', max_rows=5)
+        prefix = shards.shardPrefix(RUN_NAME)
+        geocode_bucket.objects[prefix + 'part-00000.csv'] = (
+            buckets[gcs.GCLOUD_FETCH_BUCKET].objects[prefix + 'part-00000.csv'])
+        geocode_bucket.objects[prefix + '_merged'] = b''
+
+        assert not shards.mergeIfComplete(RUN_NAME)
+        assert RUN_NAME not in geocode_bucket.objects
+        assert shards.mergeIfComplete(RUN_NAME, force=True)
+        assert pd.read_csv(io.BytesIO(geocode_bucket.objects[RUN_NAME])).shape == (
+            manifest['shards'][0]['rows'], len(HEADER))
+
+    def test_short_shard_is_not_merged(self, buckets):
+        """Verify a shard missing rows stops the merge before anything is written"""
+        geocode_bucket = buckets[gcs.GCLOUD_GEOCODE_BUCKET]
+        shards.exportShards(HEADER, ROWS, RUN_NAME, 'rows', max_rows=5)
+        geocode_bucket.objects[shards.shardPrefix(RUN_NAME) + 'part-00000.csv'] = (
+            ','.join(HEADER) + '\nU.S.A.,US,Crystal Lake,Illinois,1 Main St\n').encode()
+
+        with pytest.raises(ValueError):
+            shards.mergeIfComplete(RUN_NAME)
+        assert RUN_NAME not in geocode_bucket.objects
+
+
+class TestLocalRun:
+    """Verify the local process pool runner"""
+
+    def test_run_local(self, tmp_path, monkeypatch, fake_geocoding):
+        """Verify every shard is geocoded in a worker and merged into the geodata file"""
+        scrape_file = tmp_path / 'school_data.csv'
+        pd.DataFrame(ROWS, columns=HEADER).to_csv(scrape_file, index=False)
+        monkeypatch.setattr(geocoder, 'SCHOOL_GEODATA_FILE', str(tmp_path / 'geodata.csv'))
+        monkeypatch.setattr(snapshots, 'writeSnapshot', lambda *_: None)
+
+        school_df = shards.runLocal(
+            str(scrape_file), 'country', max_rows=2, workers=2,
+            shard_dir=str(tmp_path / 'shards'), api_factory=FoundApiManager)
+
+        assert len(school_df) == 5
+        geodata = pd.read_csv(tmp_path / 'geodata.csv', dtype=str, keep_default_na=False)
+        assert sorted(geodata['Address']) == sorted(row[4] for row in ROWS)
+        assert geodata['Latitude'].eq('1.5').all()
+        assert not (tmp_path / 'shards').exists()
@@ -0,0 +1,64 @@
+# pylint: disable=W0621,R0201
+import pyarrow as pa
+import pytest
+
+from hohgwuhn import snapshots
+
+
+GEODATA_CSV = '''Country,Country Code,City,Region,Address,Website,Phone #s,Instructor,Latitude,Longitude,Geocode Type,Google Address
+DENMARK,DK,Ikast,Ikast,Bogildvej 2 7430 Ikast,http://www.kswikast.com,21 47 32 57,Instr. Phil Brooks,56.1367943,9.1273999,ROOFTOP,"Bogildvej 2, 7430 Ikast, Denmark"
+U.S.A.,US,Crystal Lake,Illinois,"8900 US Hwy 14 Crystal Lke, IL 60012",,(847) 962-8600,PKJN Tim Seitz,,,,
+'''
+
+OLD_GEODATA_CSV = '''City,Region,Address,Phone #s,Instructor,Latitude,Longitude,Geocode Type
+Crystal Lake,Illinois,"8900 US Hwy 14 Crystal Lke, IL 60012",(847) 962-8600,PKJN Tim Seitz,42.26,-88.37,ROOFTOP
+'''
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    """A data/ folder holding an old US-only snapshot and a newer worldwide one"""
+    for date, contents in [('2015-07-06', OLD_GEODATA_CSV), ('2019-01-01', GEODATA_CSV)]:
+        (tmp_path / date).mkdir()
+        (tmp_path / date / 'school_geodata.csv').write_text(contents)
+    (tmp_path / 'school_geodata.csv').write_text(GEODATA_CSV)
+    return str(tmp_path)
+
+
+class TestSnapshotStore:
+    """Verify the columnar twins of the scrape history"""
+
+    def test_lists_dated_snapshots(self, data_dir):
+        """Verify only the dated folders are listed as snapshots"""
+        assert snapshots.listSnapshots(data_dir=data_dir) == ['2015-07-06', '2019-01-01']
+        assert snapshots.listSnapshots('scrape', data_dir=data_dir) == []
+
+    def test_columns_are_compactly_typed(self, data_dir):
+        """Verify categorical place columns and float coordinates"""
+        table = snapshots.openSnapshot('2019-01-01', data_dir=data_dir)
+
+        assert pa.types.is_dictionary(table.schema.field('Country Code').type)
+        assert pa.types.is_dictionary(table.schema.field('Region').type)
+        assert table.schema.field('Latitude').type == pa.float64()
+        assert table.column('Latitude').to_pylist() == [56.1367943, None]
+        assert table.column('Phone #s').to_pylist() == ['21 47 32 57', '(847) 962-8600']
+
+    def test_open_is_memory_mapped_with_projection(self, data_dir):
+        """Verify opening a converted snapshot copies nothing and projects columns"""
+        snapshots.convertSnapshot('2019-01-01', data_dir=data_dir)
+        allocated_before = pa.total_allocated_bytes()
+        table = snapshots.openSnapshot(
+            '2019-01-01', columns=['City', 'Longitude', 'Not A Column'], data_dir=data_dir)
+
+        assert pa.total_allocated_bytes() == allocated_before
+        assert table.column_names == ['City', 'Longitude']
+
+    def test_history_spans_schema_changes(self, data_dir):
+        """Verify loading the history lines up snapshots with different columns"""
+        history_df = snapshots.loadHistory(
+            columns=['Country Code', 'City', 'Latitude'], data_dir=data_dir)
+
+        assert history_df['Snapshot'].tolist() == ['2015-07-06', '2019-01-01', '2019-01-01']
+        assert history_df['City'].dtype == 'category'
+        assert history_df['Latitude'].tolist()[:2] == [42.26, 56.1367943]
+        assert history_df['Country Code'].isna().tolist() == [True, False, False]